@@ -1,7 +1,8 @@
-import pandas as pd
+import pandas as pd
 import numpy as np
 import logging
 import os
+import sqlite3
 import plotly.graph_objects as go
 from datetime import datetime
 from plotly.offline import plot
@@ -10,10 +11,12 @@ from plotly.offline import plot
 from ai_feature_extractor import AIFeatureExtractor
 from ai_signal_generator import AISignalGenerator
 from sentiment_analyzer import SentimentAnalyzer
+from feature_store import frame_features
 
 class AIEnhancedSignalGenerator:
-    def __init__(self):
+    def __init__(self, db_path='stock_data.db'):
         """Initialize the AI Enhanced Signal Generator"""
+        self.db_path = db_path
         self.feature_extractor = AIFeatureExtractor()
         self.ai_model = AISignalGenerator()
         self.sentiment_analyzer = SentimentAnalyzer()
@@ -25,7 +28,7 @@ class AIEnhancedSignalGenerator:
         
         try:
             # Extract AI features
-            features = self.feature_extractor.extract_features(df)
+            features = self._get_features(df, symbol)
             
             if features is None:
                 logging.warning(f'Failed to extract AI features for {symbol}')
@@ -58,6 +61,17 @@ class AIEnhancedSignalGenerator:
             logging.error(f'Error enhancing signals with AI: {str(e)}')
             return df
     
+    def _get_features(self, df, symbol=None):
+        """Read df's features from the feature store, or extract them from its candles if it lacks them"""
+        features = None
+        try:
+            features = frame_features(df, symbol, self.db_path)
+        except sqlite3.Error as e:
+            logging.warning(f'Could not read stored features: {str(e)}')
+        if features is None:
+            features = self.feature_extractor.extract_features(df)
+        return features
+    
     def add_sentiment_analysis(self, df, symbol):
         """Add sentiment analysis to the dataframe"""
         if df is None:
@@ -97,7 +111,7 @@ class AIEnhancedSignalGenerator:
             
         try:
             # Extract features for parameter optimization
-            features = self.feature_extractor.extract_features(df)
+            features = self._get_features(df)
             
             if features is None:
                 return {
@@ -1,143 +1,211 @@
 import numpy as np
 import pandas as pd
 import logging
+from numpy.lib.stride_tricks import sliding_window_view
+from signal_engine import pack_columns, rolling_mean, rsi
+
+# Feature columns, in matrix order (the volume features are left out when
+# the candles have no volume)
+FEATURE_COLUMNS = (
+    'price_ma_ratio', 'price_volatility', 'volume_ma_ratio', 'volume_price_corr', 'rsi', 'rsi_slope',
+    'bollinger_width', 'bollinger_pos', 'macd_line', 'macd_signal', 'macd_histogram', 'macd_divergence',
+    'momentum_1d', 'momentum_5d', 'momentum_10d'
+)
+VOLUME_FEATURES = ('volume_ma_ratio', 'volume_price_corr')
+
+BOLLINGER_WINDOW = 20
+VOLUME_CORR_WINDOW = 10
+DIVERGENCE_WINDOW = 10
+
+# A standard deviation this small relative to the mean is float noise from a
+# flat window, and is treated as exactly 0
+FLAT_STD_TOLERANCE = 1e-9
+
+# All features work on arrays with time on axis 0: one stock's column, or a
+# dates x stocks block with every stock at once. Windows follow pandas'
+# rolling(window) rules: fewer than `window` values or any NaN gives NaN.
+
+def _windows(values, window):
+    """Trailing windows of every row (rows before the first full window are dropped)"""
+    return sliding_window_view(values, window, axis=0)
+
+def _rolling(values, window, reduce):
+    out = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        out[window - 1:] = reduce(_windows(values, window))
+    return out
+
+def _flat(w):
+    # Windows whose values are all equal (pandas gives those an exact 0 std)
+    return w.max(axis=-1) == w.min(axis=-1)
+
+def rolling_std(values, window):
+    """Column-wise rolling sample standard deviation, like rolling(window).std()"""
+    return _rolling(values, window, lambda w: np.where(_flat(w), 0.0, w.std(axis=-1, ddof=1)))
+
+def rolling_max(values, window):
+    return _rolling(values, window, lambda w: w.max(axis=-1))
+
+def rolling_min(values, window):
+    return _rolling(values, window, lambda w: w.min(axis=-1))
+
+def rolling_corr(x, y, window):
+    """
+    Column-wise rolling Pearson correlation, like x.rolling(window).corr(y),
+    except that a window where either series is flat is NaN (pandas divides
+    by a zero std there and returns +/-inf)
+    """
+    def corr(wx, wy):
+        dx = wx - wx.mean(axis=-1, keepdims=True)
+        dy = wy - wy.mean(axis=-1, keepdims=True)
+        r = (dx * dy).sum(axis=-1) / np.sqrt((dx * dx).sum(axis=-1) * (dy * dy).sum(axis=-1))
+        return np.where(_flat(wx) | _flat(wy), np.nan, r)
+    out = np.full(x.shape, np.nan)
+    if len(x) >= window:
+        out[window - 1:] = corr(_windows(x, window), _windows(y, window))
+    return out
+
+def ema(values, span):
+    """Column-wise ewm(span=span, adjust=False).mean(), starting at each column's first value"""
+    frame = pd.DataFrame(values) if values.ndim == 2 else pd.Series(values)
+    return frame.ewm(span=span, adjust=False).mean().to_numpy()
+
+def shift(values, periods):
+    """Rows moved down by `periods`, NaN above, like Series.shift()"""
+    out = np.full(values.shape, np.nan)
+    if periods < len(values):
+        out[periods:] = values[:len(values) - periods]
+    return out
+
+def macd_divergence(close, macd_line, window=DIVERGENCE_WINDOW):
+    """
+    MACD divergence of every row against the window before it
+
+    -1 (bearish) where the price's rolling high rose but MACD's fell, else +1
+    (bullish) where the price's rolling low fell but MACD's rose, else 0;
+    rows before 2 * window are 0.
+    """
+    price_max, price_min = rolling_max(close, window), rolling_min(close, window)
+    macd_max, macd_min = rolling_max(macd_line, window), rolling_min(macd_line, window)
+    with np.errstate(invalid='ignore'):
+        bearish = (price_max > shift(price_max, window)) & (macd_max < shift(macd_max, window))
+        bullish = (price_min < shift(price_min, window)) & (macd_min > shift(macd_min, window))
+    divergence = np.where(bearish, -1.0, np.where(bullish, 1.0, 0.0))
+    divergence[:window * 2] = 0.0
+    return divergence
+
+def feature_columns(has_volume=True):
+    """Feature column names in matrix order"""
+    return [name for name in FEATURE_COLUMNS if has_volume or name not in VOLUME_FEATURES]
+
+def feature_matrix(close, sma, rsi_values, volume=None):
+    """
+    Model features of every candle
+
+    Args:
+        close, sma, rsi_values: Close, SMA-50 and RSI arrays (time on axis 0;
+            one stock, or dates x stocks)
+        volume: Volume array shaped like close, or None to leave out the volume features
+
+    Returns:
+        C-contiguous float32 array shaped close.shape + (number of features,),
+        columns in FEATURE_COLUMNS order; NaN (not yet defined) is 0
+    """
+    columns = feature_columns(volume is not None)
+    close = np.asarray(close, dtype=np.float64)
+    rsi_values = np.asarray(rsi_values, dtype=np.float64)
+    out = np.empty(close.shape + (len(columns),), dtype=np.float32)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Each rolling primitive once; volatility and both Bollinger features share them
+        mean_20 = rolling_mean(close, BOLLINGER_WINDOW)
+        std_20 = rolling_std(close, BOLLINGER_WINDOW)
+        std_20 = np.where(std_20 <= FLAT_STD_TOLERANCE * np.abs(mean_20), 0.0, std_20)
+        lower_band = mean_20 - 2 * std_20
+        band_width = 4 * std_20
+
+        ema_fast, ema_slow = ema(close, 12), ema(close, 26)
+        macd_line = ema_fast - ema_slow
+        macd_signal = ema(macd_line, 9)
+
+        features = {
+            'price_ma_ratio': close / np.asarray(sma, dtype=np.float64),
+            'price_volatility': std_20 / mean_20,
+            'rsi': rsi_values,
+            'rsi_slope': rsi_values - shift(rsi_values, 5),
+            'bollinger_width': band_width / mean_20,
+            # Position from 0 (at or below the lower band) to 1 (at or above the upper band);
+            # undefined (0) for a flat window, whose bands have no width. The running
+            # mean's rounding error must not be divided by that 0 width
+            'bollinger_pos': np.where(band_width > 0, np.clip((close - lower_band) / band_width, 0, 1), np.nan),
+            'macd_line': macd_line,
+            'macd_signal': macd_signal,
+            'macd_histogram': macd_line - macd_signal,
+            'macd_divergence': macd_divergence(close, macd_line),
+            'momentum_1d': close / shift(close, 1) - 1,
+            'momentum_5d': close / shift(close, 5) - 1,
+            'momentum_10d': close / shift(close, 10) - 1,
+        }
+        if volume is not None:
+            volume = np.asarray(volume, dtype=np.float64)
+            features['volume_ma_ratio'] = volume / rolling_mean(volume, BOLLINGER_WINDOW)
+            features['volume_price_corr'] = rolling_corr(volume, close, VOLUME_CORR_WINDOW)
+
+    for k, name in enumerate(columns):
+        values = features[name]
+        out[..., k] = np.where(np.isnan(values), 0.0, values)
+    return out
+
+def panel_features(panel, sma_period=50, rsi_period=14):
+    """
+    Features of every stock in a panel in one pass
+
+    Each stock's candles are packed to the bottom of its column first (see
+    signal_engine.pack_columns), so the windows see the same candles as
+    extract_features() on the stock's own frame.
+
+    Returns:
+        (mask, features): the packed dates x stocks candle mask, and a float32
+        dates x stocks x features array in that packed layout; stock j's
+        feature matrix is features[mask[:, j], j]
+    """
+    mask, (close, volume) = pack_columns(panel.mask, panel.close, panel.volume)
+    sma = rolling_mean(close, sma_period)
+    return mask, feature_matrix(close, sma, rsi(close, rsi_period), volume)
 
 class AIFeatureExtractor:
     def __init__(self):
         """Initialize the AI Feature Extractor"""
         pass
-        
-    def extract_features(self, df):
-        """Extract features for ML models"""
+
+    def extract_feature_matrix(self, df):
+        """
+        Extract features for ML models as a float32 matrix
+
+        Returns:
+            (matrix, columns): one row per candle of df, or None if df has
+            fewer than 50 candles
+        """
         if df is None or len(df) < 50:  # Require minimum amount of data
             return None
-            
-        features = pd.DataFrame(index=df.index)
-        
+
+        has_volume = 'volume' in df.columns
+        matrix = feature_matrix(
+            df['close'].to_numpy(dtype=np.float64),
+            df['SMA_50'].to_numpy(dtype=np.float64),
+            df['RSI'].to_numpy(dtype=np.float64),
+            df['volume'].to_numpy(dtype=np.float64) if has_volume else None
+        )
+        return matrix, feature_columns(has_volume)
+
+    def extract_features(self, df):
+        """Extract features for ML models (DataFrame over the float32 feature matrix)"""
         try:
-            # Price-based features
-            features['price_ma_ratio'] = df['close'] / df['SMA_50']
-            features['price_volatility'] = df['close'].rolling(20).std() / df['close'].rolling(20).mean()
-            
-            # Volume features
-            if 'volume' in df.columns:
-                features['volume_ma_ratio'] = df['volume'] / df['volume'].rolling(20).mean()
-                features['volume_price_corr'] = df['volume'].rolling(10).corr(df['close'])
-            
-            # Technical indicators features
-            features['rsi'] = df['RSI']
-            features['rsi_slope'] = df['RSI'].diff(5)
-            
-            # Add Bollinger Bands
-            bollinger_window = 20
-            features['bollinger_width'] = self._calculate_bollinger_width(df, bollinger_window)
-            features['bollinger_pos'] = self._calculate_bollinger_position(df, bollinger_window)
-            
-            # Add MACD features
-            features = self._add_macd_features(features, df)
-            
-            # Add momentum features
-            features['momentum_1d'] = df['close'].pct_change(1)
-            features['momentum_5d'] = df['close'].pct_change(5)
-            features['momentum_10d'] = df['close'].pct_change(10)
-            
-            # Fill any NaN values
-            features = features.fillna(0)
-            
-            return features
+            result = self.extract_feature_matrix(df)
+            if result is None:
+                return None
+            matrix, columns = result
+            return pd.DataFrame(matrix, index=df.index, columns=columns, copy=False)
         except Exception as e:
             logging.error(f"Error extracting features: {str(e)}")
             return None
-
-    def _calculate_bollinger_width(self, df, window=20):
-        """Calculate Bollinger Band width"""
-        try:
-            std = df['close'].rolling(window).std()
-            middle_band = df['close'].rolling(window).mean()
-            upper_band = middle_band + 2 * std
-            lower_band = middle_band - 2 * std
-            return (upper_band - lower_band) / middle_band
-        except Exception as e:
-            logging.error(f"Error calculating Bollinger width: {str(e)}")
-            return pd.Series(0, index=df.index)
-        
-    def _calculate_bollinger_position(self, df, window=20):
-        """Calculate price position within Bollinger Bands (0 to 1)"""
-        try:
-            std = df['close'].rolling(window).std()
-            middle_band = df['close'].rolling(window).mean()
-            upper_band = middle_band + 2 * std
-            lower_band = middle_band - 2 * std
-            
-            # Position from 0 (at or below lower band) to 1 (at or above upper band)
-            position = (df['close'] - lower_band) / (upper_band - lower_band)
-            return position.clip(0, 1)  # Limit to 0-1 range
-        except Exception as e:
-            logging.error(f"Error calculating Bollinger position: {str(e)}")
-            return pd.Series(0.5, index=df.index)
-        
-    def _add_macd_features(self, features, df):
-        """Add MACD indicator features"""
-        try:
-            # MACD Line = 12-period EMA - 26-period EMA
-            ema12 = df['close'].ewm(span=12, adjust=False).mean()
-            ema26 = df['close'].ewm(span=26, adjust=False).mean()
-            macd_line = ema12 - ema26
-            
-            # Signal Line = 9-period EMA of MACD Line
-            signal_line = macd_line.ewm(span=9, adjust=False).mean()
-            
-            # MACD Histogram = MACD Line - Signal Line
-            macd_histogram = macd_line - signal_line
-            
-            features['macd_line'] = macd_line
-            features['macd_signal'] = signal_line
-            features['macd_histogram'] = macd_histogram
-            features['macd_divergence'] = self._calculate_macd_divergence(df, macd_line)
-            
-            return features
-        except Exception as e:
-            logging.error(f"Error adding MACD features: {str(e)}")
-            return features
-        
-    def _calculate_macd_divergence(self, df, macd_line, window=10):
-        """Calculate MACD divergence (bullish/bearish)"""
-        # Calculate if price is making higher highs but MACD is making lower highs (bearish)
-        # or if price is making lower lows but MACD is making higher lows (bullish)
-        try:
-            price_max = df['close'].rolling(window=window).max()
-            price_min = df['close'].rolling(window=window).min()
-            
-            macd_max = macd_line.rolling(window=window).max()
-            macd_min = macd_line.rolling(window=window).min()
-            
-            # Higher price but lower MACD (bearish divergence): -1
-            # Lower price but higher MACD (bullish divergence): +1
-            divergence = pd.Series(0, index=df.index)
-            
-            # Compare current with previous window
-            for i in range(window*2, len(df)):
-                prev_price_max = price_max.iloc[i-window]
-                curr_price_max = price_max.iloc[i]
-                
-                prev_macd_max = macd_max.iloc[i-window]
-                curr_macd_max = macd_max.iloc[i]
-                
-                prev_price_min = price_min.iloc[i-window]
-                curr_price_min = price_min.iloc[i]
-                
-                prev_macd_min = macd_min.iloc[i-window]
-                curr_macd_min = macd_min.iloc[i]
-                
-                # Bearish divergence
-                if curr_price_max > prev_price_max and curr_macd_max < prev_macd_max:
-                    divergence.iloc[i] = -1
-                    
-                # Bullish divergence
-                elif curr_price_min < prev_price_min and curr_macd_min > prev_macd_min:
-                    divergence.iloc[i] = 1
-                    
-            return divergence
-        except Exception as e:
-            logging.error(f"Error calculating MACD divergence: {str(e)}")
-            return pd.Series(0, index=df.index)
\ No newline at end of file
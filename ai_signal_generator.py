@@ -9,6 +9,10 @@ import sqlite3
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from db_connection import connect_read_write
+from ohlcv_cache import get_cache
+from panel_loader import load_panel
+from instrument_registry import get_registry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,7 +30,7 @@ class AISignalGenerator:
     def connect_db(self):
         """Connect to the SQLite database."""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = connect_read_write(self.db_path)
             logging.info(f"Connected to database: {self.db_path}")
             return True
         except sqlite3.Error as e:
@@ -105,6 +109,11 @@ class AISignalGenerator:
             start_date = end_date - timedelta(days=days)
             start_date_str = start_date.strftime("%Y-%m-%d")
             
+            # Serve from the memory-mapped OHLCV cache when it is up to date
+            df = self._get_cached_historical_data(symbol, start_date_str)
+            if df is not None:
+                return df
+            
             # SQL query to get historical data
             query = """
                 SELECT h.date, h.open, h.high, h.low, h.close, h.volume
@@ -132,18 +141,55 @@ class AISignalGenerator:
             logging.error(f"Database error getting historical data for {symbol}: {e}")
             return None
     
-    def generate_signals(self, symbol):
+    def _get_cached_historical_data(self, symbol, start_date_str):
+        """Read a stock's candles from the OHLCV cache, or return None if the cache can't serve them"""
+        cache = get_cache(self.db_path)
+        if not cache.is_fresh(self.conn):
+            return None
+            
+        stocks = get_registry(self.db_path).get_all_by_symbol(symbol)
+        if len(stocks) != 1:
+            return None
+            
+        df = cache.get_frame(stocks[0].stock_id, from_date=start_date_str)
+        if df is None or len(df) == 0:
+            return None
+            
+        df = df.drop(columns=['timestamp'])
+        df['date'] = pd.to_datetime(df['date'])
+        df.set_index('date', inplace=True)
+        return df
+    
+    def _get_panel_historical_data(self, panel, symbol):
+        """Take one stock's frame from a loaded panel, or return None to fall back to get_historical_data"""
+        if panel is None:
+            return None
+        col = panel.symbol_column(symbol)
+        if col is None:
+            return None
+        df = panel.frame(panel.stock_ids[col])
+        if len(df) == 0:
+            return None
+            
+        df = df.drop(columns=['timestamp'])
+        df['date'] = pd.to_datetime(df['date'])
+        df.set_index('date', inplace=True)
+        return df
+    
+    def generate_signals(self, symbol, df=None):
         """
         Generate AI-enhanced signals for a specific stock.
         
         Args:
             symbol (str): The stock symbol
+            df (pd.DataFrame): Already loaded historical data (optional)
             
         Returns:
             dict: Dictionary containing signals and scores
         """
         # Get historical data
-        df = self.get_historical_data(symbol)
+        if df is None:
+            df = self.get_historical_data(symbol)
         if df is None or len(df) < 30:
             logging.warning(f"Insufficient data for {symbol}, need at least 30 data points")
             return None
@@ -220,14 +266,10 @@ class AISignalGenerator:
             cursor = self.conn.cursor()
             
             # Get stock_id for the symbol
-            cursor.execute("SELECT id FROM stocks WHERE symbol = ?", (signal_data.get('symbol'),))
-            result = cursor.fetchone()
-            
-            if not result:
+            stock_id = get_registry(self.db_path).get_stock_id(signal_data.get('symbol'))
+            if stock_id is None:
                 logging.warning(f"Stock not found for symbol: {signal_data.get('symbol')}")
                 return False
-                
-            stock_id = result[0]
             
             # Check if this signal already exists for this date
             cursor.execute(
@@ -316,9 +358,12 @@ class AISignalGenerator:
                 cursor.execute("SELECT symbol FROM stocks")
                 symbols = [row[0] for row in cursor.fetchall()]
                 
+            # Load every stock's prices in one pass instead of one query per symbol
+            panel = load_panel(self.conn, symbols=symbols, days=100, db_path=self.db_path)
+                
             results = []
             for symbol in symbols:
-                signals = self.generate_signals(symbol)
+                signals = self.generate_signals(symbol, df=self._get_panel_historical_data(panel, symbol))
                 if signals:
                     results.append(signals)
                     
@@ -6,9 +6,11 @@ import logging
 import os
 from datetime import datetime, timedelta
 import json
-import requests
 from pathlib import Path
 import dotenv
+from db_connection import connect_read_only
+from instrument_registry import get_registry
+from dhan_transport import get_transport
 
 # Set up logging
 logging.basicConfig(
@@ -236,7 +238,7 @@ class AutoOrderPlacer:
     def connect_db(self):
         """Connect to the SQLite database"""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = connect_read_only(self.db_path)
             logging.info(f"Connected to database: {self.db_path}")
             return True
         except sqlite3.Error as e:
@@ -473,165 +475,74 @@ class AutoOrderPlacer:
             logging.info(f"Stop loss: {order_params['stop_loss']}")
             logging.info(f"Target: {order_params['target']}")
             
-            # Use the direct http.client approach as in the working example
-            try:
-                import http.client
-                
-                logging.info("Using direct HTTP client implementation")
-                conn = http.client.HTTPSConnection("api.dhan.co")
-                
-                # Format the payload exactly as in the working example
-                payload_dict = {
-                    "dhanClientId": dhan_client_id,
-                    "correlationId": correlation_id,
-                    "transactionType": "BUY",
-                    "exchangeSegment": self.get_dhan_exchange_segment(order_params['symbol']),
-                    "productType": self.config.get('dhan_product_type', 'CNC'),
-                    "orderType": order_params['order_type'],
-                    "securityId": security_id,
-                    "quantity": order_params['position_size'],
-                    "price": price,
-                    "targetPrice": str(order_params['target']),
-                    "stopLossPrice": str(order_params['stop_loss']),
-                    "trailingJump": trailing_jump
-                }
-                
-                # Remove None values from payload
-                payload_dict = {k: v for k, v in payload_dict.items() if v is not None}
-                
-                payload = json.dumps(payload_dict)
-                logging.info(f"Payload prepared: {payload}")
+            # Format the payload exactly as in the working example
+            payload = {
+                "dhanClientId": dhan_client_id,
+                "correlationId": correlation_id,
+                "transactionType": "BUY",
+                "exchangeSegment": self.get_dhan_exchange_segment(order_params['symbol']),
+                "productType": self.config.get('dhan_product_type', 'CNC'),
+                "orderType": order_params['order_type'],
+                "securityId": security_id,
+                "quantity": order_params['position_size'],
+                "price": price,
+                "targetPrice": str(order_params['target']),
+                "stopLossPrice": str(order_params['stop_loss']),
+                "trailingJump": trailing_jump
+            }
+            
+            # Remove None values from payload
+            payload = {k: v for k, v in payload.items() if v is not None}
+            
+            logging.info(f"Dhan Super Order payload: {json.dumps(payload)}")
+            
+            # Sent once over the pooled connection: order requests are never resent
+            # once they may have reached Dhan, so a failure here can't double an order
+            response = get_transport(access_token, api_url).post(
+                "/super/orders", family='order', json=payload
+            )
+            
+            # Log full response for debugging
+            logging.info(f"Dhan API response status: {response.status_code}")
+            logging.info(f"Dhan API response body: {response.text}")
+            
+            # Check if the request was successful
+            if response.status_code == 200:
+                response_data = response.json()
+                logging.info(f"Dhan Super Order placed successfully: {response_data}")
                 
-                headers = {
-                    'Content-Type': 'application/json',
-                    'access-token': access_token
+                # Prepare order record
+                order = {
+                    'symbol': order_params['symbol'],
+                    'quantity': order_params['position_size'],
+                    'price': order_params['current_price'] if order_params['order_type'] == 'MARKET' else order_params['limit_price'],
+                    'order_type': order_params['order_type'],
+                    'stop_loss': order_params['stop_loss'],
+                    'target': order_params['target'],
+                    'status': 'open',
+                    'timestamp': datetime.now().isoformat(),
+                    'broker': 'dhan',
+                    'order_id': response_data.get('orderId'),
+                    'security_id': security_id,
+                    'trailing_jump': trailing_jump
                 }
                 
-                logging.info("Making direct HTTP request to Dhan API")
-                conn.request("POST", "/v2/super/orders", payload, headers)
-                res = conn.getresponse()
-                data = res.read()
-                response_text = data.decode("utf-8")
-                
-                logging.info(f"Response status: {res.status}")
-                logging.info(f"Response body: {response_text}")
-                
-                if res.status == 200:
-                    response_data = json.loads(response_text)
-                    logging.info(f"Dhan Super Order placed successfully: {response_data}")
-                    
-                    # Prepare order record
-                    order = {
-                        'symbol': order_params['symbol'],
-                        'quantity': order_params['position_size'],
-                        'price': order_params['current_price'] if order_params['order_type'] == 'MARKET' else order_params['limit_price'],
-                        'order_type': order_params['order_type'],
-                        'stop_loss': order_params['stop_loss'],
-                        'target': order_params['target'],
-                        'status': 'open',
-                        'timestamp': datetime.now().isoformat(),
-                        'broker': 'dhan',
-                        'order_id': response_data.get('orderId'),
-                        'security_id': security_id,
-                        'trailing_jump': trailing_jump
-                    }
-                    
-                    # Add to order history
-                    self.order_history['orders'].append(order)
-                    self.save_order_history()
-                    
-                    return {
-                        'success': True,
-                        'order_id': response_data.get('orderId'),
-                        'message': "Dhan Super Order placed successfully"
-                    }
-                else:
-                    logging.error(f"Failed to place Dhan Super Order: {response_text}")
-                    return {
-                        'success': False,
-                        'status_code': res.status,
-                        'message': f"Failed to place Dhan Super Order: {response_text}"
-                    }
-            except Exception as req_error:
-                logging.error(f"HTTP client error: {req_error}", exc_info=True)
-                
-                # Fall back to requests library method if http.client fails
-                logging.info("Falling back to requests library method")
+                # Add to order history
+                self.order_history['orders'].append(order)
+                self.save_order_history()
                 
-                # Set up the headers
-                headers = {
-                    'Content-Type': 'application/json',
-                    'access-token': access_token
+                return {
+                    'success': True,
+                    'order_id': response_data.get('orderId'),
+                    'message': "Dhan Super Order placed successfully"
                 }
-                
-                # Prepare the super order request
-                super_order_endpoint = f"{api_url}/super/orders"
-                
-                # Prepare the payload
-                payload = {
-                    'dhanClientId': dhan_client_id,
-                    'correlationId': correlation_id,
-                    'transactionType': 'BUY',
-                    'exchangeSegment': self.get_dhan_exchange_segment(order_params['symbol']),
-                    'productType': self.config.get('dhan_product_type', 'CNC'),
-                    'orderType': order_params['order_type'],
-                    'securityId': security_id,
-                    'quantity': order_params['position_size'],
-                    'price': str(price) if price else None,
-                    'targetPrice': str(order_params['target']),
-                    'stopLossPrice': str(order_params['stop_loss']),
-                    'trailingJump': trailing_jump
+            else:
+                logging.error(f"Failed to place Dhan Super Order: {response.text}")
+                return {
+                    'success': False,
+                    'status_code': response.status_code,
+                    'message': f"Failed to place Dhan Super Order: {response.text}"
                 }
-                
-                # Remove None values from payload
-                payload = {k: v for k, v in payload.items() if v is not None}
-                
-                logging.info(f"Dhan Super Order payload: {json.dumps(payload)}")
-                
-                # Make the API request using requests library
-                response = requests.post(super_order_endpoint, headers=headers, json=payload)
-                
-                # Log full response for debugging
-                logging.info(f"Dhan API response status: {response.status_code}")
-                logging.info(f"Dhan API response body: {response.text}")
-                
-                # Check if the request was successful
-                if response.status_code == 200:
-                    response_data = response.json()
-                    logging.info(f"Dhan Super Order placed successfully: {response_data}")
-                    
-                    # Prepare order record
-                    order = {
-                        'symbol': order_params['symbol'],
-                        'quantity': order_params['position_size'],
-                        'price': order_params['current_price'] if order_params['order_type'] == 'MARKET' else order_params['limit_price'],
-                        'order_type': order_params['order_type'],
-                        'stop_loss': order_params['stop_loss'],
-                        'target': order_params['target'],
-                        'status': 'open',
-                        'timestamp': datetime.now().isoformat(),
-                        'broker': 'dhan',
-                        'order_id': response_data.get('orderId'),
-                        'security_id': security_id,
-                        'trailing_jump': trailing_jump
-                    }
-                    
-                    # Add to order history
-                    self.order_history['orders'].append(order)
-                    self.save_order_history()
-                    
-                    return {
-                        'success': True,
-                        'order_id': response_data.get('orderId'),
-                        'message': "Dhan Super Order placed successfully"
-                    }
-                else:
-                    logging.error(f"Failed to place Dhan Super Order: {response.text}")
-                    return {
-                        'success': False,
-                        'status_code': response.status_code,
-                        'message': f"Failed to place Dhan Super Order: {response.text}"
-                    }
         
         except Exception as e:
             logging.error(f"Error placing Dhan Super Order: {e}", exc_info=True)
@@ -651,10 +562,11 @@ class AutoOrderPlacer:
                 return ''
             return re.sub(r'[^A-Z0-9]', '', str(s).upper())
         try:
-            cursor = self.conn.cursor()
-            # Fetch all symbols and names with their security IDs
-            cursor.execute("SELECT symbol, name, security_id FROM stocks")
-            rows = cursor.fetchall()
+            # All symbols and names with their security IDs, from the instrument registry
+            rows = [
+                (instrument.symbol, instrument.name, instrument.security_id)
+                for instrument in get_registry(self.db_path).instruments()
+            ]
             norm_input = normalize(symbol_or_name)
             # Try direct symbol match
             for symbol, name, secid in rows:
@@ -782,13 +694,7 @@ class AutoOrderPlacer:
                 return {'success': False, 'message': "Dhan credentials not configured"}
             
             # Prepare the modify order request
-            modify_endpoint = f"{api_url}/super/orders/{order_id}"
-            
-            # Set up the headers
-            headers = {
-                'Content-Type': 'application/json',
-                'access-token': access_token
-            }
+            modify_endpoint = f"/super/orders/{order_id}"
             
             # Prepare the payload
             payload = {
@@ -809,7 +715,7 @@ class AutoOrderPlacer:
             logging.info(f"Dhan Modify Order payload: {json.dumps(payload)}")
             
             # Make the API request
-            response = requests.put(modify_endpoint, headers=headers, json=payload)
+            response = get_transport(access_token, api_url).put(modify_endpoint, family='order', json=payload)
             
             # Check if the request was successful
             if response.status_code == 200:
@@ -875,16 +781,10 @@ class AutoOrderPlacer:
                 return {'success': False, 'message': "Dhan credentials not configured"}
             
             # Prepare the cancel order request
-            cancel_endpoint = f"{api_url}/super/orders/{order_id}/{leg_name}"
-            
-            # Set up the headers
-            headers = {
-                'Content-Type': 'application/json',
-                'access-token': access_token
-            }
+            cancel_endpoint = f"/super/orders/{order_id}/{leg_name}"
             
             # Make the API request (DELETE method)
-            response = requests.delete(cancel_endpoint, headers=headers)
+            response = get_transport(access_token, api_url).delete(cancel_endpoint, family='order')
             
             # Check if the request was successful
             if response.status_code == 200:
@@ -935,13 +835,7 @@ class AutoOrderPlacer:
                 return {'success': False, 'message': "Dhan credentials not configured"}
             
             # Prepare the request
-            orders_endpoint = f"{api_url}/super/orders"
-            
-            # Set up the headers
-            headers = {
-                'Content-Type': 'application/json',
-                'access-token': access_token
-            }
+            orders_endpoint = "/super/orders"
             
             # Set up params (dhanClientId is required)
             params = {
@@ -949,7 +843,9 @@ class AutoOrderPlacer:
             }
             
             # Make the API request
-            response = requests.get(orders_endpoint, headers=headers, params=params)
+            response = get_transport(access_token, api_url).get(
+                orders_endpoint, family='non_trading', params=params
+            )
             
             # Check if the request was successful
             if response.status_code == 200:
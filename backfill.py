@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Checkpointed, resumable history backfill.
+
+A backfill job is a named set of units, one per (stock, date range), stored in
+the backfill_checkpoints table. prepare() registers the units of a new job, or
+fits them into an unfinished one (only the days it doesn't cover yet), and
+returns the pending units; run() fetches them.
+
+Units are marked done inside the same write transaction that commits their
+candles, so after a crash, network drop, token expiry or Ctrl-C the next run of
+the same job fetches only the units that are still pending. Progress and an ETA
+are logged while the job runs. A job whose units keep failing stays unfinished
+(and keeps resuming) until it is reset.
+
+Usage:
+    python backfill.py --status            # progress of every backfill job
+    python backfill.py --reset main_history   # forget a job's checkpoints
+    python backfill.py --years 10          # backfill 10 years for every stock
+"""
+
+import sys
+import time
+import logging
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+from db_connection import connect_read_only
+from db_handler import DatabaseHandler
+from ingest_pipeline import IngestPipeline
+from ohlcv_cache import date_to_day, days_to_dates
+from update_planner import FetchTask, plan_updates
+
+# Seconds between progress / ETA log lines
+PROGRESS_INTERVAL = 30
+
+def _uncovered(start, stop, spans):
+    """(start, stop) day ranges of start..stop that none of the sorted (start, stop) spans covers"""
+    parts = []
+    for span_start, span_stop in spans:
+        if span_stop < start:
+            continue
+        if span_start > stop:
+            break
+        if span_start > start:
+            parts.append((start, span_start - 1))
+        start = max(start, span_stop + 1)
+        if start > stop:
+            break
+    if start <= stop:
+        parts.append((start, stop))
+    return parts
+
+class BackfillJob:
+    def __init__(self, name, db_path='stock_data.db'):
+        """
+        A named, resumable backfill
+
+        Args:
+            name: Job name; a later run with the same name resumes the job
+            db_path: Database holding the history and the checkpoints
+        """
+        self.name = name
+        self.db_path = db_path
+        self.total = 0
+        self.done = 0
+        self.done_this_run = 0
+        self.rows = 0
+        self.started = None
+        self._unit_rows = {}
+
+    def prepare(self, db, units):
+        """
+        Register the job's units, adding them to the pending units of an unfinished run
+
+        Args:
+            db: Connected DatabaseHandler
+            units: FetchTask units the job should cover
+
+        Returns:
+            list of FetchTask units that still have to be fetched
+        """
+        try:
+            insert_sql = '''
+                INSERT OR IGNORE INTO backfill_checkpoints (job, stock_id, from_date, to_date)
+                VALUES (?, ?, ?, ?)
+            '''
+            db.cursor.execute(
+                "SELECT stock_id, from_date, to_date, status FROM backfill_checkpoints WHERE job = ?", (self.name,)
+            )
+            stored = {
+                (stock_id, from_date): (to_date, status)
+                for stock_id, from_date, to_date, status in db.cursor.fetchall()
+            }
+            done = sum(1 for _, status in stored.values() if status == 'done')
+
+            if stored and done < len(stored):
+                # The requested units join the unfinished job, trimmed to the days
+                # it doesn't cover yet; its pending units are still fetched
+                requested = {(unit.stock_id, unit.from_date): unit.to_date for unit in units}
+                added, dropped = self._merge_units(db, stored, units)
+                if requested and requested != {key: to_date for key, (to_date, _) in stored.items()}:
+                    logging.warning(
+                        f"Backfill '{self.name}' has unfinished units that differ from the requested ones: "
+                        f"adding {len(added)} units and replacing {len(dropped)} of its {len(stored)} "
+                        f"stored units ({len(stored) - done} pending)"
+                    )
+                db.cursor.executemany(
+                    "DELETE FROM backfill_checkpoints WHERE job = ? AND stock_id = ? AND from_date = ?",
+                    [(self.name, stock_id, from_date) for stock_id, from_date in dropped]
+                )
+                db.cursor.executemany(
+                    insert_sql, [(self.name, unit.stock_id, unit.from_date, unit.to_date) for unit in added]
+                )
+                db.conn.commit()
+                logging.info(f"Resuming backfill '{self.name}': {done} of {len(stored)} units already done")
+            else:
+                # New job, or the previous run finished: start a new one
+                db.cursor.execute("DELETE FROM backfill_checkpoints WHERE job = ?", (self.name,))
+                db.cursor.executemany(
+                    insert_sql, [(self.name, unit.stock_id, unit.from_date, unit.to_date) for unit in units]
+                )
+                db.conn.commit()
+                logging.info(f"Started backfill '{self.name}' with {len(units)} units")
+
+            # Pending units, with the stock details needed to fetch them
+            db.cursor.execute('''
+                SELECT c.stock_id, s.security_id, s.exchange_segment, s.symbol, s.instrument,
+                       c.from_date, c.to_date
+                FROM backfill_checkpoints c
+                JOIN stocks s ON s.id = c.stock_id
+                WHERE c.job = ? AND c.status = 'pending'
+                ORDER BY c.stock_id, c.from_date
+            ''', (self.name,))
+            pending = [FetchTask(*row) for row in db.cursor.fetchall()]
+
+            db.cursor.execute(
+                "SELECT COUNT(*), SUM(status = 'done'), SUM(rows) FROM backfill_checkpoints WHERE job = ?",
+                (self.name,)
+            )
+            self.total, done, rows = db.cursor.fetchone()
+            self.done = done or 0
+            self.rows = rows or 0
+            return pending
+        except sqlite3.Error as e:
+            logging.error(f"Error preparing backfill '{self.name}': {e}")
+            db.conn.rollback()
+            return []
+
+    def _merge_units(self, db, stored, units):
+        """
+        Fit the requested units into an unfinished job
+
+        A pending unit is replaced by a requested unit of the same stock that
+        covers the days of it still requested. Of the other requested units only
+        the days no stored unit covers are added, and the new days of a stock
+        with done units start after its last stored candle (its watermark, as
+        planned by update_planner.plan_updates), so a run resumed the next day
+        fetches the unfinished stocks and one day of the others.
+
+        Args:
+            db: Connected DatabaseHandler
+            stored: {(stock_id, from_date): (to_date, status)} of the job
+            units: Requested FetchTask units
+
+        Returns:
+            (added, dropped): FetchTask units to add, and the (stock_id, from_date)
+            keys of the pending units they replace
+        """
+        spans_by_stock = {}
+        for (stock_id, from_date), (to_date, status) in stored.items():
+            spans_by_stock.setdefault(stock_id, {})[from_date] = (date_to_day(from_date), date_to_day(to_date), status)
+        units_by_stock = {}
+        for unit in units:
+            units_by_stock.setdefault(unit.stock_id, []).append(
+                (unit, date_to_day(unit.from_date), date_to_day(unit.to_date))
+            )
+
+        added, dropped = [], []
+        tails = {}
+        for stock_id, wanted in units_by_stock.items():
+            spans = spans_by_stock.get(stock_id)
+            if not spans:
+                added += [unit for unit, _, _ in wanted]
+                continue
+            first = min(start for _, start, _ in wanted)
+            last = max(stop for _, _, stop in wanted)
+
+            replacing = set()
+            for from_date, (start, stop, status) in list(spans.items()):
+                if status != 'pending':
+                    continue
+                start, stop = max(start, first), min(stop, last)
+                cover = next((unit for unit, unit_start, unit_stop in wanted
+                              if unit_start <= start and stop <= unit_stop
+                              and unit.from_date not in spans and unit.from_date != from_date), None)
+                if start > stop or cover is not None:
+                    # No longer requested, or replaced by a unit covering its days
+                    dropped.append((stock_id, from_date))
+                    del spans[from_date]
+                    if cover is not None:
+                        replacing.add(cover.from_date)
+
+            has_done = any(status == 'done' for _, _, status in spans.values())
+            covered = sorted((start, stop) for start, stop, _ in spans.values())
+            covered_to = max((stop for _, stop in covered), default=None)
+            for unit, unit_start, unit_stop in wanted:
+                if unit.from_date in replacing:
+                    added.append(unit)
+                    continue
+                if unit.from_date in spans:
+                    continue
+                for start, stop in _uncovered(unit_start, unit_stop, covered):
+                    if has_done and covered_to is not None and start > covered_to:
+                        # New days after the stored ones: plan them from the watermark
+                        if stock_id in tails:
+                            start, stop = min(start, tails[stock_id][1]), max(stop, tails[stock_id][2])
+                        tails[stock_id] = (unit, start, stop)
+                    else:
+                        added.append(unit._replace(from_date=str(days_to_dates([start])[0]),
+                                                   to_date=str(days_to_dates([stop])[0])))
+
+        by_end = {}
+        for unit, start, stop in tails.values():
+            by_end.setdefault(stop, []).append((unit, start))
+        for stop, group in by_end.items():
+            first_day = {unit.stock_id: start for unit, start in group}
+            planned, _ = plan_updates(db.conn, [tuple(unit[:5]) for unit, _ in group],
+                                      end_date=str(days_to_dates([stop])[0]))
+            for task in planned:
+                start = max(date_to_day(task.from_date), first_day[task.stock_id])
+                if start <= date_to_day(task.to_date):
+                    added.append(task._replace(from_date=str(days_to_dates([start])[0])))
+        return added, dropped
+
+    def mark_done(self, db, units, stats):
+        """
+        Record units whose candles were written; IngestPipeline calls this inside
+        the write transaction, so checkpoints and candles commit together
+        """
+        completed = datetime.now().isoformat()
+        # Several windows of one stock can share a batch; stats are per stock, so
+        # split its candles between them instead of crediting each with the total
+        units_per_stock = {}
+        for unit in units:
+            units_per_stock[unit.stock_id] = units_per_stock.get(unit.stock_id, 0) + 1
+        rows = []
+        credited = set()
+        for unit in units:
+            stock_stats = stats.get(unit.stock_id)
+            if stock_stats is None:
+                continue
+            total = sum(stock_stats.values())
+            share = total // units_per_stock[unit.stock_id]
+            if unit.stock_id not in credited:
+                share += total % units_per_stock[unit.stock_id]
+                credited.add(unit.stock_id)
+            self._unit_rows[(unit.stock_id, unit.from_date)] = share
+            rows.append((share, completed, self.name, unit.stock_id, unit.from_date))
+        db.cursor.executemany('''
+            UPDATE backfill_checkpoints SET status = 'done', rows = ?, completed = ?
+            WHERE job = ? AND stock_id = ? AND from_date = ?
+        ''', rows)
+
+    def progress(self):
+        """
+        Progress of the job
+
+        Returns:
+            dict with total, done and remaining units, candles written, the unit
+            rate of this run and the estimated seconds to completion (None until known)
+        """
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        rate = self.done_this_run / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done
+        return {
+            'total': self.total,
+            'done': self.done,
+            'remaining': remaining,
+            'rows': self.rows,
+            'rate': rate,
+            'eta': remaining / rate if rate > 0 else None,
+        }
+
+    def log_progress(self):
+        progress = self.progress()
+        percent = 100.0 * progress['done'] / progress['total'] if progress['total'] else 100.0
+        eta = f"{progress['eta'] / 60:.1f} min" if progress['eta'] is not None else "unknown"
+        logging.info(
+            f"Backfill '{self.name}': {progress['done']}/{progress['total']} units ({percent:.1f}%), "
+            f"{progress['rows']} candles, {progress['rate']:.2f} units/s, ETA {eta}"
+        )
+
+    def run(self, pending, fetch, **pipeline_options):
+        """
+        Fetch and store the pending units returned by prepare()
+
+        Args:
+            pending: FetchTask units to fetch
+            fetch: Function called with one FetchTask in a fetch worker; returns the API response
+            **pipeline_options: Passed to IngestPipeline (fetch_workers, batch_size, ...)
+
+        Returns:
+            Generator of (unit, stats) pairs as units complete; stats is None if the
+            unit failed and will be retried by the next run
+        """
+        self.started = time.monotonic()
+        self.done_this_run = 0
+        if not pending:
+            self.log_progress()
+            return
+
+        pipeline = IngestPipeline(fetch, self.db_path, before_commit=self.mark_done, **pipeline_options)
+        last_report = time.monotonic()
+        for unit, stats in pipeline.run(pending):
+            if stats is not None:
+                self.done += 1
+                self.done_this_run += 1
+                self.rows += self._unit_rows.pop((unit.stock_id, unit.from_date), sum(stats.values()))
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                self.log_progress()
+                last_report = time.monotonic()
+            yield unit, stats
+
+        self.log_progress()
+        if self.done < self.total:
+            logging.warning(
+                f"Backfill '{self.name}' has {self.total - self.done} failed units; run it again to retry them"
+            )
+
+def job_status(db_path='stock_data.db'):
+    """Per-job unit counts from the checkpoint table"""
+    conn = connect_read_only(db_path)
+    try:
+        return conn.execute('''
+            SELECT job, COUNT(*), SUM(status = 'done'), SUM(rows), MAX(completed)
+            FROM backfill_checkpoints
+            GROUP BY job
+            ORDER BY job
+        ''').fetchall()
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run, show or reset resumable backfill jobs')
+    parser.add_argument('--db', default='stock_data.db', help='Database path')
+    parser.add_argument('--status', action='store_true', help='Show the progress of every backfill job')
+    parser.add_argument('--reset', metavar='JOB', help='Delete the checkpoints of a job so it starts afresh')
+    parser.add_argument('--years', type=int, help='Backfill this many years of history for every stock')
+    parser.add_argument('--job', default='history_backfill', help='Job name for --years (rerun to resume)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db = DatabaseHandler(args.db)
+    if not db.connect():
+        return 1
+
+    try:
+        if args.reset:
+            db.cursor.execute("DELETE FROM backfill_checkpoints WHERE job = ?", (args.reset,))
+            db.conn.commit()
+            logging.info(f"Deleted {db.cursor.rowcount} checkpoints of backfill '{args.reset}'")
+        stocks = db.get_all_stocks() if args.years else []
+    finally:
+        db.close()
+
+    if args.years:
+        # Imported here: stock_fetcher is only needed (and only configured) for fetching
+        from stock_fetcher import StockFetcher
+        from_date = (datetime.now() - timedelta(days=365 * args.years)).strftime("%Y-%m-%d")
+        fetcher = StockFetcher()
+        if fetcher.db.db_name != args.db:
+            fetcher.db.close()
+            fetcher.db = DatabaseHandler(args.db)
+            if not fetcher.db.connect():
+                return 1
+        try:
+            progress = fetcher.backfill_history(stocks, from_date, job_name=args.job)
+        finally:
+            fetcher.db.close()
+        return 0 if progress['remaining'] == 0 else 1
+
+    if args.status or not args.reset:
+        rows = job_status(args.db)
+        if not rows:
+            print("No backfill jobs")
+        for job, total, done, candles, last in rows:
+            done = done or 0
+            print(f"{job}: {done}/{total} units done, {total - done} pending, "
+                  f"{candles or 0} candles, last unit {last or '-'}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
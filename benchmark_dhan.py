@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Offline throughput benchmarks against the mock Dhan API.
+
+Starts mock_dhan_server.py in-process (or uses --url) and points StockFetcher,
+AutoOrderPlacer and SecurityIDVerifier at it, then reports requests/s, p50/p99
+call latency and the end-to-end time to ingest a universe of stocks. Everything
+runs in a scratch directory with its own database, so the real stock_data.db
+and order_history.json are not touched.
+
+Call latency is measured around the client call, so it includes the time spent
+waiting for the rate limiter and any client-side retries. The adaptive limiters'
+final rates and throttle counts are printed at the end.
+
+Usage:
+    python benchmark_dhan.py                          # Dhan's real quotas
+    python benchmark_dhan.py --rate 50 --stocks 500   # what would a higher quota buy?
+    python benchmark_dhan.py --latency 0.2 --error-rate-5xx 0.02 --workers 16
+    python benchmark_dhan.py --rate 5 --client-rate 10   # client over-estimates the quota
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import numpy as np
+from datetime import datetime, timedelta
+from dhan_transport import get_transport
+from ingest_pipeline import IngestPipeline
+from mock_dhan_server import MockDhanServer
+from rate_limiter import rate_limit_stats
+from stock_fetcher import StockFetcher, FETCH_WORKERS
+from update_planner import FetchTask
+
+def timed_calls(fetcher, jobs, call, workers):
+    """
+    Run call(job) for every job on the fetcher's worker pool
+
+    Returns:
+        (results, latencies, elapsed): results in completion order, per-call seconds
+        and the wall time of the whole run
+    """
+    def timed(job):
+        start = time.monotonic()
+        result = call(job)
+        return result, time.monotonic() - start
+
+    start = time.monotonic()
+    results = []
+    latencies = []
+    for job, outcome in fetcher.fetch_many(jobs, timed, max_workers=workers):
+        if outcome is not None:
+            results.append(outcome[0])
+            latencies.append(outcome[1])
+    return results, latencies, time.monotonic() - start
+
+def report(name, count, latencies, elapsed, failed=0):
+    """Print one benchmark line"""
+    rate = count / elapsed if elapsed > 0 else 0.0
+    p50, p99 = np.percentile(latencies, [50, 99]) if latencies else (0.0, 0.0)
+    print(f"{name:<22} {count:>6} calls {failed:>5} failed {rate:>8.1f}/s "
+          f"p50 {p50 * 1000:>8.1f} ms  p99 {p99 * 1000:>8.1f} ms  in {elapsed:.2f}s")
+
+def create_universe(db, size):
+    """Insert size mock stocks; returns their get_all_stocks rows"""
+    for i in range(size):
+        db.insert_stock(str(100000 + i), "NSE_EQ", f"MOCK{i:04d}", f"Mock Stock {i}", "EQUITY")
+    return db.get_all_stocks()
+
+def bench_historical(fetcher, stocks, requests, workers):
+    to_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    from_date = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    jobs = [stocks[i % len(stocks)] for i in range(requests)]
+    results, latencies, elapsed = timed_calls(
+        fetcher, jobs,
+        lambda stock: fetcher.fetch_historical_daily_data(
+            stock[1], stock[2], stock[4], from_date, to_date, demo_fallback=False
+        ),
+        workers
+    )
+    report("historical", len(jobs), latencies, elapsed, len(jobs) - sum(1 for r in results if r))
+
+def bench_ingest(fetcher, stocks, days, workers):
+    to_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    from_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    tasks = [FetchTask(*stock, from_date, to_date) for stock in stocks]
+
+    def fetch(task):
+        return fetcher.fetch_historical_daily_data(
+            task.security_id, task.exchange_segment, task.instrument, task.from_date, task.to_date,
+            demo_fallback=False
+        )
+
+    start = time.monotonic()
+    pipeline = IngestPipeline(fetch, fetcher.db.db_name, fetch_workers=workers)
+    written = [stats for _, stats in pipeline.run(tasks)]
+    elapsed = time.monotonic() - start
+    candles = sum(stats['inserted'] + stats['updated'] for stats in written if stats)
+    failed = sum(1 for stats in written if stats is None)
+    print(f"{'universe ingest':<22} {len(tasks):>6} stocks {failed:>4} failed "
+          f"{candles:>9} candles in {elapsed:.2f}s ({len(tasks) / elapsed:.1f} stocks/s)")
+
+def bench_orders(url, stocks, orders):
+    # Imported here: auto_order configures file logging on import, which is a
+    # no-op once this script has configured logging
+    from auto_order import AutoOrderPlacer
+    placer = AutoOrderPlacer(db_path='stock_data.db')
+    placer.config['dhan_api_url'] = url
+    placer.config['api_secret'] = placer.config.get('api_secret') or 'mock-token'
+    placer.config['dhan_client_id'] = placer.config.get('dhan_client_id') or 'mock-client'
+
+    latencies = {'place': [], 'modify': [], 'cancel': [], 'list': []}
+    failed = {name: 0 for name in latencies}
+
+    def timed(name, call):
+        start = time.monotonic()
+        result = call()
+        latencies[name].append(time.monotonic() - start)
+        if not result.get('success'):
+            failed[name] += 1
+        return result
+
+    start = time.monotonic()
+    for i in range(orders):
+        symbol = stocks[i % len(stocks)][3]
+        placed = timed('place', lambda: placer.place_dhan_super_order({
+            'symbol': symbol, 'order_type': 'LIMIT', 'position_size': 1, 'limit_price': 100.0,
+            'current_price': 100.5, 'stop_loss': 95.0, 'target': 110.0,
+        }))
+        if placed.get('success'):
+            timed('modify', lambda: placer.modify_dhan_super_order(
+                placed['order_id'], 'TARGET_LEG', {'targetPrice': 111.0}
+            ))
+            timed('cancel', lambda: placer.cancel_dhan_super_order_leg(placed['order_id'], 'ENTRY_LEG'))
+    timed('list', placer.get_dhan_super_orders)
+    elapsed = time.monotonic() - start
+
+    for name, values in latencies.items():
+        report(f"orders: {name}", len(values), values, sum(values), failed[name])
+    total = sum(len(values) for values in latencies.values())
+    print(f"{'orders: total':<22} {total:>6} calls in {elapsed:.2f}s ({total / elapsed:.1f}/s)")
+    placer.db.close()
+
+def bench_verify(fetcher, url, stocks, workers):
+    try:
+        from verify_security_ids import SecurityIDVerifier
+    except ImportError as e:
+        print(f"{'verify security ids':<22} skipped ({e})")
+        return
+    verifier = SecurityIDVerifier()
+    verifier.api_base_url = url
+    verifier.transport = get_transport(verifier.api_key, url)
+    to_date = datetime.now().strftime("%Y-%m-%d")
+    from_date = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+    results, latencies, elapsed = timed_calls(
+        fetcher, stocks,
+        lambda stock: verifier.check_security_id(stock[1], stock[2], stock[4], from_date, to_date),
+        workers
+    )
+    report("verify security ids", len(stocks), latencies, elapsed, sum(1 for r in results if r != "OK"))
+
+def bench_quotes(transport, stocks, calls):
+    # Quote APIs take up to 1000 instruments per request and allow 1 request/s
+    security_ids = [int(stock[1]) for stock in stocks[:1000]]
+    latencies = []
+    failed = 0
+    start = time.monotonic()
+    for _ in range(calls):
+        call_start = time.monotonic()
+        response = transport.post("/marketfeed/ltp", family='quote', json={"NSE_EQ": security_ids})
+        latencies.append(time.monotonic() - call_start)
+        if response.status_code != 200:
+            failed += 1
+    report("quotes (ltp)", calls, latencies, time.monotonic() - start, failed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Dhan clients against the mock Dhan API')
+    parser.add_argument('--url', help='Use an already running mock (e.g. http://127.0.0.1:8765/v2)')
+    parser.add_argument('--stocks', type=int, default=200, help='Universe size')
+    parser.add_argument('--days', type=int, default=365, help='Days of history per stock for the ingest run')
+    parser.add_argument('--requests', type=int, default=100, help='Historical requests for the latency run')
+    parser.add_argument('--orders', type=int, default=20, help='Orders to place, modify and cancel')
+    parser.add_argument('--quotes', type=int, default=3, help='Quote requests')
+    parser.add_argument('--workers', type=int, default=None, help='Concurrent requests (default FETCH_WORKERS)')
+    parser.add_argument('--rate', type=float, help='Data API requests/s, for both the client limiter and the mock')
+    parser.add_argument('--client-rate', type=float,
+                        help="Client's data quota if different from --rate; set it above the mock's quota "
+                             "to watch the adaptive limiter settle on the mock's")
+    parser.add_argument('--latency', type=float, default=0.02, help='Mock response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='Mock latency jitter in seconds')
+    parser.add_argument('--error-rate-429', type=float, default=0.0, help='Share of injected 429s')
+    parser.add_argument('--error-rate-5xx', type=float, default=0.0, help='Share of injected 5xx errors')
+    parser.add_argument('--skip', nargs='*', default=[],
+                        choices=['historical', 'ingest', 'orders', 'verify', 'quotes'], help='Benchmarks to skip')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Modules imported above may already have configured per-request INFO logging
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # The limiter reads its rate on first use, so this must happen before any request
+    if args.client_rate or args.rate:
+        os.environ["DHAN_DATA_RATE_LIMIT"] = str(args.client_rate or args.rate)
+    workers = args.workers or FETCH_WORKERS
+
+    scratch = tempfile.mkdtemp(prefix="dhan_bench_")
+    cwd = os.getcwd()
+    os.chdir(scratch)
+    server = None
+    try:
+        url = args.url
+        if not url:
+            server = MockDhanServer(latency=args.latency, jitter=args.jitter,
+                                    error_rate_429=args.error_rate_429, error_rate_5xx=args.error_rate_5xx,
+                                    rate_limits={'data': args.rate} if args.rate else None).start()
+            url = server.url
+
+        fetcher = StockFetcher()
+        fetcher.api_base_url = url
+        fetcher.transport = get_transport(fetcher.api_key or 'mock-token', url)
+        stocks = create_universe(fetcher.db, args.stocks)
+        print(f"Benchmarking against {url}: {len(stocks)} stocks, {workers} workers, "
+              f"data rate {os.getenv('DHAN_DATA_RATE_LIMIT', 'default')}")
+
+        if 'historical' not in args.skip:
+            bench_historical(fetcher, stocks, args.requests, workers)
+        if 'ingest' not in args.skip:
+            bench_ingest(fetcher, stocks, args.days, workers)
+        if 'verify' not in args.skip:
+            bench_verify(fetcher, url, stocks, workers)
+        if 'orders' not in args.skip:
+            bench_orders(url, stocks, args.orders)
+        if 'quotes' not in args.skip:
+            bench_quotes(fetcher.transport, stocks, args.quotes)
+        fetcher.db.close()
+
+        print("Client rate limiters:")
+        for family, stats in sorted(rate_limit_stats().items()):
+            print(f"  {family}: {stats}")
+        if server:
+            print("Mock responses:")
+            for (method, route), counts in sorted(server.summary().items()):
+                print(f"  {method} {route}: {counts}")
+    finally:
+        if server:
+            server.stop()
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
 Script to clean the history_data table in the stock database
+
+On the v2 layout --days and --before-date drop whole monthly partitions: a month
+is removed once all of it is older than the cutoff.
 """
 
 import argparse
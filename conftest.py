@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""Shared pytest fixtures for the tests that run on a synthetic stock database"""
+
+import pytest
+from db_handler import DatabaseHandler
+from synthetic_market import synthetic_history, write_synthetic_database
+
+# Last day of the synthetic history; newer candles are appended with append_days()
+END_DATE = '2026-09-30'
+
+@pytest.fixture
+def make_db(tmp_path):
+    """
+    Factory writing a synthetic stock_data.db into the test's tmp_path
+
+    Returns:
+        make_db(stocks=3, years=1) -> database path
+    """
+    def make(stocks=3, years=1):
+        db_path = str(tmp_path / 'stock_data.db')
+        assert write_synthetic_database(db_path, stocks=stocks, years=years, end_date=END_DATE)
+        return db_path
+    return make
+
+def append_days(db_path, from_date, to_date, stock_ids=None):
+    """Store candles after the synthetic history for every stock (or stock_ids), as a nightly update would"""
+    db = DatabaseHandler(db_path)
+    assert db.connect()
+    try:
+        for stock_id, security_id in db.conn.execute("SELECT id, security_id FROM stocks").fetchall():
+            if stock_ids is not None and stock_id not in stock_ids:
+                continue
+            payload = synthetic_history(security_id, from_date, to_date, seed=1)
+            assert db.insert_history_data(stock_id, payload)['inserted'] == len(payload['candles'])
+    finally:
+        db.close()
@@ -0,0 +1,69 @@
+"""
+Shared SQLite connection factory.
+
+Every module opens the stock database through this module so that all
+connections use the same tuning: WAL journaling, a busy timeout, a larger
+page cache, memory-mapped I/O and in-memory temp storage.
+
+Two kinds of connection are available:
+- read-write: used by the ingest jobs, settings and signal writers
+- read-only: used by the UI and lookup-only paths such as the order runner's
+  candle reads; in WAL mode these never block behind (or block) the nightly
+  ingest, and query_only guarantees they cannot write by accident
+"""
+
+import sqlite3
+
+DEFAULT_DB_PATH = 'stock_data.db'
+
+READ_WRITE = 'rw'
+READ_ONLY = 'ro'
+
+# How long a connection waits on a locked database before giving up
+BUSY_TIMEOUT_MS = 30000
+
+# Page cache per connection in KiB (negative values of cache_size are KiB)
+CACHE_SIZE_KIB = 64 * 1024
+
+# Maximum number of bytes of the database file to memory-map
+MMAP_SIZE = 256 * 1024 * 1024
+
+def get_connection(db_path=DEFAULT_DB_PATH, kind=READ_WRITE, check_same_thread=True):
+    """
+    Open a tuned SQLite connection
+
+    Args:
+        db_path: Path to the SQLite database file
+        kind: READ_WRITE or READ_ONLY
+        check_same_thread: Pass False for a connection shared between threads
+            (the caller must serialize access, e.g. with a lock)
+
+    Returns:
+        sqlite3.Connection (raises sqlite3.Error on failure, like sqlite3.connect)
+    """
+    if kind not in (READ_WRITE, READ_ONLY):
+        raise ValueError(f"Unknown connection kind: {kind}")
+
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=check_same_thread)
+
+    # WAL is persistent in the database file, so this is a no-op after the first call
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable against corruption in WAL mode and avoids an fsync per commit
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+    if kind == READ_ONLY:
+        conn.execute("PRAGMA query_only=ON")
+
+    return conn
+
+def connect_read_write(db_path=DEFAULT_DB_PATH):
+    """Open a tuned read-write connection"""
+    return get_connection(db_path, READ_WRITE)
+
+def connect_read_only(db_path=DEFAULT_DB_PATH):
+    """Open a tuned read-only connection"""
+    return get_connection(db_path, READ_ONLY)
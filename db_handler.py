@@ -1,22 +1,428 @@
 import sqlite3
 import os
+import time
 from datetime import datetime
 import logging
+import numpy as np
+from db_connection import connect_read_write
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+HISTORY_COLUMNS = ('timestamp', 'date', 'open', 'high', 'low', 'close', 'volume', 'open_interest')
+
+# Indexes maintained by create_tables. Changing a definition here makes the next
+# connect() drop and rebuild that index; query_plan_check.py verifies the hot
+# queries still use them.
+MANAGED_INDEXES = {
+    # Symbol lookups in the signal, AI and order paths
+    'idx_stocks_symbol': "CREATE INDEX idx_stocks_symbol ON stocks (symbol)",
+    # Covering index for per-stock date-range reads (signals, AI, charts, latest candle)
+    'idx_history_stock_date': (
+        "CREATE INDEX idx_history_stock_date ON history_data "
+        "(stock_id, date, timestamp, open, high, low, close, volume)"
+    ),
+    # Covering index for the security_id chart fallback
+    'idx_history_security_date': (
+        "CREATE INDEX idx_history_security_date ON history_data "
+        "(security_id, date, timestamp, open, high, low, close, volume)"
+    ),
+}
+
+# Indexes created by earlier versions that should be dropped if present
+RETIRED_INDEXES = ()
+
+# Indexes that only apply to the v1 history_data table; the v2 primary key replaces them
+V1_HISTORY_INDEXES = ('idx_history_stock_date', 'idx_history_security_date')
+
+# history_data layouts: v1 is the original rowid table, v2 stores candles in
+# history_v2 and exposes them through a history_data compatibility view
+HISTORY_LAYOUT_V1 = 'v1'
+HISTORY_LAYOUT_V2 = 'v2'
+
+HISTORY_V2_TABLE = 'history_v2'
+
+# v2 candles are partitioned by month: history_v2 is the writable "hot" table
+# for recent months, and roll_history_partitions() moves each closed month into
+# its own read-only history_v2_pYYYYMM table. history_v2_all is a UNION ALL view
+# over all of them, and history_data reads from that. Retention then drops
+# whole partition tables instead of deleting rows.
+HISTORY_ALL_VIEW = 'history_v2_all'
+HISTORY_PARTITION_PREFIX = 'history_v2_p'
+
+# Months (counting the current one) that stay in the hot table
+HOT_MONTHS = 2
+
+HISTORY_V2_COLUMNS = ('stock_id', 'day', 'open', 'high', 'low', 'close', 'volume', 'open_interest')
+
+def history_v2_table_sql(name):
+    """
+    DDL for a v2 candle table: one row per stock per trading day. day is days
+    since 1970-01-01, prices are integer paise; date, timestamp and
+    security_id are derived by the history_data view
+    """
+    return f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            stock_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            open INTEGER,
+            high INTEGER,
+            low INTEGER,
+            close INTEGER,
+            volume INTEGER,
+            open_interest INTEGER,
+            PRIMARY KEY (stock_id, day)
+        ) WITHOUT ROWID
+    '''
+
+HISTORY_V2_TABLE_SQL = history_v2_table_sql(HISTORY_V2_TABLE)
+
+def history_all_view_sql(partitions):
+    """DDL for the UNION ALL view over the hot table and the given partition tables"""
+    columns = ", ".join(HISTORY_V2_COLUMNS)
+    selects = [f"SELECT {columns} FROM {name}" for name in [HISTORY_V2_TABLE] + list(partitions)]
+    return f"CREATE VIEW IF NOT EXISTS {HISTORY_ALL_VIEW} AS " + " UNION ALL ".join(selects)
+
+def partition_freeze_sql(name):
+    """Triggers that make a partition append-only: its rows can't be changed or deleted"""
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {name}_frozen_{action.lower()} BEFORE {action} ON {name} "
+        f"BEGIN SELECT RAISE(ABORT, 'history partition {name} is read-only'); END"
+        for action in ('UPDATE', 'DELETE')
+    ]
+
+def month_of_day(day):
+    """Month index (months since 1970-01) of a day since the epoch"""
+    return int(np.datetime64(int(day), 'D').astype('datetime64[M]').astype(np.int64))
+
+def month_bounds(month):
+    """First and last day (days since the epoch) of a month index"""
+    first = np.datetime64(int(month), 'M').astype('datetime64[D]').astype(np.int64)
+    following = np.datetime64(int(month) + 1, 'M').astype('datetime64[D]').astype(np.int64)
+    return int(first), int(following) - 1
+
+def partition_name(month):
+    """Partition table name for a month index, e.g. history_v2_p202401"""
+    return HISTORY_PARTITION_PREFIX + str(np.datetime64(int(month), 'M')).replace('-', '')
+
+def list_history_partitions(conn):
+    """
+    Partition tables present in the database
+    
+    Returns:
+        list of (table name, first day, last day) ordered by month
+    """
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ? ESCAPE '\\'",
+        (HISTORY_PARTITION_PREFIX.replace('_', '\\_') + '%',)
+    ).fetchall()
+    partitions = []
+    for (name,) in rows:
+        suffix = name[len(HISTORY_PARTITION_PREFIX):]
+        if len(suffix) != 6 or not suffix.isdigit():
+            continue
+        month = (int(suffix[:4]) - 1970) * 12 + int(suffix[4:]) - 1
+        partitions.append((name,) + month_bounds(month))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def rebuild_history_all_view(conn):
+    """Re-create history_v2_all over the partition tables currently present"""
+    partitions = [name for name, _, _ in list_history_partitions(conn)]
+    conn.execute(f"DROP VIEW IF EXISTS {HISTORY_ALL_VIEW}")
+    conn.execute(history_all_view_sql(partitions))
+
+def history_day_sql(date_expr, timestamp_expr):
+    """SQL expression for days since the epoch from a date string, falling back to a timestamp"""
+    return (
+        f"CAST(julianday(substr(COALESCE({date_expr}, "
+        f"date({timestamp_expr}, 'unixepoch', 'localtime')), 1, 10)) - 2440587.5 AS INTEGER)"
+    )
+
+def history_paise_sql(price_expr):
+    """SQL expression converting a rupee price to integer paise"""
+    return f"CAST(ROUND({price_expr} * 100) AS INTEGER)"
+
+# Compatibility view: the v1 columns (plus day) so existing queries keep working.
+# timestamp is local midnight, as written for 'candles' payloads. Writes through
+# the view go to the hot table; changing or deleting a candle that sits in a
+# frozen partition is rejected, as the partition's own triggers would, and an
+# insert of an existing candle fails like one into the v1 table
+HISTORY_FROZEN_CANDLE_SQL = (
+    "SELECT RAISE(ABORT, 'history candle is in a read-only partition') "
+    "WHERE EXISTS (SELECT 1 FROM history_v2_all WHERE stock_id = {stock_id} AND day = {day}) "
+    "AND NOT EXISTS (SELECT 1 FROM history_v2 WHERE stock_id = {stock_id} AND day = {day})"
+)
+
+HISTORY_VIEW_SQL = (
+    history_all_view_sql([]),
+    '''
+    CREATE VIEW IF NOT EXISTS history_data AS
+    SELECT h.stock_id AS stock_id,
+           CAST(strftime('%s', h.day * 86400, 'unixepoch', 'utc') AS INTEGER) AS timestamp,
+           date(h.day * 86400, 'unixepoch') AS date,
+           h.open / 100.0 AS open,
+           h.high / 100.0 AS high,
+           h.low / 100.0 AS low,
+           h.close / 100.0 AS close,
+           h.volume AS volume,
+           h.open_interest AS open_interest,
+           s.security_id AS security_id,
+           h.day AS day
+    FROM history_v2_all h
+    LEFT JOIN stocks s ON s.id = h.stock_id
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS history_data_insert INSTEAD OF INSERT ON history_data
+    BEGIN
+        {HISTORY_FROZEN_CANDLE_SQL.format(
+            stock_id='NEW.stock_id', day=f"COALESCE(NEW.day, {history_day_sql('NEW.date', 'NEW.timestamp')})"
+        )};
+        INSERT INTO history_v2 (stock_id, day, open, high, low, close, volume, open_interest)
+        VALUES (NEW.stock_id, COALESCE(NEW.day, {history_day_sql('NEW.date', 'NEW.timestamp')}),
+                {history_paise_sql('NEW.open')}, {history_paise_sql('NEW.high')},
+                {history_paise_sql('NEW.low')}, {history_paise_sql('NEW.close')},
+                NEW.volume, NEW.open_interest);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS history_data_update INSTEAD OF UPDATE ON history_data
+    BEGIN
+        {HISTORY_FROZEN_CANDLE_SQL.format(stock_id='OLD.stock_id', day='OLD.day')};
+        UPDATE history_v2
+        SET open = {history_paise_sql('NEW.open')}, high = {history_paise_sql('NEW.high')},
+            low = {history_paise_sql('NEW.low')}, close = {history_paise_sql('NEW.close')},
+            volume = NEW.volume, open_interest = NEW.open_interest
+        WHERE stock_id = OLD.stock_id AND day = OLD.day;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS history_data_delete INSTEAD OF DELETE ON history_data
+    BEGIN
+        {HISTORY_FROZEN_CANDLE_SQL.format(stock_id='OLD.stock_id', day='OLD.day')};
+        DELETE FROM history_v2 WHERE stock_id = OLD.stock_id AND day = OLD.day;
+    END
+    ''',
+)
+
+# Write triggers of the history_data view, re-created by _upgrade_history_view
+# when they predate the read-only partition checks
+HISTORY_VIEW_TRIGGERS = ('history_data_insert', 'history_data_update', 'history_data_delete')
+
+# Cached indicator frames and latest-signal records (signal_cache.py), valid
+# while the 'history' data version is unchanged
+SIGNAL_CACHE_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS signal_cache (
+        stock_id INTEGER NOT NULL,
+        last_day INTEGER NOT NULL,
+        from_day INTEGER NOT NULL,
+        sma_period INTEGER NOT NULL,
+        rsi_period INTEGER NOT NULL,
+        rsi_threshold REAL NOT NULL,
+        history_version INTEGER NOT NULL,
+        signals TEXT NOT NULL,
+        frame BLOB NOT NULL,
+        created TEXT,
+        PRIMARY KEY (stock_id, last_day, from_day, sma_period, rsi_period, rsi_threshold)
+    ) WITHOUT ROWID
+'''
+
+def _upsert_sql(table, key, columns):
+    """INSERT ... ON CONFLICT DO UPDATE that leaves a row untouched unless a value changed"""
+    all_columns = ('stock_id', key) + columns
+    return f'''
+        INSERT INTO {table} ({", ".join(all_columns)})
+        VALUES ({", ".join("?" * len(all_columns))})
+        ON CONFLICT (stock_id, {key}) DO UPDATE SET
+            {", ".join(f"{column} = excluded.{column}" for column in columns)}
+        WHERE {" OR ".join(f"{table}.{column} IS NOT excluded.{column}" for column in columns)}
+    '''
+
+def _existing_sql(table, key, columns):
+    """Stored rows of one stock within a key range, for comparing against incoming candles"""
+    return f"SELECT {key}, {', '.join(columns)} FROM {table} WHERE stock_id = ? AND {key} BETWEEN ? AND ?"
+
+# Per-layout statements used by insert_history_data_bulk; rows are (stock_id, key, values...)
+_V1_VALUE_COLUMNS = ('date', 'open', 'high', 'low', 'close', 'volume', 'open_interest', 'security_id')
+_V2_VALUE_COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'open_interest')
+HISTORY_UPSERTS = {
+    HISTORY_LAYOUT_V1: {
+        'upsert': _upsert_sql('history_data', 'timestamp', _V1_VALUE_COLUMNS),
+        'existing': _existing_sql('history_data', 'timestamp', _V1_VALUE_COLUMNS),
+    },
+    HISTORY_LAYOUT_V2: {
+        'upsert': _upsert_sql(HISTORY_V2_TABLE, 'day', _V2_VALUE_COLUMNS),
+        'existing': _existing_sql(HISTORY_ALL_VIEW, 'day', _V2_VALUE_COLUMNS),
+        'existing_hot': f"SELECT day FROM {HISTORY_V2_TABLE} WHERE stock_id = ? AND day BETWEEN ? AND ?",
+    },
+}
+
+# Length of a prepare_history_rows row on each layout, to recognise rows
+# prepared before migrate_history_v2 switched the layout
+HISTORY_ROW_LENGTHS = {
+    HISTORY_LAYOUT_V1: 2 + len(_V1_VALUE_COLUMNS),
+    HISTORY_LAYOUT_V2: 2 + len(_V2_VALUE_COLUMNS),
+}
+
+def get_history_layout(conn):
+    """Return HISTORY_LAYOUT_V2 if history_data is the v2 compatibility view, else HISTORY_LAYOUT_V1"""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'history_data'").fetchone()
+    return HISTORY_LAYOUT_V2 if row and row[0] == 'view' else HISTORY_LAYOUT_V1
+
+def get_data_version(conn, name):
+    """
+    Read the change counter for a data set (e.g. 'history') from data_versions
+    
+    Returns:
+        int version, or None if the database has no data_versions table yet
+    """
+    try:
+        row = conn.execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+    except sqlite3.OperationalError:
+        return None
+
+def bump_data_version(conn, name):
+    """Increment the change counter for a data set; call inside the writing transaction"""
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute('''
+        INSERT INTO data_versions (name, version, last_updated) VALUES (?, 1, ?)
+        ON CONFLICT (name) DO UPDATE SET version = version + 1, last_updated = excluded.last_updated
+    ''', (name, current_time))
+
+def _normalize_sql(sql):
+    """Collapse whitespace and case so index definitions can be compared"""
+    return " ".join((sql or "").split()).lower()
+
+def _convert_setting(key, value, value_type):
+    """Convert a stored setting string to its declared type"""
+    try:
+        if value_type == 'int':
+            return int(value)
+        elif value_type == 'float':
+            return float(value)
+        elif value_type == 'bool':
+            return value.lower() == 'true'
+    except (ValueError, AttributeError):
+        logging.warning(f"Setting {key} is not a valid {value_type}: {value!r}")
+    # Treat as string by default
+    return value
+
+def _dates_to_timestamps(date_strings):
+    """Convert YYYY-MM-DD strings to local-midnight epoch seconds in one pass"""
+    dates = np.asarray(date_strings, dtype=str)
+    if len(dates) == 0:
+        return []
+    
+    # Vectorized path: every string is a plain date and the local zone has no DST
+    if not time.daylight and np.all(np.char.str_len(dates) == 10):
+        try:
+            days = dates.astype('datetime64[D]').astype(np.int64)
+            return (days * 86400 + time.timezone).tolist()
+        except ValueError:
+            pass
+    
+    # Fallback: parse one by one, using the current time for unparseable dates
+    timestamps = []
+    for date_str in dates:
+        try:
+            timestamps.append(int(datetime.strptime(date_str, "%Y-%m-%d").timestamp()))
+        except ValueError:
+            timestamps.append(int(datetime.now().timestamp()))
+    return timestamps
+
+def _timestamps_to_dates(timestamps):
+    """Convert epoch seconds to local YYYY-MM-DD strings in one pass"""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if not time.daylight:
+        local = (timestamps - time.timezone).astype('datetime64[s]')
+        return np.datetime_as_string(local, unit='D').tolist()
+    return [datetime.fromtimestamp(ts).strftime("%Y-%m-%d") for ts in timestamps.tolist()]
+
+def _dates_to_days(date_strings):
+    """Convert date strings to days since the epoch, using today for unparseable dates"""
+    dates = [str(d)[:10] for d in date_strings]
+    try:
+        return np.array(dates, dtype='datetime64[D]').astype(np.int64).tolist()
+    except ValueError:
+        days = []
+        today = int(np.datetime64(datetime.now().strftime("%Y-%m-%d"), 'D').astype(np.int64))
+        for date_str in dates:
+            try:
+                days.append(int(np.datetime64(date_str, 'D').astype(np.int64)))
+            except ValueError:
+                days.append(today)
+        return days
+
+def _to_paise(prices):
+    """Convert rupee prices to integer paise (None stays None)"""
+    values = np.array([np.nan if p is None else p for p in prices], dtype=np.float64)
+    missing = np.isnan(values)
+    paise = np.floor(np.nan_to_num(values) * 100 + 0.5).astype(np.int64).astype(object)
+    paise[missing] = None
+    return paise.tolist()
+
+def _padded_column(data, key, length):
+    """Return data[key] truncated or zero-padded to the given length"""
+    values = list(data.get(key) or [])[:length]
+    return values + [0] * (length - len(values))
+
+def parse_history_payload(data):
+    """
+    Parse a historical data API response into columns
+    
+    Handles both the 'candles' format ([date, open, high, low, close, volume, oi])
+    and the legacy format with separate timestamp/open/high/... arrays.
+    
+    Returns:
+        dict mapping each name in HISTORY_COLUMNS to a list, or None if the
+        payload is not in a recognised format
+    """
+    if data and 'candles' in data:
+        # Make sure we have enough data points: [date, open, high, low, close, volume]
+        candles = [candle for candle in data['candles'] if len(candle) >= 6]
+        return {
+            'timestamp': _dates_to_timestamps([candle[0] for candle in candles]),
+            'date': [candle[0] for candle in candles],
+            'open': [candle[1] for candle in candles],
+            'high': [candle[2] for candle in candles],
+            'low': [candle[3] for candle in candles],
+            'close': [candle[4] for candle in candles],
+            'volume': [candle[5] for candle in candles],
+            'open_interest': [candle[6] if len(candle) > 6 else 0 for candle in candles]
+        }
+    elif data and 'timestamp' in data:
+        timestamps = [int(ts) for ts in data['timestamp']]
+        n = len(timestamps)
+        return {
+            'timestamp': timestamps,
+            'date': _timestamps_to_dates(timestamps),
+            'open': _padded_column(data, 'open', n),
+            'high': _padded_column(data, 'high', n),
+            'low': _padded_column(data, 'low', n),
+            'close': _padded_column(data, 'close', n),
+            'volume': _padded_column(data, 'volume', n),
+            'open_interest': _padded_column(data, 'open_interest', n)
+        }
+    return None
+
 class DatabaseHandler:
     def __init__(self, db_name='stock_data.db'):
         """Initialize the database connection"""
         self.db_name = db_name
         self.conn = None
         self.cursor = None
+        self.history_layout = HISTORY_LAYOUT_V1
+        # PRAGMA data_version when history_layout was last checked, see refresh_history_layout
+        self._layout_data_version = None
+        # Typed settings cache, see _load_settings
+        self._settings = None
+        self._settings_data_version = None
+        self._settings_version = None
         
     def connect(self):
         """Connect to the database"""
         try:
-            self.conn = sqlite3.connect(self.db_name)
+            self.conn = connect_read_write(self.db_name)
             self.cursor = self.conn.cursor()
             logging.info(f"Connected to database: {self.db_name}")
             self.create_tables()
@@ -34,6 +440,14 @@ class DatabaseHandler:
     def create_tables(self):
         """Create necessary tables if they don't exist"""
         try:
+            # New databases use incremental auto_vacuum so dropped history partitions
+            # can give their pages back. The WAL header already exists at this point,
+            # so the setting only takes effect after a VACUUM (cheap on an empty file)
+            self.cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+            if self.cursor.fetchone()[0] == 0:
+                self.cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                self.cursor.execute("VACUUM")
+            
             # Create stocks table
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS stocks (
@@ -48,6 +462,16 @@ class DatabaseHandler:
                 )
             ''')
             
+            # New databases start on the compact v2 layout; existing v1 databases
+            # keep their table until migrate_history_v2.py converts them
+            self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'history_data'")
+            if self.cursor.fetchone() is None:
+                self.cursor.execute(HISTORY_V2_TABLE_SQL)
+                for sql in HISTORY_VIEW_SQL:
+                    self.cursor.execute(sql)
+            else:
+                self._upgrade_history_view()
+            
             # Create history_data table
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS history_data (
@@ -79,6 +503,63 @@ class DatabaseHandler:
                 )
             ''')
             
+            # Create data_versions table: change counters that let caches detect new data
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS data_versions (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    last_updated TEXT
+                )
+            ''')
+            
+            # Create backfill_checkpoints table: units of resumable backfill jobs
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+                    job TEXT NOT NULL,
+                    stock_id INTEGER NOT NULL,
+                    from_date TEXT NOT NULL,
+                    to_date TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    rows INTEGER,
+                    completed TEXT,
+                    PRIMARY KEY (job, stock_id, from_date)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Create indicator_state table: per-stock incremental SMA/RSI/EMA state (indicator_state.py)
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS indicator_state (
+                    stock_id INTEGER PRIMARY KEY,
+                    params TEXT NOT NULL,
+                    last_day INTEGER NOT NULL,
+                    candles INTEGER NOT NULL,
+                    closes BLOB NOT NULL,
+                    sma_sum INTEGER NOT NULL,
+                    gain_sum INTEGER NOT NULL,
+                    loss_sum INTEGER NOT NULL,
+                    ema_fast REAL,
+                    ema_slow REAL,
+                    macd_signal REAL,
+                    price_above_ma INTEGER NOT NULL,
+                    rsi_above INTEGER NOT NULL,
+                    ma_signal INTEGER,
+                    prev_ma_signal INTEGER,
+                    rsi_signal INTEGER,
+                    prev_rsi_signal INTEGER,
+                    combined_signal INTEGER NOT NULL,
+                    volume INTEGER,
+                    updated TEXT
+                )
+            ''')
+            
+            # The AI feature store lives in its own file next to this one
+            # (feature_store.py); drop the tables it was first kept in here
+            self.cursor.execute("DROP TABLE IF EXISTS feature_store")
+            self.cursor.execute("DROP TABLE IF EXISTS feature_store_stocks")
+
+            # Create signal_cache table: computed signal frames and records
+            self.cursor.execute(SIGNAL_CACHE_TABLE_SQL)
+            
             # Create watchlist table for auto order enabled symbols
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS watchlist (
@@ -92,25 +573,126 @@ class DatabaseHandler:
             ''')
             
             self.conn.commit()
-            logging.info("Tables created successfully")
-            return True
+            self.history_layout = get_history_layout(self.conn)
+            logging.info(f"Tables created successfully (history layout {self.history_layout})")
+            return self.ensure_indexes()
         except sqlite3.Error as e:
             logging.error(f"Error creating tables: {e}")
             self.conn.rollback()
             return False
     
+    def refresh_history_layout(self):
+        """
+        Re-read the history layout when another connection has committed since the
+        last check (PRAGMA data_version moved), so a handler connected before
+        migrate_history_v2 switched history_data to the v2 view writes the v2 way
+        
+        Returns:
+            The current history layout
+        """
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._layout_data_version:
+            layout = get_history_layout(self.conn)
+            if layout != self.history_layout:
+                logging.info(f"History layout changed from {self.history_layout} to {layout}")
+            self.history_layout = layout
+            self._layout_data_version = data_version
+        return self.history_layout
+    
+    def _upgrade_history_view(self):
+        """
+        Point a v2 history_data view created before partitioning at history_v2_all,
+        and give write triggers created before it the read-only partition checks
+        """
+        self.cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'history_data'")
+        row = self.cursor.fetchone()
+        if row is None:
+            return
+        
+        if HISTORY_ALL_VIEW not in row[0]:
+            # Dropping the view drops its write triggers too
+            self.cursor.execute("DROP VIEW history_data")
+            rebuild_history_all_view(self.conn)
+            for sql in HISTORY_VIEW_SQL:
+                self.cursor.execute(sql)
+            logging.info("history_data view now reads from the partitioned history_v2_all")
+            return
+        
+        self.cursor.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+            f"AND name IN ({','.join('?' * len(HISTORY_VIEW_TRIGGERS))})", HISTORY_VIEW_TRIGGERS
+        )
+        triggers = dict(self.cursor.fetchall())
+        if all('read-only partition' in (triggers.get(name) or '') for name in HISTORY_VIEW_TRIGGERS):
+            return
+        for name in HISTORY_VIEW_TRIGGERS:
+            self.cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        for sql in HISTORY_VIEW_SQL:
+            self.cursor.execute(sql)
+        logging.info("history_data write triggers now reject changes to read-only partitions")
+    
+    def ensure_indexes(self):
+        """Create missing managed indexes, rebuild changed ones and drop retired ones"""
+        try:
+            self.cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index'")
+            existing = dict(self.cursor.fetchall())
+            changed = False
+            
+            for name in RETIRED_INDEXES:
+                if name in existing:
+                    self.cursor.execute(f"DROP INDEX IF EXISTS {name}")
+                    logging.info(f"Dropped retired index {name}")
+                    changed = True
+            
+            for name, sql in MANAGED_INDEXES.items():
+                if self.history_layout == HISTORY_LAYOUT_V2 and name in V1_HISTORY_INDEXES:
+                    continue
+                if name in existing:
+                    if _normalize_sql(existing[name]) == _normalize_sql(sql):
+                        continue
+                    self.cursor.execute(f"DROP INDEX {name}")
+                    logging.info(f"Rebuilding index {name} with new definition")
+                self.cursor.execute(sql)
+                logging.info(f"Created index {name}")
+                changed = True
+            
+            if changed:
+                # Refresh planner statistics so the new indexes are used right away
+                self.cursor.execute("ANALYZE")
+            
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Error creating indexes: {e}")
+            self.conn.rollback()
+            return False
+    
     def insert_stock(self, security_id, exchange_segment, symbol, name, instrument):
         """Insert a new stock or update if it exists"""
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         try:
+            # Update in place so the stock keeps its id (and its history rows);
+            # an unchanged stock is not written at all
             self.cursor.execute('''
-                INSERT OR REPLACE INTO stocks 
+                INSERT INTO stocks 
                 (security_id, exchange_segment, symbol, name, instrument, 
                 added_date, last_updated)
-                VALUES (?, ?, ?, ?, ?, 
-                COALESCE((SELECT added_date FROM stocks WHERE security_id = ?), ?), ?)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (security_id) DO UPDATE SET
+                    exchange_segment = excluded.exchange_segment,
+                    symbol = excluded.symbol,
+                    name = excluded.name,
+                    instrument = excluded.instrument,
+                    last_updated = excluded.last_updated
+                WHERE stocks.exchange_segment IS NOT excluded.exchange_segment
+                OR stocks.symbol IS NOT excluded.symbol
+                OR stocks.name IS NOT excluded.name
+                OR stocks.instrument IS NOT excluded.instrument
             ''', (security_id, exchange_segment, symbol, name, instrument, 
-                 security_id, current_time, current_time))
+                 current_time, current_time))
+            if self.cursor.rowcount:
+                # Tells instrument registries to reload
+                self.bump_data_version('stocks')
             self.conn.commit()
             
             # Get the ID of the inserted/updated stock
@@ -123,77 +705,156 @@ class DatabaseHandler:
             return None
     
     def insert_history_data(self, stock_id, data):
-        """Insert historical data for a stock"""
+        """
+        Insert or update historical data for a stock
+        
+        Returns:
+            dict with 'inserted', 'updated', 'unchanged' and 'frozen' row counts, or None on failure
+        """
+        return self.insert_history_data_bulk([(stock_id, data)]).get(stock_id)
+    
+    def insert_history_data_bulk(self, payloads):
+        """
+        Insert or update historical data for many stocks in a single transaction
+        
+        Candles are compared with the stored rows first: new candles are inserted,
+        changed ones updated, and unchanged ones (e.g. the nightly overlap) are not
+        written at all. On the v2 layout candles already in a read-only monthly
+        partition are never rewritten; changed ones are counted as 'frozen'.
+        
+        Args:
+            payloads: Iterable of (stock_id, data) pairs, where data is an API
+                      response in either the 'candles' or the legacy array format
+        
+        Returns:
+            dict mapping stock_id to {'inserted': n, 'updated': n, 'unchanged': n, 'frozen': n}
+        """
         try:
-            count = 0
-            
-            # Get the security_id for this stock_id
-            self.cursor.execute("SELECT security_id FROM stocks WHERE id = ?", (stock_id,))
-            result = self.cursor.fetchone()
-            security_id = result[0] if result else None
-            
-            # Check if data contains 'candles' (API response format)
-            if data and 'candles' in data:
-                candles = data['candles']
+            self.refresh_history_layout()
+        except sqlite3.Error as e:
+            logging.error(f"Error inserting history data: {e}")
+            return {}
+        return self.insert_history_rows_bulk(
+            (stock_id, self.prepare_history_rows(stock_id, data)) for stock_id, data in payloads
+        )
+    
+    def prepare_history_rows(self, stock_id, data):
+        """
+        Parse an API payload into rows for the current history layout
+        
+        Does not use the database connection, so ingest pipelines can call it
+        from a parse thread while another thread writes.
+        
+        Returns:
+            dict mapping the row key (day or timestamp) to a (stock_id, key, values...)
+            row, or None if the payload is invalid
+        """
+        columns = parse_history_payload(data)
+        if columns is None:
+            logging.error(f"Invalid data format for historical data (stock_id={stock_id})")
+            return None
+        
+        n = len(columns['timestamp'])
+        if self.history_layout == HISTORY_LAYOUT_V2:
+            stock_rows = zip(
+                [stock_id] * n,
+                _dates_to_days(columns['date']),
+                *(_to_paise(columns[name]) for name in ('open', 'high', 'low', 'close')),
+                columns['volume'],
+                columns['open_interest']
+            )
+        else:
+            stock_rows = zip(
+                [stock_id] * n,
+                *(columns[name] for name in HISTORY_COLUMNS),
+                [self._security_id(self._registry(), stock_id)] * n
+            )
+        # A repeated key keeps the last row
+        return {row[1]: row for row in stock_rows}
+    
+    def insert_history_rows_bulk(self, prepared, before_commit=None):
+        """
+        Write rows from prepare_history_rows for many stocks in a single transaction
+        
+        Args:
+            prepared: Iterable of (stock_id, rows) pairs; rows of None (an invalid
+                      payload) are skipped
+            before_commit: Optional function called with the stats dict inside the
+                           transaction, just before it commits (e.g. to record
+                           backfill checkpoints atomically with the candles)
+        
+        Returns:
+            dict mapping stock_id to {'inserted': n, 'updated': n, 'unchanged': n, 'frozen': n}
+        """
+        try:
+            v2 = self.refresh_history_layout() == HISTORY_LAYOUT_V2
+            layout = HISTORY_UPSERTS[self.history_layout]
+            row_length = HISTORY_ROW_LENGTHS[self.history_layout]
+            rows = []
+            stats = {}
+            for stock_id, incoming in prepared:
+                if incoming is None:
+                    continue
+                if incoming and len(next(iter(incoming.values()))) != row_length:
+                    # Parsed before the layout switched: left out, so the caller retries it
+                    logging.error(f"Historical data of stock_id={stock_id} was prepared for another history layout")
+                    continue
                 
-                for candle in candles:
-                    if len(candle) >= 6:  # Make sure we have enough data points
-                        # Candle format: [date, open, high, low, close, volume]
-                        date_str = candle[0]
-                        try:
-                            # Try parsing the date string to get a timestamp
-                            timestamp = int(datetime.strptime(date_str, "%Y-%m-%d").timestamp())
-                        except ValueError:
-                            # If date parsing fails, use current timestamp as fallback
-                            timestamp = int(datetime.now().timestamp())
-                            
-                        open_price = candle[1] if len(candle) > 1 else 0
-                        high_price = candle[2] if len(candle) > 2 else 0
-                        low_price = candle[3] if len(candle) > 3 else 0
-                        close_price = candle[4] if len(candle) > 4 else 0
-                        volume = candle[5] if len(candle) > 5 else 0
-                        open_interest = candle[6] if len(candle) > 6 else 0
-                        
-                        # Insert data
-                        self.cursor.execute('''
-                            INSERT OR REPLACE INTO history_data 
-                            (stock_id, timestamp, date, open, high, low, close, volume, open_interest, security_id)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (stock_id, timestamp, date_str, open_price, high_price, low_price, 
-                              close_price, volume, open_interest, security_id))
-                        count += 1
-            # Handle legacy format (with separate arrays)
-            elif data and 'timestamp' in data:
-                for i in range(len(data['timestamp'])):
-                    timestamp = data['timestamp'][i]
-                    date_str = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
-                    
-                    # Get data for this timestamp
-                    open_price = data['open'][i] if 'open' in data and i < len(data['open']) else 0
-                    high_price = data['high'][i] if 'high' in data and i < len(data['high']) else 0
-                    low_price = data['low'][i] if 'low' in data and i < len(data['low']) else 0
-                    close_price = data['close'][i] if 'close' in data and i < len(data['close']) else 0
-                    volume = data['volume'][i] if 'volume' in data and i < len(data['volume']) else 0
-                    open_interest = data['open_interest'][i] if 'open_interest' in data and i < len(data['open_interest']) else 0
-                    
-                    # Insert data
-                    self.cursor.execute('''
-                        INSERT OR REPLACE INTO history_data 
-                        (stock_id, timestamp, date, open, high, low, close, volume, open_interest, security_id)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (stock_id, timestamp, date_str, open_price, high_price, low_price, 
-                          close_price, volume, open_interest, security_id))
-                    count += 1
-            else:
-                logging.error("Invalid data format for historical data")
-                return 0
+                stock_stats = stats.setdefault(
+                    stock_id, {'inserted': 0, 'updated': 0, 'unchanged': 0, 'frozen': 0}
+                )
+                if not incoming:
+                    continue
                 
+                key_range = (stock_id, min(incoming), max(incoming))
+                self.cursor.execute(layout['existing'], key_range)
+                existing = {row[0]: tuple(row[1:]) for row in self.cursor.fetchall()}
+                hot = None
+                for key, row in incoming.items():
+                    stored = existing.get(key)
+                    if stored is None:
+                        stock_stats['inserted'] += 1
+                    elif stored != tuple(row[2:]):
+                        if v2:
+                            # Only rows still in the hot table can be updated
+                            if hot is None:
+                                self.cursor.execute(layout['existing_hot'], key_range)
+                                hot = {hot_row[0] for hot_row in self.cursor.fetchall()}
+                            if key not in hot:
+                                stock_stats['frozen'] += 1
+                                continue
+                        stock_stats['updated'] += 1
+                    else:
+                        stock_stats['unchanged'] += 1
+                        continue
+                    rows.append(row)
+            
+            if rows:
+                self.cursor.executemany(layout['upsert'], rows)
+                self.bump_data_version('history')
+            
+            if before_commit:
+                before_commit(stats)
             self.conn.commit()
-            return count
+            return stats
         except sqlite3.Error as e:
             logging.error(f"Error inserting history data: {e}")
             self.conn.rollback()
-            return 0
+            return {}
+    
+    def _registry(self):
+        # Imported here: instrument_registry imports this module
+        from instrument_registry import get_registry
+        return get_registry(self.db_name)
+    
+    def _security_id(self, registry, stock_id):
+        """security_id of a stock, from the instrument registry"""
+        instrument = registry.get_by_stock_id(stock_id)
+        return instrument.security_id if instrument else None
+    
+    def bump_data_version(self, name):
+        """Increment the change counter for a data set; call inside the writing transaction"""
+        bump_data_version(self.conn, name)
     
     def get_all_stocks(self):
         """Get all stocks from the database"""
@@ -217,20 +878,37 @@ class DatabaseHandler:
             return None
             
     def clean_history_data(self, older_than_days=None, stock_id=None, before_date=None, all_data=False):
-        """Clean history data based on specified criteria"""
+        """
+        Clean history data based on specified criteria
+        
+        On the v2 layout age cutoffs are applied per month: monthly partitions
+        that lie entirely before the cutoff are dropped, and a partition that
+        straddles it is kept whole until a later run.
+        """
         try:
             conditions = []
             params = []
+            v2 = self.refresh_history_layout() == HISTORY_LAYOUT_V2
+            table = "history_data"
             
             if all_data:
                 # Delete all data
-                query = "DELETE FROM history_data"
+                query = f"DELETE FROM {table}"
             else:
                 # Build query based on filters
                 if older_than_days:
                     cutoff_timestamp = int((datetime.now().timestamp()) - (older_than_days * 86400))
-                    conditions.append("timestamp < ?")
-                    params.append(cutoff_timestamp)
+                    if v2:
+                        # A day's row is older than the cutoff if its local midnight is
+                        cutoff = datetime.fromtimestamp(cutoff_timestamp)
+                        cutoff_day = _dates_to_days([cutoff.strftime("%Y-%m-%d")])[0]
+                        if cutoff.time() != datetime.min.time():
+                            cutoff_day += 1
+                        conditions.append("day < ?")
+                        params.append(cutoff_day)
+                    else:
+                        conditions.append("timestamp < ?")
+                        params.append(cutoff_timestamp)
                 
                 if stock_id:
                     conditions.append("stock_id = ?")
@@ -239,8 +917,12 @@ class DatabaseHandler:
                 if before_date:
                     try:
                         date_timestamp = int(datetime.strptime(before_date, "%Y-%m-%d").timestamp())
-                        conditions.append("timestamp < ?")
-                        params.append(date_timestamp)
+                        if v2:
+                            conditions.append("day < ?")
+                            params.append(_dates_to_days([before_date])[0])
+                        else:
+                            conditions.append("timestamp < ?")
+                            params.append(date_timestamp)
                     except ValueError:
                         logging.error(f"Invalid date format: {before_date}. Expected YYYY-MM-DD")
                         return 0
@@ -249,14 +931,24 @@ class DatabaseHandler:
                     logging.error("No valid conditions provided for cleaning")
                     return 0
                 
-                query = "DELETE FROM history_data WHERE " + " AND ".join(conditions)
+                query = f"DELETE FROM {table} WHERE " + " AND ".join(conditions)
             
-            # Execute the delete query
-            self.cursor.execute(query, params)
-            deleted_count = self.cursor.rowcount
+            if v2:
+                cutoff_days = [param for condition, param in zip(conditions, params) if condition == "day < ?"]
+                deleted_count = self._clean_history_v2(
+                    min(cutoff_days) if cutoff_days else None, None if all_data else stock_id
+                )
+            else:
+                # Execute the delete query
+                self.cursor.execute(query, params)
+                deleted_count = self.cursor.rowcount
+            if deleted_count:
+                self.bump_data_version('history')
             self.conn.commit()
             
             logging.info(f"Deleted {deleted_count} records from history_data")
+            if v2 and deleted_count:
+                self._incremental_vacuum()
             return deleted_count
             
         except sqlite3.Error as e:
@@ -264,8 +956,126 @@ class DatabaseHandler:
             self.conn.rollback()
             return 0
     
+    def _clean_history_v2(self, cutoff_day=None, stock_id=None):
+        """
+        Delete v2 candles before cutoff_day (all days if None), for one stock or all
+        
+        Partitions entirely before the cutoff are dropped rather than emptied. Deleting
+        one stock's rows from a partition lifts its read-only triggers for the duration
+        of the transaction. Runs inside the caller's transaction.
+        
+        Returns:
+            Number of rows deleted
+        """
+        deleted = 0
+        dropped = False
+        for name, first_day, last_day in list_history_partitions(self.conn):
+            if cutoff_day is not None and first_day >= cutoff_day:
+                continue
+            
+            if stock_id is None and (cutoff_day is None or last_day < cutoff_day):
+                self.cursor.execute(f"SELECT COUNT(*) FROM {name}")
+                deleted += self.cursor.fetchone()[0]
+                self.cursor.execute(f"DROP TABLE {name}")
+                dropped = True
+                logging.info(f"Dropped history partition {name}")
+            elif stock_id is not None:
+                for action in ('update', 'delete'):
+                    self.cursor.execute(f"DROP TRIGGER IF EXISTS {name}_frozen_{action}")
+                query = f"DELETE FROM {name} WHERE stock_id = ?"
+                params = [stock_id]
+                if cutoff_day is not None:
+                    query += " AND day < ?"
+                    params.append(cutoff_day)
+                self.cursor.execute(query, params)
+                deleted += self.cursor.rowcount
+                for sql in partition_freeze_sql(name):
+                    self.cursor.execute(sql)
+            else:
+                logging.info(f"Keeping history partition {name}: it extends past the cutoff")
+        
+        if dropped:
+            rebuild_history_all_view(self.conn)
+        
+        # Deletes go to the hot table itself: the view's triggers don't report a row count
+        conditions = []
+        params = []
+        if cutoff_day is not None:
+            conditions.append("day < ?")
+            params.append(cutoff_day)
+        if stock_id is not None:
+            conditions.append("stock_id = ?")
+            params.append(stock_id)
+        query = f"DELETE FROM {HISTORY_V2_TABLE}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        self.cursor.execute(query, params)
+        return deleted + self.cursor.rowcount
+    
+    def _incremental_vacuum(self):
+        """Give free pages back to the filesystem when the database uses incremental auto_vacuum"""
+        try:
+            self.cursor.execute("PRAGMA auto_vacuum")
+            if self.cursor.fetchone()[0] == 2:
+                # executescript steps the pragma to completion; execute() frees one page
+                self.cursor.executescript("PRAGMA incremental_vacuum;")
+        except sqlite3.Error as e:
+            logging.warning(f"Incremental vacuum failed: {e}")
+    
+    def roll_history_partitions(self):
+        """
+        Move closed months from the hot history_v2 table into read-only monthly partitions
+        
+        The current month and the HOT_MONTHS - 1 before it stay in the hot table.
+        Each older month is moved in its own short transaction. The candles don't
+        change, so the history data version is not bumped.
+        
+        Returns:
+            Number of rows moved
+        """
+        if self.refresh_history_layout() != HISTORY_LAYOUT_V2:
+            return 0
+        
+        today = _dates_to_days([datetime.now().strftime("%Y-%m-%d")])[0]
+        hot_start = month_bounds(month_of_day(today) - HOT_MONTHS + 1)[0]
+        columns = ", ".join(HISTORY_V2_COLUMNS)
+        moved = 0
+        try:
+            self.cursor.execute(f"SELECT DISTINCT day FROM {HISTORY_V2_TABLE} WHERE day < ?", (hot_start,))
+            months = sorted({month_of_day(row[0]) for row in self.cursor.fetchall()})
+            
+            for month in months:
+                name = partition_name(month)
+                first_day, last_day = month_bounds(month)
+                self.cursor.execute(history_v2_table_sql(name))
+                for sql in partition_freeze_sql(name):
+                    self.cursor.execute(sql)
+                # A partition is append-only: late candles for a closed month are added
+                self.cursor.execute(f'''
+                    INSERT OR IGNORE INTO {name} ({columns})
+                    SELECT {columns} FROM {HISTORY_V2_TABLE}
+                    WHERE day BETWEEN ? AND ?
+                ''', (first_day, last_day))
+                self.cursor.execute(
+                    f"DELETE FROM {HISTORY_V2_TABLE} WHERE day BETWEEN ? AND ?", (first_day, last_day)
+                )
+                rows = self.cursor.rowcount
+                rebuild_history_all_view(self.conn)
+                self.conn.commit()
+                moved += rows
+                logging.info(f"Moved {rows} candles into history partition {name}")
+            
+            return moved
+        except sqlite3.Error as e:
+            logging.error(f"Error rolling history partitions: {e}")
+            self.conn.rollback()
+            return moved
+    
     def update_security_ids(self):
         """Update security_id column in history_data table for existing records"""
+        if self.refresh_history_layout() == HISTORY_LAYOUT_V2:
+            logging.info("history_data v2 derives security_id from stocks; nothing to update")
+            return 0
         try:
             # Find records with empty or NULL security_id
             self.cursor.execute("""
@@ -304,30 +1114,48 @@ class DatabaseHandler:
             logging.error(f"Error checking data existence: {e}")
             return False
 
-    def get_setting(self, key, default=None):
-        """Get a setting value from the database by key"""
+    def _load_settings(self):
+        """
+        Make sure the in-memory settings cache is current
+        
+        Reloads with one query when this connection has never loaded settings, or
+        when another connection has committed (PRAGMA data_version moved) and the
+        'settings' data version shows that the settings table changed.
+        
+        Returns:
+            True if the cache is usable
+        """
         try:
-            self.cursor.execute(
-                "SELECT value, value_type FROM settings WHERE key = ?", 
-                (key,)
-            )
-            result = self.cursor.fetchone()
+            self.cursor.execute("PRAGMA data_version")
+            data_version = self.cursor.fetchone()[0]
+            if self._settings is not None and data_version == self._settings_data_version:
+                return True
             
-            if result:
-                value, value_type = result
-                # Convert value based on its type
-                if value_type == 'int':
-                    return int(value)
-                elif value_type == 'float':
-                    return float(value)
-                elif value_type == 'bool':
-                    return value.lower() == 'true'
-                else:  # Treat as string by default
-                    return value
-            return default
+            settings_version = get_data_version(self.conn, 'settings')
+            if (self._settings is not None and settings_version is not None
+                    and settings_version == self._settings_version):
+                # Another connection wrote something else (e.g. candles)
+                self._settings_data_version = data_version
+                return True
+            
+            self.cursor.execute("SELECT key, value, value_type FROM settings")
+            self._settings = {
+                key: _convert_setting(key, value, value_type)
+                for key, value, value_type in self.cursor.fetchall()
+            }
+            self._settings_data_version = data_version
+            self._settings_version = settings_version
+            return True
         except sqlite3.Error as e:
-            logging.error(f"Error retrieving setting {key}: {e}")
+            logging.error(f"Error loading settings: {e}")
+            self._settings = None
+            return False
+    
+    def get_setting(self, key, default=None):
+        """Get a setting value by key (served from the settings cache)"""
+        if not self._load_settings():
             return default
+        return self._settings.get(key, default)
             
     def set_setting(self, key, value, description=None):
         """Save a setting value to the database"""
@@ -363,8 +1191,12 @@ class DatabaseHandler:
                 (key, value, value_type, description, last_updated)
                 VALUES (?, ?, ?, ?, ?)
             ''', (key, value_str, value_type, description, current_time))
+            # Tells other processes' settings caches to reload
+            self.bump_data_version('settings')
             
             self.conn.commit()
+            # This connection's own writes don't move PRAGMA data_version, so reload next read
+            self._settings = None
             return True
         except sqlite3.Error as e:
             logging.error(f"Error saving setting {key}: {e}")
@@ -372,40 +1204,19 @@ class DatabaseHandler:
             return False
             
     def get_all_settings(self):
-        """Get all settings as a dictionary"""
-        try:
-            self.cursor.execute("SELECT key, value, value_type FROM settings")
-            results = self.cursor.fetchall()
-            
-            settings = {}
-            for key, value, value_type in results:
-                # Convert value based on its type
-                if value_type == 'int':
-                    settings[key] = int(value)
-                elif value_type == 'float':
-                    settings[key] = float(value)
-                elif value_type == 'bool':
-                    settings[key] = value.lower() == 'true'
-                else:  # Treat as string by default
-                    settings[key] = value
-                    
-            return settings
-        except sqlite3.Error as e:
-            logging.error(f"Error retrieving all settings: {e}")
+        """Get all settings as a dictionary (served from the settings cache)"""
+        if not self._load_settings():
             return {}
+        return dict(self._settings)
             
     def add_to_watchlist(self, symbol):
         """Add a symbol to the watchlist"""
         try:
             # First, find the stock ID for this symbol
-            self.cursor.execute("SELECT id FROM stocks WHERE symbol = ?", (symbol,))
-            result = self.cursor.fetchone()
-            
-            if not result:
+            stock_id = self._registry().get_stock_id(symbol)
+            if stock_id is None:
                 logging.error(f"Symbol {symbol} not found in stocks table")
                 return False
-                
-            stock_id = result[0]
             current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
             # Insert into watchlist
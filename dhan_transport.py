@@ -0,0 +1,182 @@
+"""
+Shared HTTP transport for the Dhan API.
+
+Every Dhan client (the historical fetcher, the order placer and the security ID
+verifier) sends its requests through a DhanTransport, so TCP/TLS connections are
+kept alive and reused instead of being set up for every request. The transport
+also supplies the common headers, per-call timeouts, the retry policy and the
+rate limiting for each API family.
+
+Retries are split by family:
+- data and other read calls retry connection failures, read timeouts and 5xx
+  responses with exponential backoff
+- order calls (place / modify / cancel) are only retried when the connection
+  could not be opened, i.e. when the request cannot have reached Dhan, so an
+  order is never sent twice
+Only connection set-up is retried by the connection pool. Read errors and 5xx
+responses are retried by request() itself, so every attempt that reaches Dhan
+waits for the rate limiter and is counted by it. 429 responses are returned to
+the caller. Every response is also reported to
+the family's adaptive rate limiter, so a 429 slows down all callers of the
+family at once and the caller can simply try again through the limiter.
+"""
+
+import os
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from rate_limiter import get_rate_limiter
+
+# API root; can be pointed elsewhere (e.g. at mock_dhan_server.py) with the
+# DHAN_API_URL environment variable
+DHAN_API_URL = os.getenv("DHAN_API_URL", "https://api.dhan.co/v2")
+
+# Connections kept open per transport; at least the number of fetch workers
+POOL_SIZE = 16
+
+# (connect, read) timeouts in seconds
+DATA_TIMEOUT = (5, 30)
+ORDER_TIMEOUT = (5, 15)
+
+# Connection set-up retries, done by the connection pool: a request that could
+# not be connected was never sent, so it doesn't count against the rate limit
+DATA_RETRY = Retry(
+    total=3,
+    connect=3,
+    read=0,
+    status=0,
+    allowed_methods=None,  # historical data requests are POSTs but read-only
+    backoff_factor=0.5,
+    raise_on_status=False,
+)
+
+ORDER_RETRY = Retry(
+    total=2,
+    connect=2,
+    read=0,
+    status=0,
+    allowed_methods=None,
+    backoff_factor=0.2,
+    raise_on_status=False,
+)
+
+# Retries of requests that reached Dhan, done by DhanTransport.request():
+# (retries, retried statuses, retried methods (None for all), backoff factor)
+DATA_RESEND = (2, frozenset([500, 502, 503, 504]), None, 0.5)
+ORDER_RESEND = (2, frozenset([502, 503, 504]), frozenset(['GET']), 0.2)  # reads and 5xx only for GETs
+
+class DhanTransport:
+    def __init__(self, access_token=None, base_url=DHAN_API_URL, client_id=None):
+        """
+        Pooled keep-alive sessions for one set of Dhan credentials
+
+        Args:
+            access_token: Dhan access token, sent as the access-token header
+            base_url: API root that relative paths are joined to
+            client_id: Dhan client ID, sent as the client-id header if given
+        """
+        self.base_url = (base_url or DHAN_API_URL).rstrip('/')
+
+        # Header template applied to every request
+        self.headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+        if access_token:
+            self.headers["access-token"] = access_token
+        if client_id:
+            self.headers["client-id"] = str(client_id)
+
+        self.sessions = {
+            'data': self._session(DATA_RETRY),
+            'order': self._session(ORDER_RETRY),
+        }
+
+    def _session(self, retry):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry, pool_block=False)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def url(self, path):
+        """Absolute URL for an API path (full URLs are returned unchanged)"""
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, family='data', timeout=None, **kwargs):
+        """
+        Send a request through the pooled session for an API family
+
+        Args:
+            method: HTTP method
+            path: API path (e.g. "/charts/historical") or full URL
+            family: Dhan API family ('data', 'order', 'quote', 'non_trading'); sets the
+                    rate limit and, for 'order', the no-resend retry policy
+            timeout: (connect, read) timeout, defaults to the family's timeout
+            **kwargs: Passed to requests (json, params, headers, ...)
+
+        Returns:
+            requests.Response; connection errors raise requests.RequestException
+        """
+        session = self.sessions['order' if family == 'order' else 'data']
+        if timeout is None:
+            timeout = ORDER_TIMEOUT if family == 'order' else DATA_TIMEOUT
+
+        retries, statuses, methods, backoff = ORDER_RESEND if family == 'order' else DATA_RESEND
+        if methods is not None and method.upper() not in methods:
+            retries = 0
+
+        limiter = get_rate_limiter(family)
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff * (2 ** (attempt - 1)))
+            # Every attempt goes through the limiter, so retries are paced and counted too
+            limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = session.request(method, self.url(path), timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == retries:
+                    raise
+                logging.warning(f"{method} {path} failed ({e}); retrying ({attempt + 1}/{retries})")
+                continue
+            limiter.record(started, response.status_code, response.headers.get("Retry-After"))
+            logging.debug(f"{method} {path} -> {response.status_code} in {response.elapsed.total_seconds():.3f}s")
+            if response.status_code not in statuses or attempt == retries:
+                return response
+            logging.warning(f"{method} {path} -> {response.status_code}; retrying ({attempt + 1}/{retries})")
+            response.close()
+
+    def get(self, path, family='data', **kwargs):
+        return self.request("GET", path, family, **kwargs)
+
+    def post(self, path, family='data', **kwargs):
+        return self.request("POST", path, family, **kwargs)
+
+    def put(self, path, family='data', **kwargs):
+        return self.request("PUT", path, family, **kwargs)
+
+    def delete(self, path, family='data', **kwargs):
+        return self.request("DELETE", path, family, **kwargs)
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+
+# One transport per set of credentials, shared by every client in the process
+_transports = {}
+_transports_lock = threading.Lock()
+
+def get_transport(access_token=None, base_url=DHAN_API_URL, client_id=None):
+    """Get the process-wide transport for a set of Dhan credentials"""
+    key = (access_token, (base_url or DHAN_API_URL).rstrip('/'), client_id)
+    with _transports_lock:
+        if key not in _transports:
+            _transports[key] = DhanTransport(access_token, base_url, client_id)
+        return _transports[key]
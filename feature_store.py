@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Universe feature store.
+
+Keeps the AI model features (ai_feature_extractor.FEATURE_COLUMNS) of every
+stock and candle, so model inference and training read precomputed vectors
+instead of recomputing the rolling windows from raw candles. A vector per
+candle is several times the size of the candle itself, so the store lives in
+its own database file next to stock_data.db (<db name>_features.db) and never
+bloats the daily database:
+- feature_store: one float32 vector per (stock_id, day), as a BLOB
+- feature_store_stocks: each stock's watermark (last day stored and its close,
+  to notice corrected candles) and the parameters the features were built with
+
+The updates read the candles from the daily database with the feature file
+attached to the same connection as 'features'.
+
+Features run over the stock's whole history with the default signal
+parameters (SMA-50, RSI-14), so the first rows of any window already have an
+SMA and a settled MACD, which extract_features() on a short frame lacks.
+
+update_feature_store() appends the days after each stock's watermark only. It
+reads WARMUP_DAYS of candles before them, which covers the longest window and
+lets the EMAs settle below float32 precision, so appended vectors equal
+rebuilt ones. Stocks with corrected candles, without a watermark or built with
+other parameters are rebuilt from their history; rebuild_feature_store() does
+that for any set of stocks.
+
+Usage:
+    python feature_store.py              # append the new days of every stock
+    python feature_store.py --rebuild    # rebuild every stock from history
+"""
+
+import os
+import sys
+import logging
+import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from db_connection import connect_read_only
+from db_handler import DatabaseHandler
+from ohlcv_cache import date_to_day
+from signal_engine import rolling_mean, rsi
+from ai_feature_extractor import FEATURE_COLUMNS, feature_matrix
+from indicator_state import SMA_PERIOD, RSI_PERIOD
+from incremental_store import cli_parser, read_since, rebuild_in_chunks, run_cli, stale_stocks
+from instrument_registry import get_registry
+
+# Stores built with other parameters or columns are rebuilt
+FEATURE_PARAMS = f"{SMA_PERIOD}/{RSI_PERIOD}/{','.join(FEATURE_COLUMNS)}"
+
+# Calendar days read before a stock's watermark when appending: about 270
+# candles, after which the EMA-26 seed weighs less than 1e-9
+WARMUP_DAYS = 400
+
+# Stocks computed (and held in memory) at a time when rebuilding
+REBUILD_CHUNK_SIZE = 100
+
+VECTOR_BYTES = 4 * len(FEATURE_COLUMNS)
+
+# Tables of the feature database, created through the 'features' attachment
+FEATURE_TABLES_SQL = (
+    '''
+    CREATE TABLE IF NOT EXISTS features.feature_store (
+        stock_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        features BLOB NOT NULL,
+        PRIMARY KEY (stock_id, day)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS features.feature_store_stocks (
+        stock_id INTEGER PRIMARY KEY,
+        params TEXT NOT NULL,
+        last_day INTEGER NOT NULL,
+        last_close INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        updated TEXT
+    )
+    ''',
+)
+
+def features_db_path(db_path='stock_data.db'):
+    """Feature database file that sits next to the daily database"""
+    return os.path.splitext(os.path.abspath(db_path))[0] + '_features.db'
+
+def _connect(db_path):
+    """DatabaseHandler on the daily database with the feature database attached as 'features', or None"""
+    db = DatabaseHandler(db_path)
+    if not db.connect():
+        return None
+    try:
+        db.conn.execute("ATTACH DATABASE ? AS features", (features_db_path(db_path),))
+        db.conn.execute("PRAGMA features.journal_mode=WAL")
+        for sql in FEATURE_TABLES_SQL:
+            db.conn.execute(sql)
+        db.conn.commit()
+        return db
+    except sqlite3.Error as e:
+        logging.error(f"Feature database connection error: {e}")
+        db.close()
+        return None
+
+def compute_features(runs):
+    """
+    Feature matrices of several stocks in one pass
+
+    Args:
+        runs: List of (closes, volumes) arrays in day order (closes in paise)
+
+    Returns:
+        List of float32 (candles x FEATURE_COLUMNS) matrices, one per run
+    """
+    if not runs:
+        return []
+    # Bottom-aligned dates x stocks block with NaN above the shorter runs, the
+    # packed layout of signal_engine, so every run is computed as on its own
+    length = max(len(closes) for closes, _ in runs)
+    close = np.full((length, len(runs)), np.nan)
+    volume = np.full((length, len(runs)), np.nan)
+    for j, (closes, volumes) in enumerate(runs):
+        close[length - len(closes):, j] = np.asarray(closes) / 100
+        volume[length - len(volumes):, j] = volumes
+    features = feature_matrix(close, rolling_mean(close, SMA_PERIOD), rsi(close, RSI_PERIOD), volume)
+    return [features[length - len(closes):, j] for j, (closes, _) in enumerate(runs)]
+
+def load_watermarks(conn):
+    """{stock_id: (params, last_day, last_close)} of the stored stocks"""
+    return {row[0]: row[1:] for row in conn.execute(
+        "SELECT stock_id, params, last_day, last_close FROM features.feature_store_stocks"
+    )}
+
+def _save(conn, stock_id, days, closes, features, total_rows):
+    """Write a stock's new feature rows and its watermark (without committing)"""
+    data = np.ascontiguousarray(features, dtype=np.float32).tobytes()
+    conn.executemany(
+        "INSERT OR REPLACE INTO features.feature_store (stock_id, day, features) VALUES (?, ?, ?)",
+        [(stock_id, int(day), data[k * VECTOR_BYTES:(k + 1) * VECTOR_BYTES]) for k, day in enumerate(days)]
+    )
+    conn.execute('''
+        INSERT OR REPLACE INTO features.feature_store_stocks (stock_id, params, last_day, last_close, rows, updated)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (stock_id, FEATURE_PARAMS, int(days[-1]), int(closes[-1]), int(total_rows),
+          datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+def _rebuild_chunk(conn, chunk, runs):
+    """Rebuild and save the features of one chunk of stocks (rebuild_in_chunks() callback)"""
+    placeholders = ','.join('?' * len(chunk))
+    # Stocks without candles keep no features
+    conn.execute(f"DELETE FROM features.feature_store WHERE stock_id IN ({placeholders})", chunk)
+    conn.execute(f"DELETE FROM features.feature_store_stocks WHERE stock_id IN ({placeholders})", chunk)
+
+    matrices = compute_features([(closes, volumes) for _, _, closes, volumes in runs])
+    for (stock_id, days, closes, _), features in zip(runs, matrices):
+        _save(conn, stock_id, days, closes, features, len(days))
+    return sum(len(days) for _, days, _, _ in runs)
+
+def _rebuild(conn, stock_ids):
+    """Rebuild and save the features of some stocks; returns the number of rows written"""
+    return rebuild_in_chunks(conn, stock_ids, REBUILD_CHUNK_SIZE, _rebuild_chunk)
+
+def rebuild_feature_store(db_path='stock_data.db', stock_ids=None):
+    """
+    Rebuild the features of every stock (or the given ones) from history
+
+    Returns:
+        Number of feature rows written, or None on error
+    """
+    db = _connect(db_path)
+    if db is None:
+        return None
+    try:
+        if stock_ids is None:
+            db.conn.execute("DELETE FROM features.feature_store")
+            db.conn.execute("DELETE FROM features.feature_store_stocks")
+            stock_ids = [row[0] for row in db.conn.execute("SELECT id FROM stocks")]
+        written = _rebuild(db.conn, stock_ids)
+        db.conn.commit()
+        logging.info(f"Rebuilt {written} feature rows of {len(stock_ids)} stocks")
+        return written
+    except Exception as e:
+        logging.error(f"Error rebuilding feature store: {e}")
+        db.conn.rollback()
+        return None
+    finally:
+        db.close()
+
+def update_feature_store(db_path='stock_data.db', rebuild_ids=None):
+    """
+    Append the features of the candles stored after each stock's watermark
+
+    Args:
+        db_path: Database path
+        rebuild_ids: Stocks to rebuild from scratch instead (e.g. those whose
+                     candles were corrected by the update)
+
+    Returns:
+        dict with the number of stocks appended to, rows appended and rows
+        rebuilt, or None on error
+    """
+    db = _connect(db_path)
+    if db is None:
+        return None
+    conn = db.conn
+    try:
+        marks = load_watermarks(conn)
+        stale = stale_stocks(conn, {stock_id: mark[0] for stock_id, mark in marks.items()},
+                             FEATURE_PARAMS, rebuild_ids)
+
+        # Read the warm-up before each watermark with the new candles
+        runs, gone = read_since(conn, {stock_id: mark[1:] for stock_id, mark in marks.items()
+                                       if stock_id not in stale}, warmup_days=WARMUP_DAYS)
+        stale |= gone
+        pending = [run for run in runs if len(run[2]) > run[1] + 1]
+
+        totals = {'appended': 0, 'rows': 0, 'rebuilt': 0}
+        rows = dict(conn.execute("SELECT stock_id, rows FROM features.feature_store_stocks"))
+        matrices = compute_features([(closes, volumes) for _, _, _, closes, volumes in pending])
+        for (stock_id, i, days, closes, _), features in zip(pending, matrices):
+            new = len(days) - i - 1
+            _save(conn, stock_id, days[i + 1:], closes[i + 1:], features[i + 1:], rows.get(stock_id, 0) + new)
+            totals['appended'] += 1
+            totals['rows'] += new
+
+        if stale:
+            totals['rebuilt'] = _rebuild(conn, stale)
+        conn.commit()
+        logging.info(
+            f"Feature store: {totals['rows']} rows appended to {totals['appended']} stocks, "
+            f"{totals['rebuilt']} rows rebuilt"
+        )
+        return totals
+    except Exception as e:
+        logging.error(f"Error updating feature store: {e}")
+        conn.rollback()
+        return None
+    finally:
+        db.close()
+
+def read_features(conn, stock_ids=None, from_date=None, to_date=None):
+    """
+    Stored feature vectors of any set of stocks and dates
+
+    Args:
+        conn: Connection to the feature database (features_db_path())
+        stock_ids: Stocks to read (all stocks if None)
+        from_date, to_date: Date range (YYYY-MM-DD, inclusive), open-ended if None
+
+    Returns:
+        (stock_ids, days, matrix): int64 arrays and a float32 (rows x
+        FEATURE_COLUMNS) matrix, ordered by stock and day
+    """
+    conditions, params = [], []
+    if stock_ids is not None:
+        conditions.append(f"stock_id IN ({','.join('?' * len(stock_ids))})")
+        params += [int(stock_id) for stock_id in stock_ids]
+    if from_date:
+        conditions.append("day >= ?")
+        params.append(date_to_day(from_date))
+    if to_date:
+        conditions.append("day <= ?")
+        params.append(date_to_day(to_date))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = conn.execute(
+        f"SELECT stock_id, day, features FROM feature_store {where} ORDER BY stock_id, day", params
+    ).fetchall()
+
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    days = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    matrix = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.float32)
+    return ids, days, matrix.reshape(len(rows), len(FEATURE_COLUMNS))
+
+def frame_features(df, symbol=None, db_path='stock_data.db'):
+    """
+    Stored features of a stock's candle frame, in extract_features() form
+
+    Args:
+        df: Candles of one stock with a 'date' column (and 'symbol' / 'security_id')
+        symbol: The stock's symbol, if df has no 'symbol' column
+        db_path: Daily database path (for the instrument registry and the feature file next to it)
+
+    Returns:
+        DataFrame indexed like df with FEATURE_COLUMNS, or None if the stock
+        is unknown or the store lacks any of df's dates
+    """
+    if df is None or len(df) == 0 or 'date' not in df.columns:
+        return None
+    if not os.path.exists(features_db_path(db_path)):
+        return None
+    symbol = symbol or (df['symbol'].iloc[0] if 'symbol' in df.columns else None)
+    if not symbol:
+        return None
+    stocks = get_registry(db_path).get_all_by_symbol(symbol)
+    if 'security_id' in df.columns:
+        stocks = [stock for stock in stocks if str(stock.security_id) == str(df['security_id'].iloc[0])]
+    if len(stocks) != 1:
+        return None
+
+    wanted = np.array([str(date)[:10] for date in df['date']], dtype='datetime64[D]').astype(np.int64)
+    conn = connect_read_only(features_db_path(db_path))
+    try:
+        _, days, matrix = read_features(conn, [stocks[0].stock_id],
+                                        str(df['date'].iloc[0])[:10], str(df['date'].iloc[-1])[:10])
+    finally:
+        conn.close()
+    positions = np.searchsorted(days, wanted)
+    if len(days) == 0 or positions.max() >= len(days) or (days[positions] != wanted).any():
+        return None
+    return pd.DataFrame(matrix[positions], index=df.index, columns=list(FEATURE_COLUMNS))
+
+def main():
+    args = cli_parser('Maintain the AI feature store').parse_args()
+    return run_cli(args, update_feature_store, rebuild_feature_store)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,14 @@ from plotly.offline import plot
 import webbrowser
 from datetime import datetime, timedelta
 import argparse
+from db_connection import connect_read_write
+from ohlcv_cache import get_cache, date_to_day
+from panel_loader import load_panel
+from signal_engine import universe_signals, SIGNAL_COLUMNS
+from indicator_state import indicator_signals, state_is_current, SMA_PERIOD, RSI_PERIOD, RSI_THRESHOLD
+from signal_cache import get_signal_cache
+from instrument_registry import get_registry
+from intraday_store import IntradayStore
 
 # Import AI signal components
 try:
@@ -37,7 +45,7 @@ class SignalGenerator:
         # Initialize AI components if available
         if self.use_ai:
             try:
-                self.ai_signals = AIEnhancedSignalGenerator()
+                self.ai_signals = AIEnhancedSignalGenerator(db_path)
                 logging.info("AI signal generator initialized")
             except Exception as e:
                 self.use_ai = False
@@ -46,7 +54,7 @@ class SignalGenerator:
     def connect_db(self):
         """Connect to the SQLite database"""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = connect_read_write(self.db_path)
             logging.info(f"Connected to database: {self.db_path}")
             return True
         except sqlite3.Error as e:
@@ -59,7 +67,7 @@ class SignalGenerator:
             self.conn.close()
             logging.info("Database connection closed")
             
-    def get_stock_data(self, symbol=None, security_id=None, days=100):
+    def get_stock_data(self, symbol=None, security_id=None, days=100, interval=None):
         """
         Fetch historical stock data for the specified symbol or security_id
         
@@ -67,6 +75,7 @@ class SignalGenerator:
             symbol: Stock symbol (e.g., 'HDFCBANK')
             security_id: Security ID (e.g., 'INE040A01034')
             days: Number of days of historical data to fetch
+            interval: Bar size in minutes for intraday data (None for daily candles)
         
         Returns:
             DataFrame with historical price data
@@ -83,6 +92,9 @@ class SignalGenerator:
             from_date = start_date.strftime("%Y-%m-%d")
             to_date = end_date.strftime("%Y-%m-%d")
             
+            if interval:
+                return self._get_intraday_stock_data(symbol, security_id, interval, from_date, to_date)
+            
             # Build query parameters
             query_params = []
             conditions = []
@@ -99,6 +111,12 @@ class SignalGenerator:
                 logging.error("Either symbol or security_id must be provided")
                 return None
                 
+            # Serve from the memory-mapped OHLCV cache when it is up to date
+            df = self._get_cached_stock_data(symbol, security_id, from_date, to_date)
+            if df is not None:
+                logging.info(f"Retrieved {len(df)} cached data points for {symbol or security_id}")
+                return df
+            
             # Add date range
             query_params.extend([from_date, to_date])
             
@@ -127,6 +145,51 @@ class SignalGenerator:
             logging.error(f"Error fetching stock data: {e}")
             return None
             
+    def _get_intraday_stock_data(self, symbol, security_id, interval, from_date, to_date):
+        """Read a stock's intraday bars from the intraday store"""
+        stocks = self._find_stocks(symbol, security_id)
+        if not stocks:
+            logging.warning(f"Stock not found: {symbol or security_id}")
+            return None
+        
+        stock = stocks[0]
+        store = IntradayStore(daily_db_path=self.db_path)
+        if not store.connect():
+            return None
+        try:
+            df = store.get_bars(stock.stock_id, interval, from_date, to_date)
+        finally:
+            store.close()
+        if df is None:
+            logging.warning(f"No {interval}-minute bars found for {symbol or security_id}")
+            return None
+        
+        df['symbol'] = stock.symbol
+        df['name'] = stock.name
+        df['security_id'] = stock.security_id
+        logging.info(f"Retrieved {len(df)} {interval}-minute bars for {symbol or security_id}")
+        return df
+    
+    def _get_cached_stock_data(self, symbol, security_id, from_date, to_date):
+        """Read a stock's candles from the OHLCV cache, or return None if the cache can't serve them"""
+        cache = get_cache(self.db_path)
+        if not cache.is_fresh(self.conn):
+            return None
+            
+        stocks = self._find_stocks(symbol, security_id)
+        if len(stocks) != 1:
+            return None
+            
+        stock = stocks[0]
+        df = cache.get_frame(stock.stock_id, from_date, to_date)
+        if df is None or len(df) == 0:
+            return None
+            
+        df['symbol'] = stock.symbol
+        df['name'] = stock.name
+        df['security_id'] = stock.security_id
+        return df
+            
     def calculate_sma(self, df, period=50):
         """Calculate Simple Moving Average"""
         if df is None or len(df) < period:
@@ -571,21 +634,48 @@ class SignalGenerator:
         
         print("="*100)
         
-    def analyze_stock(self, symbol=None, security_id=None, days=100, show_chart=True):
-        """Analyze a stock and generate signals"""
-        # Get historical data
-        df = self.get_stock_data(symbol, security_id, days)
-        if df is None:
-            logging.error(f"Could not get data for {symbol or security_id}")
-            return None
-
-        # If AI is available, use it to optimize parameters
+    def analyze_stock(self, symbol=None, security_id=None, days=100, show_chart=True, df=None, interval=None):
+        """
+        Analyze a stock and generate signals (df: already loaded price data, optional;
+        interval: bar size in minutes to analyze intraday bars instead of daily candles)
+        """
         optimal_params = {
             'ma_period': 50,
             'rsi_period': 14,
             'rsi_threshold': 50
         }
         
+        # Daily signals with the default parameters are served from the signal
+        # cache while the stock's candles are unchanged (AI parameters and
+        # enhancements depend on more than the candles, so they are not cached)
+        cache, stock_id = None, None
+        if not interval and not self.use_ai:
+            stock_id = self._stock_id_for(symbol, security_id)
+            cache = get_signal_cache(self.db_path) if stock_id is not None else None
+        # The window is keyed by its first day: that of the candles passed in, else
+        # the start of the requested span (used again when the result is stored)
+        if df is not None and len(df):
+            from_day = date_to_day(df['date'].iloc[0])
+        else:
+            from_day = date_to_day((datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d"))
+        if cache:
+            last_day = cache.last_day(self.conn, stock_id) if df is None else date_to_day(df['date'].iloc[-1])
+            cached = cache.get(self.conn, stock_id, last_day, from_day, optimal_params)
+            if cached:
+                df_signals, signals = cached
+                logging.info(f"Using cached signals for {symbol or security_id}")
+                if show_chart and symbol:
+                    self._open_chart(df_signals, symbol)
+                return signals
+        
+        # Get historical data
+        if df is None:
+            df = self.get_stock_data(symbol, security_id, days, interval)
+        if df is None:
+            logging.error(f"Could not get data for {symbol or security_id}")
+            return None
+
+        # If AI is available, use it to optimize parameters
         if self.use_ai:
             try:
                 # Get optimal parameters for this stock
@@ -627,29 +717,58 @@ class SignalGenerator:
         else:
             signals = self.get_latest_signals(df_signals)
         
-        # Save signals to database
-        self.save_signals_to_db(signals)
+        # Save signals to database (stock_signals holds one daily signal per stock
+        # and date, so intraday signals are only returned)
+        if not interval:
+            self.save_signals_to_db(signals)
+        
+        if cache and signals:
+            cache.put(self.conn, stock_id, date_to_day(df_signals['date'].iloc[-1]), from_day,
+                      optimal_params, df_signals, signals)
         
         # Create chart if requested
         if show_chart and symbol:
-            if self.use_ai:
-                try:
-                    # Create AI-enhanced chart
-                    filename = self.ai_signals.create_ai_enhanced_chart(df_signals, symbol, sentiment_analysis)
-                except Exception as e:
-                    logging.error(f"Error creating AI-enhanced chart: {str(e)}. Falling back to traditional chart.")
-                    filename = self.create_signal_chart(df_signals, symbol)
-            else:
-                filename = self.create_signal_chart(df_signals, symbol)
-            
-            # Open the chart file in a browser
-            if filename and os.path.exists(filename):
-                try:
-                    webbrowser.open('file://' + os.path.abspath(filename))
-                except Exception as e:
-                    logging.error(f"Error opening browser: {e}")
+            self._open_chart(df_signals, symbol, sentiment_analysis)
         
         return signals
+    
+    def _open_chart(self, df_signals, symbol, sentiment_analysis=None):
+        """Create the signal chart (AI-enhanced if available) and open it in a browser"""
+        if self.use_ai:
+            try:
+                # Create AI-enhanced chart
+                filename = self.ai_signals.create_ai_enhanced_chart(df_signals, symbol, sentiment_analysis)
+            except Exception as e:
+                logging.error(f"Error creating AI-enhanced chart: {str(e)}. Falling back to traditional chart.")
+                filename = self.create_signal_chart(df_signals, symbol)
+        else:
+            filename = self.create_signal_chart(df_signals, symbol)
+        
+        # Open the chart file in a browser
+        if filename and os.path.exists(filename):
+            try:
+                webbrowser.open('file://' + os.path.abspath(filename))
+            except Exception as e:
+                logging.error(f"Error opening browser: {e}")
+    
+    def _find_stocks(self, symbol, security_id):
+        """Registry entries matching a symbol and/or security ID"""
+        registry = get_registry(self.db_path)
+        if symbol:
+            stocks = registry.get_all_by_symbol(symbol)
+            if security_id:
+                stocks = [stock for stock in stocks if str(stock.security_id) == str(security_id)]
+        else:
+            stock = registry.get_by_security_id(security_id)
+            stocks = [stock] if stock else []
+        return stocks
+    
+    def _stock_id_for(self, symbol, security_id):
+        """stock_id of a symbol / security ID, or None if it is unknown or ambiguous"""
+        if not self.conn and not self.connect_db():
+            return None
+        stocks = self._find_stocks(symbol, security_id)
+        return stocks[0].stock_id if len(stocks) == 1 else None
         
     def analyze_multiple_stocks(self, symbols=None, show_charts=False):
         """Analyze multiple stocks and generate signals for all of them"""
@@ -661,7 +780,7 @@ class SignalGenerator:
                     FROM stocks s
                     JOIN history_data h ON s.id = h.stock_id
                     GROUP BY s.id
-                    ORDER BY COUNT(h.id) DESC
+                    ORDER BY COUNT(*) DESC
                     LIMIT 50
                 """
                 df_stocks = pd.read_sql_query(query, self.conn)
@@ -670,15 +789,117 @@ class SignalGenerator:
                 logging.error(f"Error fetching stock list: {e}")
                 return []
         
+        # Without per-stock AI parameters or charts, the latest signals are read from
+        # the indicator state the nightly update keeps, while it is current
+        if not self.use_ai and not show_charts:
+            state_signals = self._state_signals(symbols)
+            if state_signals is not None:
+                signals_list = state_signals.to_dict('records')
+                for signals in signals_list:
+                    self.save_signals_to_db(signals)
+                return signals_list
+        
+        # Load every stock's prices in one pass instead of one query per symbol
+        try:
+            panel = load_panel(self.conn, symbols=symbols, days=100, db_path=self.db_path)
+        except sqlite3.Error as e:
+            logging.error(f"Error loading price panel: {e}")
+            panel = None
+        
+        # Without per-stock AI parameters or charts, the signals of all stocks
+        # come from one cross-sectional pass over the panel
+        if panel is not None and not self.use_ai and not show_charts:
+            signals_list = universe_signals(panel).to_dict('records')
+            for signals in signals_list:
+                self.save_signals_to_db(signals)
+            return signals_list
+        
         signals_list = []
         for symbol in symbols:
             logging.info(f"Analyzing {symbol}...")
-            signals = self.analyze_stock(symbol=symbol, show_chart=show_charts)
+            df = self._get_panel_stock_data(panel, symbol)
+            signals = self.analyze_stock(symbol=symbol, show_chart=show_charts, df=df)
             if signals:
                 signals_list.append(signals)
                 
         return signals_list
 
+    def scan_universe(self, symbols=None, days=100, sma_period=50, rsi_period=14, rsi_threshold=50,
+                      end_date=None):
+        """
+        Latest signals of every stock (or the given symbols) in one vectorized pass
+        
+        With the default parameters the signals are read from the indicator state
+        while it is current; it covers each stock's whole history.
+        
+        Args:
+            symbols: Stock symbols to scan (all stocks if None)
+            days: Calendar days of history to load
+            sma_period, rsi_period, rsi_threshold: Signal parameters
+            end_date: Last date to include (defaults to today)
+        
+        Returns:
+            DataFrame with one row per stock, as returned by signal_engine.universe_signals(),
+            or None on error
+        """
+        if not self.conn:
+            if not self.connect_db():
+                return None
+        if end_date is None and (sma_period, rsi_period, rsi_threshold) == (SMA_PERIOD, RSI_PERIOD, RSI_THRESHOLD):
+            signals = self._state_signals(symbols, days)
+            if signals is not None:
+                return signals
+        try:
+            panel = load_panel(self.conn, symbols=symbols, days=days, end_date=end_date, db_path=self.db_path)
+        except sqlite3.Error as e:
+            logging.error(f"Error loading price panel: {e}")
+            return None
+        if panel is None:
+            return None
+        return universe_signals(panel, sma_period, rsi_period, rsi_threshold)
+
+    def _state_signals(self, symbols=None, days=100):
+        """
+        Latest signals from the incremental indicator state (indicator_state.py)
+        
+        Args:
+            symbols: Stock symbols (all stocks if None)
+            days: Leave out stocks whose last candle is older than this many days
+        
+        Returns:
+            DataFrame with SIGNAL_COLUMNS, or None if the state is behind the stored
+            candles (the caller then computes the signals from the candles)
+        """
+        try:
+            if not state_is_current(self.conn):
+                return None
+            stock_ids = None
+            if symbols:
+                stock_ids = [row[0] for row in self.conn.execute(
+                    f"SELECT id FROM stocks WHERE symbol IN ({','.join('?' * len(symbols))})", list(symbols)
+                )]
+            signals = indicator_signals(self.conn, stock_ids)
+        except sqlite3.Error as e:
+            logging.error(f"Error reading indicator state: {e}")
+            return None
+        since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+        return signals.loc[signals['date'] >= since, list(SIGNAL_COLUMNS)].reset_index(drop=True)
+    
+    def _get_panel_stock_data(self, panel, symbol):
+        """Take one stock's frame from a loaded panel, or return None to fall back to get_stock_data"""
+        if panel is None:
+            return None
+        col = panel.symbol_column(symbol)
+        if col is None:
+            return None
+        df = panel.frame(panel.stock_ids[col])
+        if len(df) == 0:
+            return None
+        df['symbol'] = panel.symbols[col]
+        df['name'] = panel.names[col]
+        df['security_id'] = panel.security_ids[col]
+        return df
+
     def save_signals_to_db(self, signals):
         """Save signals to the database
         
@@ -704,14 +925,10 @@ class SignalGenerator:
             cursor = self.conn.cursor()
             
             # Get stock_id for the symbol
-            cursor.execute("SELECT id FROM stocks WHERE symbol = ?", (signals.get('symbol'),))
-            result = cursor.fetchone()
-            
-            if not result:
+            stock_id = get_registry(self.db_path).get_stock_id(signals.get('symbol'))
+            if stock_id is None:
                 logging.warning(f"Stock not found for symbol: {signals.get('symbol')}")
                 return False
-                
-            stock_id = result[0]
             
             # Check if this signal already exists for this date
             cursor.execute(
@@ -789,19 +1006,28 @@ def main():
     parser.add_argument('--days', type=int, default=100, help='Number of days of historical data')
     parser.add_argument('--list', action='store_true', help='Analyze all available stocks')
     parser.add_argument('--no-chart', action='store_true', help='Do not show charts')
+    parser.add_argument('--interval', type=int, help='Analyze intraday bars of this many minutes instead of daily candles')
+    parser.add_argument('--scan', action='store_true', help='Scan every stock in one vectorized pass and list the buy signals')
     
     args = parser.parse_args()
     
     signal_gen = SignalGenerator()
     
     try:
-        if args.list:
+        if args.scan:
+            signals = signal_gen.scan_universe(days=args.days)
+            if signals is not None:
+                buys = signals[signals['combined_signal'] > 0]
+                print(f"Scanned {len(signals)} stocks: {len(buys)} buy signals")
+                signal_gen.print_signals_summary(buys.to_dict('records'))
+        elif args.list:
             # Analyze top stocks
             signals_list = signal_gen.analyze_multiple_stocks(show_charts=not args.no_chart)
             signal_gen.print_signals_summary(signals_list)
         elif args.symbol:
             # Analyze single stock
-            signals = signal_gen.analyze_stock(symbol=args.symbol, days=args.days, show_chart=not args.no_chart)
+            signals = signal_gen.analyze_stock(symbol=args.symbol, days=args.days, show_chart=not args.no_chart,
+                                               interval=args.interval)
             if signals:
                 signal_gen.print_signals_summary([signals])
         else:
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Scaffolding shared by the per-stock stores derived from the candle history
+(indicator_state, feature_store).
+
+Each store keeps a watermark per stock: the last day it covers, that day's
+close (to notice a corrected candle) and the parameters it was built with. An
+update reads the candles from each watermark on with read_since() and extends
+the stock, or rebuilds it when the watermark no longer matches its history;
+rebuilds read the history a chunk of stocks at a time with rebuild_in_chunks().
+"""
+
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from db_handler import (
+    DatabaseHandler, get_history_layout, HISTORY_LAYOUT_V2, HISTORY_V2_TABLE, HISTORY_ALL_VIEW,
+    list_history_partitions, history_day_sql, history_paise_sql
+)
+from ohlcv_cache import days_to_dates
+
+# Stocks whose watermark is this many days behind the newest one are read one
+# by one, so a delisted stock doesn't make every update scan old partitions
+LAGGARD_DAYS = 31
+
+def read_candles(conn, since_day=None, stock_ids=None):
+    """
+    Closes (paise) and volumes of the candles on or after since_day
+
+    On the v2 layout only the hot table and the partitions that reach since_day
+    are read.
+
+    Returns:
+        (stock_ids, days, closes, volumes) int64 arrays ordered by stock and day
+    """
+    conditions, params = [], []
+    if stock_ids is not None:
+        conditions.append(f"stock_id IN ({','.join('?' * len(stock_ids))})")
+        params += [int(stock_id) for stock_id in stock_ids]
+
+    if get_history_layout(conn) == HISTORY_LAYOUT_V2:
+        if since_day is not None:
+            conditions.append("day >= ?")
+            params.append(int(since_day))
+            tables = [HISTORY_V2_TABLE] + [name for name, _, last_day in list_history_partitions(conn)
+                                           if last_day >= since_day]
+        else:
+            tables = [HISTORY_ALL_VIEW]
+        where = f"WHERE {' AND '.join(conditions)} AND close IS NOT NULL" if conditions else "WHERE close IS NOT NULL"
+        selects = [f"SELECT stock_id, day, close, volume FROM {table} {where}" for table in tables]
+        query = " UNION ALL ".join(selects)
+        params = params * len(tables)
+    else:
+        if since_day is not None:
+            conditions.append("date >= ?")
+            params.append(days_to_dates([since_day])[0])
+        where = " AND ".join(conditions + ["close IS NOT NULL"])
+        query = f'''
+            SELECT stock_id, {history_day_sql('date', 'timestamp')} AS day,
+                   {history_paise_sql('close')} AS close, volume
+            FROM history_data WHERE {where}
+        '''
+
+    df = pd.read_sql_query(f"SELECT stock_id, day, close, volume FROM ({query}) ORDER BY stock_id, day",
+                           conn, params=params)
+    df['volume'] = df['volume'].fillna(0)
+    return tuple(df[name].to_numpy(dtype=np.int64) for name in ('stock_id', 'day', 'close', 'volume'))
+
+def split_by_stock(stock_ids):
+    """(stock_id, start, stop) for each run of a sorted stock_id array"""
+    if len(stock_ids) == 0:
+        return []
+    starts = np.flatnonzero(np.r_[True, stock_ids[1:] != stock_ids[:-1]])
+    stops = np.r_[starts[1:], len(stock_ids)]
+    return [(int(stock_ids[start]), start, stop) for start, stop in zip(starts, stops)]
+
+def stale_stocks(conn, stored_params, params, rebuild_ids=None):
+    """
+    Stocks a store has to rebuild from scratch
+
+    Args:
+        conn: Database connection
+        stored_params: {stock_id: params} of the stocks the store holds
+        params: The store's current parameters
+        rebuild_ids: Stocks to rebuild regardless (e.g. those with corrected candles)
+
+    Returns:
+        set of the rebuild_ids, the stocks the store lacks and those built with other parameters
+    """
+    stale = {int(stock_id) for stock_id in rebuild_ids or ()}
+    stale |= {row[0] for row in conn.execute("SELECT id FROM stocks") if row[0] not in stored_params}
+    stale |= {stock_id for stock_id, stored in stored_params.items() if stored != params}
+    return stale
+
+def read_since(conn, watermarks, warmup_days=0):
+    """
+    Candles of each stock from its watermark on
+
+    Args:
+        conn: Database connection
+        watermarks: {stock_id: (last_day, last_close)} of the stocks to extend
+        warmup_days: Calendar days read before each watermark as well
+
+    Returns:
+        (runs, stale): runs is a list of (stock_id, i, days, closes, volumes)
+        with the stock's candles from warmup_days before its watermark, where
+        i is the position of the watermark candle; stale is the set of stocks
+        whose watermark candle is gone or was corrected
+    """
+    reads = []
+    if watermarks:
+        newest = max(last_day for last_day, _ in watermarks.values())
+        recent = [last_day for last_day, _ in watermarks.values() if last_day >= newest - LAGGARD_DAYS]
+        reads.append(read_candles(conn, since_day=min(recent) - warmup_days))
+        for stock_id, (last_day, _) in watermarks.items():
+            if last_day < newest - LAGGARD_DAYS:
+                reads.append(read_candles(conn, since_day=last_day - warmup_days, stock_ids=[stock_id]))
+
+    runs = []
+    seen = set()
+    stale = set()
+    for ids, days, closes, volumes in reads:
+        for stock_id, start, stop in split_by_stock(ids):
+            if stock_id not in watermarks or stock_id in seen:
+                continue
+            seen.add(stock_id)
+            last_day, last_close = watermarks[stock_id]
+            first = start + int(np.searchsorted(days[start:stop], last_day - warmup_days))
+            i = start + int(np.searchsorted(days[start:stop], last_day))
+            if i >= stop or days[i] != last_day or closes[i] != last_close:
+                stale.add(stock_id)
+            else:
+                runs.append((stock_id, i - first, days[first:stop], closes[first:stop], volumes[first:stop]))
+    # A stock whose watermark candle is gone no longer matches the history
+    stale |= set(watermarks) - seen
+    return runs, stale
+
+def rebuild_in_chunks(conn, stock_ids, chunk_size, rebuild_chunk):
+    """
+    Rebuild some stocks from their whole history, chunk_size stocks at a time
+
+    Args:
+        conn: Database connection
+        stock_ids: Stocks to rebuild
+        chunk_size: Stocks read (and held in memory) at a time
+        rebuild_chunk: Called with (conn, chunk, runs) per chunk, where runs
+                       is a list of (stock_id, days, closes, volumes) of the
+                       chunk's stocks that have candles; returns a count
+
+    Returns:
+        Sum of the counts returned by rebuild_chunk
+    """
+    stock_ids = sorted(int(stock_id) for stock_id in stock_ids)
+    total = 0
+    for i in range(0, len(stock_ids), chunk_size):
+        chunk = stock_ids[i:i + chunk_size]
+        ids, days, closes, volumes = read_candles(conn, stock_ids=chunk)
+        runs = [(stock_id, days[start:stop], closes[start:stop], volumes[start:stop])
+                for stock_id, start, stop in split_by_stock(ids)]
+        total += rebuild_chunk(conn, chunk, runs)
+    return total
+
+def cli_parser(description):
+    """Argument parser with the --db, --rebuild and --symbols options of a store's command line"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--db', default='stock_data.db', help='Database path')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild every stock from history')
+    parser.add_argument('--symbols', nargs='*', help='With --rebuild, only rebuild these symbols')
+    return parser
+
+def run_cli(args, update, rebuild):
+    """
+    Run a store's update, or its rebuild with --rebuild
+
+    Args:
+        args: Arguments parsed with cli_parser()
+        update: Called with the database path
+        rebuild: Called with the database path and the stock ids (None for every stock)
+
+    Returns:
+        Exit code
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if not args.rebuild:
+        return 0 if update(args.db) is not None else 1
+    stock_ids = None
+    if args.symbols:
+        db = DatabaseHandler(args.db)
+        if not db.connect():
+            return 1
+        wanted = {symbol.upper() for symbol in args.symbols}
+        stock_ids = [stock[0] for stock in db.get_all_stocks() if str(stock[3]).upper() in wanted]
+        db.close()
+    return 0 if rebuild(args.db, stock_ids) is not None else 1
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Incremental indicator state.
+
+Keeps, per stock, everything needed to advance the signal indicators by one
+candle in constant time, in the indicator_state table:
+- the last closes (enough for the longest window) and the SMA-50 window sum
+- the RSI-14 gain and loss sums
+- the EMA-12 / EMA-26 values and the EMA-9 signal line of the MACD
+- the Price_Above_MA / RSI_Above_50 flags and the last two crossover values
+
+Closes and window sums are integer paise, so adding the entering value and
+subtracting the leaving one never drifts, and the crossover tests compare
+exact integers (close * 50 > window sum, 100 * gains > 50 * (gains + losses)).
+The SMA / RSI flags match SignalGenerator.generate_signals() on the stock's
+last candles; the EMAs run over the stock's whole stored history.
+
+update_indicator_state() folds only the candles after each stock's last_day
+into its state, so the nightly refresh costs time per new candle rather than
+per candle of history. It records the history version it caught up with, and
+while no candles have been written since (state_is_current()), the signal
+scans read indicator_signals() instead of recomputing from the candles. A stock whose stored last candle no longer matches its
+history (a corrected candle), a stock without state and a state built with
+other periods are rebuilt from scratch; rebuild_indicator_state() does that
+for any set of stocks.
+
+Usage:
+    python indicator_state.py              # advance every stock's state
+    python indicator_state.py --rebuild    # rebuild every stock's state from history
+    python indicator_state.py --signals    # print the current buy signals
+"""
+
+import sys
+import logging
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from db_handler import DatabaseHandler, get_data_version
+from ohlcv_cache import days_to_dates
+from incremental_store import cli_parser, read_since, rebuild_in_chunks, run_cli, stale_stocks
+from signal_engine import SIGNAL_COLUMNS
+
+SMA_PERIOD = 50
+RSI_PERIOD = 14
+RSI_THRESHOLD = 50
+
+# MACD: fast and slow EMA spans, and the span of the signal line
+EMA_FAST_SPAN = 12
+EMA_SLOW_SPAN = 26
+MACD_SIGNAL_SPAN = 9
+
+# Closes kept per stock: the longest window, which also holds the close leaving it
+STATE_WINDOW = max(SMA_PERIOD, RSI_PERIOD + 1)
+
+# States built with other periods are rebuilt
+STATE_PARAMS = f"{SMA_PERIOD}/{RSI_PERIOD}/{RSI_THRESHOLD}/{EMA_FAST_SPAN}/{EMA_SLOW_SPAN}/{MACD_SIGNAL_SPAN}"
+
+INDICATOR_STATE_COLUMNS = (
+    'stock_id', 'params', 'last_day', 'candles', 'closes', 'sma_sum', 'gain_sum', 'loss_sum',
+    'ema_fast', 'ema_slow', 'macd_signal', 'price_above_ma', 'rsi_above', 'ma_signal', 'prev_ma_signal',
+    'rsi_signal', 'prev_rsi_signal', 'combined_signal', 'volume', 'updated'
+)
+
+# Extra columns of indicator_signals() after SIGNAL_COLUMNS
+MACD_COLUMNS = ('ema_12', 'ema_26', 'macd', 'macd_signal')
+
+# Stocks read per statement when rebuilding
+REBUILD_CHUNK_SIZE = 500
+
+# data_versions row holding the 'history' version every state was last brought
+# up to date with; the states are current while the two match
+STATE_VERSION_NAME = 'indicator_state_history'
+
+def _ema_step(previous, value, span):
+    # pandas ewm(span=span, adjust=False): the first value starts the average
+    if previous is None:
+        return value
+    alpha = 2.0 / (span + 1)
+    return (1 - alpha) * previous + alpha * value
+
+class IndicatorState:
+    def __init__(self, stock_id):
+        """Indicator state of one stock before its first candle"""
+        self.stock_id = int(stock_id)
+        self.params = STATE_PARAMS
+        self.last_day = None
+        self.candles = 0
+        self.closes = []
+        self.sma_sum = 0
+        self.gain_sum = 0
+        self.loss_sum = 0
+        self.ema_fast = None
+        self.ema_slow = None
+        self.macd_signal = None
+        self.price_above_ma = 0
+        self.rsi_above = 0
+        self.ma_signal = None
+        self.prev_ma_signal = None
+        self.rsi_signal = None
+        self.prev_rsi_signal = None
+        self.combined_signal = 0
+        self.volume = None
+
+    @classmethod
+    def from_row(cls, row):
+        """State from an indicator_state row (INDICATOR_STATE_COLUMNS order)"""
+        values = dict(zip(INDICATOR_STATE_COLUMNS, row))
+        state = cls(values.pop('stock_id'))
+        values.pop('updated')
+        values['closes'] = np.frombuffer(values['closes'], dtype=np.int64).tolist()
+        state.__dict__.update(values)
+        return state
+
+    def to_row(self, updated):
+        """indicator_state row (INDICATOR_STATE_COLUMNS order)"""
+        values = dict(self.__dict__, updated=updated)
+        values['closes'] = np.array(self.closes, dtype=np.int64).tobytes()
+        return tuple(values[name] for name in INDICATOR_STATE_COLUMNS)
+
+    @property
+    def sma(self):
+        """SMA in rupees, or NaN before SMA_PERIOD candles"""
+        return self.sma_sum / SMA_PERIOD / 100 if self.candles >= SMA_PERIOD else np.nan
+
+    @property
+    def rsi(self):
+        """RSI from the simple averages of gains and losses, NaN where calculate_rsi() gives NaN"""
+        if self.candles < RSI_PERIOD + 1 or self.gain_sum + self.loss_sum == 0:
+            return np.nan
+        if self.loss_sum == 0:
+            return 100.0
+        return 100 - 100 / (1 + self.gain_sum / self.loss_sum)
+
+    def _flags(self):
+        # Price_Above_MA and RSI_Above_50 of the last candle, in exact integer arithmetic
+        close = self.closes[-1]
+        above = int(self.candles >= SMA_PERIOD and close * SMA_PERIOD > self.sma_sum)
+        rsi_above = int(self.candles >= RSI_PERIOD + 1 and
+                        100 * self.gain_sum > RSI_THRESHOLD * (self.gain_sum + self.loss_sum))
+        return above, rsi_above
+
+    def advance(self, day, close, volume=None):
+        """
+        Fold one new candle into the state
+
+        Args:
+            day: Trading day (days since 1970-01-01), after last_day
+            close: Close in integer paise
+            volume: Volume of the candle
+        """
+        close = int(close)
+        closes = self.closes
+        if closes:
+            delta = close - closes[-1]
+            self.gain_sum += max(delta, 0)
+            self.loss_sum += max(-delta, 0)
+            # The change leaving the RSI window
+            if len(closes) > RSI_PERIOD:
+                leaving = closes[-RSI_PERIOD] - closes[-RSI_PERIOD - 1]
+                self.gain_sum -= max(leaving, 0)
+                self.loss_sum -= max(-leaving, 0)
+        # The close leaving the SMA window
+        self.sma_sum += close
+        if len(closes) >= SMA_PERIOD:
+            self.sma_sum -= closes[-SMA_PERIOD]
+        closes.append(close)
+        del closes[:-STATE_WINDOW]
+        self.candles += 1
+        self.last_day = int(day)
+        self.volume = None if volume is None else int(volume)
+
+        value = close / 100
+        self.ema_fast = _ema_step(self.ema_fast, value, EMA_FAST_SPAN)
+        self.ema_slow = _ema_step(self.ema_slow, value, EMA_SLOW_SPAN)
+        self.macd_signal = _ema_step(self.macd_signal, self.ema_fast - self.ema_slow, MACD_SIGNAL_SPAN)
+
+        above, rsi_above = self._flags()
+        first = self.candles == 1
+        self.prev_ma_signal, self.ma_signal = self.ma_signal, None if first else above - self.price_above_ma
+        self.prev_rsi_signal, self.rsi_signal = self.rsi_signal, None if first else rsi_above - self.rsi_above
+        self.price_above_ma, self.rsi_above = above, rsi_above
+        self.combined_signal = int((self.ma_signal or 0) > 0 and (self.rsi_signal or 0) > 0)
+
+def build_state(stock_id, days, closes, volumes):
+    """
+    State of a stock from its whole history
+
+    The window sums and EMAs of all but the last few candles are computed with
+    array operations, and the last candles are folded in with advance(), so a
+    rebuilt state is the same as one advanced candle by candle.
+
+    Args:
+        days, closes, volumes: The stock's candles in day order (closes in paise)
+
+    Returns:
+        IndicatorState, or None if there are no candles
+    """
+    n = len(closes)
+    if n == 0:
+        return None
+    state = IndicatorState(stock_id)
+    # The last two crossovers need the flags of the three candles before them
+    head = max(0, n - 3)
+    if head:
+        prefix = np.asarray(closes[:head], dtype=np.int64)
+        state.candles = head
+        state.last_day = int(days[head - 1])
+        state.closes = prefix[-STATE_WINDOW:].tolist()
+        state.sma_sum = int(prefix[-SMA_PERIOD:].sum())
+        deltas = np.diff(prefix)[-RSI_PERIOD:]
+        state.gain_sum = int(deltas[deltas > 0].sum())
+        state.loss_sum = int(-deltas[deltas < 0].sum())
+
+        values = pd.Series(prefix / 100)
+        ema_fast = values.ewm(span=EMA_FAST_SPAN, adjust=False).mean()
+        ema_slow = values.ewm(span=EMA_SLOW_SPAN, adjust=False).mean()
+        signal = (ema_fast - ema_slow).ewm(span=MACD_SIGNAL_SPAN, adjust=False).mean()
+        state.ema_fast = float(ema_fast.iloc[-1])
+        state.ema_slow = float(ema_slow.iloc[-1])
+        state.macd_signal = float(signal.iloc[-1])
+        state.price_above_ma, state.rsi_above = state._flags()
+    for i in range(head, n):
+        state.advance(days[i], closes[i], volumes[i])
+    return state
+
+def load_states(conn, stock_ids=None):
+    """Stored states by stock_id (all stocks, or the given ones)"""
+    query = f"SELECT {', '.join(INDICATOR_STATE_COLUMNS)} FROM indicator_state"
+    params = []
+    if stock_ids is not None:
+        query += f" WHERE stock_id IN ({','.join('?' * len(stock_ids))})"
+        params = [int(stock_id) for stock_id in stock_ids]
+    return {row[0]: IndicatorState.from_row(row) for row in conn.execute(query, params)}
+
+def save_states(conn, states):
+    """Write states (without committing)"""
+    updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany(
+        f"INSERT OR REPLACE INTO indicator_state ({', '.join(INDICATOR_STATE_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(INDICATOR_STATE_COLUMNS))})",
+        [state.to_row(updated) for state in states]
+    )
+
+def _rebuild_chunk(conn, chunk, runs):
+    """Rebuild and save the states of one chunk of stocks (rebuild_in_chunks() callback)"""
+    states = [build_state(stock_id, days, closes, volumes) for stock_id, days, closes, volumes in runs]
+    # Stocks without candles keep no state
+    conn.execute(f"DELETE FROM indicator_state WHERE stock_id IN ({','.join('?' * len(chunk))})", chunk)
+    save_states(conn, states)
+    return len(states)
+
+def _rebuild(conn, stock_ids):
+    """Rebuild and save the states of some stocks; returns the number rebuilt"""
+    return rebuild_in_chunks(conn, stock_ids, REBUILD_CHUNK_SIZE, _rebuild_chunk)
+
+def _mark_current(conn, history_version):
+    """Record that every state matches the given history version (without committing)"""
+    if history_version is None:
+        return
+    conn.execute(
+        "INSERT OR REPLACE INTO data_versions (name, version, last_updated) VALUES (?, ?, ?)",
+        (STATE_VERSION_NAME, history_version, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+
+def state_is_current(conn):
+    """True if the states include every stored candle, i.e. no history was written since the last update"""
+    history_version = get_data_version(conn, 'history')
+    if history_version is None:
+        return False
+    row = conn.execute("SELECT version FROM data_versions WHERE name = ?", (STATE_VERSION_NAME,)).fetchone()
+    return row is not None and row[0] == history_version
+
+def rebuild_indicator_state(db_path='stock_data.db', stock_ids=None):
+    """
+    Rebuild the state of every stock (or the given ones) from its whole history,
+    e.g. after history was corrected
+
+    Returns:
+        Number of stocks rebuilt, or None on error
+    """
+    db = DatabaseHandler(db_path)
+    if not db.connect():
+        return None
+    try:
+        history_version = get_data_version(db.conn, 'history')
+        rebuild_all = stock_ids is None
+        if rebuild_all:
+            stock_ids = [row[0] for row in db.conn.execute("SELECT id FROM stocks")]
+        rebuilt = _rebuild(db.conn, stock_ids)
+        if rebuild_all:
+            _mark_current(db.conn, history_version)
+        db.conn.commit()
+        logging.info(f"Rebuilt indicator state of {rebuilt} stocks")
+        return rebuilt
+    except Exception as e:
+        logging.error(f"Error rebuilding indicator state: {e}")
+        db.conn.rollback()
+        return None
+    finally:
+        db.close()
+
+def update_indicator_state(db_path='stock_data.db', rebuild_ids=None):
+    """
+    Advance every stock's state by the candles stored after its last_day
+
+    Args:
+        db_path: Database path
+        rebuild_ids: Stocks to rebuild from scratch instead (e.g. those whose
+                     candles were corrected by the update)
+
+    Returns:
+        dict with the number of stocks advanced, candles folded in and stocks
+        rebuilt, or None on error
+    """
+    db = DatabaseHandler(db_path)
+    if not db.connect():
+        return None
+    conn = db.conn
+    try:
+        # Read before the candles: a write made during the update leaves the states marked stale
+        history_version = get_data_version(conn, 'history')
+        states = load_states(conn)
+        stale = stale_stocks(conn, {stock_id: state.params for stock_id, state in states.items()},
+                             STATE_PARAMS, rebuild_ids)
+        current = {stock_id: state for stock_id, state in states.items() if stock_id not in stale}
+
+        # Read from each state's last candle on, so a corrected last candle is noticed
+        runs, gone = read_since(conn, {stock_id: (state.last_day, state.closes[-1])
+                                       for stock_id, state in current.items()})
+        stale |= gone
+
+        changed = []
+        totals = {'advanced': 0, 'candles': 0, 'rebuilt': 0}
+        for stock_id, i, days, closes, volumes in runs:
+            state = current[stock_id]
+            for j in range(i + 1, len(days)):
+                state.advance(days[j], closes[j], volumes[j])
+            if len(days) > i + 1:
+                changed.append(state)
+                totals['advanced'] += 1
+                totals['candles'] += len(days) - i - 1
+
+        save_states(conn, changed)
+        if stale:
+            totals['rebuilt'] = _rebuild(conn, stale)
+        _mark_current(conn, history_version)
+        conn.commit()
+        logging.info(
+            f"Indicator state: {totals['advanced']} stocks advanced by {totals['candles']} candles, "
+            f"{totals['rebuilt']} rebuilt"
+        )
+        return totals
+    except Exception as e:
+        logging.error(f"Error updating indicator state: {e}")
+        conn.rollback()
+        return None
+    finally:
+        db.close()
+
+def indicator_signals(conn, stock_ids=None):
+    """
+    Latest signals of every stock (or the given ones) from its stored state
+
+    The signals are those of the state's last candle; check state_is_current()
+    first to be sure no candles were stored since.
+
+    Returns:
+        DataFrame with SIGNAL_COLUMNS (as signal_engine.universe_signals()) plus
+        MACD_COLUMNS, for the stocks with enough candles for both indicators
+    """
+    states = load_states(conn, stock_ids)
+    stocks = {row[0]: row[1:] for row in conn.execute("SELECT id, symbol, name, security_id FROM stocks")}
+    records = []
+    for stock_id, state in sorted(states.items()):
+        if stock_id not in stocks or state.params != STATE_PARAMS:
+            continue
+        if state.candles < max(SMA_PERIOD, RSI_PERIOD + 1, 2):
+            continue
+        symbol, name, security_id = stocks[stock_id]
+        close, previous = state.closes[-1] / 100, state.closes[-2] / 100
+        ma_signal, rsi_signal = state.ma_signal or 0, state.rsi_signal or 0
+        recent_ma = ma_signal != 0 or (state.prev_ma_signal or 0) != 0
+        recent_rsi = rsi_signal != 0 or (state.prev_rsi_signal or 0) != 0
+        combined_desc = 'STRONG BUY' if state.combined_signal > 0 else 'NEUTRAL'
+        if combined_desc == 'STRONG BUY' and recent_ma and recent_rsi:
+            combined_desc = 'FRESH STRONG BUY'
+        macd = state.ema_fast - state.ema_slow
+        records.append({
+            'stock_id': stock_id,
+            'date': days_to_dates([state.last_day])[0],
+            'symbol': symbol,
+            'name': name,
+            'security_id': security_id,
+            'close': close,
+            'ma_50': state.sma,
+            'rsi': state.rsi,
+            'price_vs_ma': 'ABOVE' if state.price_above_ma else 'BELOW',
+            'ma_signal': float(ma_signal),
+            'rsi_signal': float(rsi_signal),
+            'combined_signal': state.combined_signal,
+            'ma_signal_desc': 'BUY' if ma_signal > 0 else 'SELL' if ma_signal < 0 else 'NEUTRAL',
+            'rsi_signal_desc': 'BUY' if rsi_signal > 0 else 'SELL' if rsi_signal < 0 else 'NEUTRAL',
+            'combined_signal_desc': combined_desc,
+            'recent_ma_crossover': recent_ma,
+            'recent_rsi_crossover': recent_rsi,
+            'change_percent': (close - previous) / previous * 100 if previous > 0 else 0.0,
+            'volume': state.volume or 0,
+            'ema_12': state.ema_fast,
+            'ema_26': state.ema_slow,
+            'macd': macd,
+            'macd_signal': state.macd_signal,
+        })
+    return pd.DataFrame(records, columns=list(SIGNAL_COLUMNS + MACD_COLUMNS))
+
+def main():
+    parser = cli_parser('Maintain the incremental indicator state')
+    parser.add_argument('--signals', action='store_true', help='Print the buy signals of the current state')
+    args = parser.parse_args()
+
+    status = run_cli(args, update_indicator_state, rebuild_indicator_state)
+    if status:
+        return status
+
+    if args.signals:
+        db = DatabaseHandler(args.db)
+        if not db.connect():
+            return 1
+        signals = indicator_signals(db.conn)
+        db.close()
+        buys = signals[signals['combined_signal'] > 0]
+        print(f"{len(signals)} stocks, {len(buys)} buy signals")
+        for row in buys.itertuples():
+            print(f"{row.symbol:<12} {row.date} close {row.close:>10.2f} SMA-50 {row.ma_50:>10.2f} "
+                  f"RSI {row.rsi:>6.2f} MACD {row.macd:>8.2f} {row.combined_signal_desc}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
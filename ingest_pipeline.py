@@ -0,0 +1,274 @@
+"""
+Pipelined history ingestion: fetch -> parse -> write.
+
+Instead of fetching, parsing and committing one stock at a time, the stages run
+concurrently and are connected by bounded queues:
+- fetch workers call the API (paced by the shared rate limiter) and push the
+  raw responses onto the parse queue
+- a parse stage turns each response into rows for the history layout
+- a single writer thread owns its own database connection and commits the
+  rows of many stocks per transaction
+
+When a later stage falls behind, the bounded queues block the stages feeding
+it, so memory stays bounded. Every stage counts its items, busy time and the
+time it spent waiting on its neighbours; report() logs them so the bottleneck
+stage is obvious (it is the one with the highest utilization).
+"""
+
+import time
+import queue
+import logging
+import threading
+from db_handler import DatabaseHandler
+from stock_fetcher import FETCH_WORKERS
+
+# Stocks committed per write transaction
+WRITE_BATCH_SIZE = 50
+
+# Longest time the writer holds a partial batch before committing it
+WRITE_BATCH_WAIT = 2.0
+
+# Capacity of the parse and write queues (in stocks)
+QUEUE_SIZE = 2 * WRITE_BATCH_SIZE
+
+# Seconds between progress reports while the pipeline runs
+REPORT_INTERVAL = 30
+
+_DONE = object()
+
+class StageCounters:
+    def __init__(self, name, workers=1):
+        """Throughput counters for one pipeline stage"""
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.starved = 0.0  # waiting for input
+        self.blocked = 0.0  # waiting for space in the next queue (backpressure)
+        self._lock = threading.Lock()
+
+    def add(self, items=0, failed=0, busy=0.0, starved=0.0, blocked=0.0):
+        with self._lock:
+            self.items += items
+            self.failed += failed
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+
+    def utilization(self, elapsed):
+        """Share of the stage's worker time spent doing work"""
+        if elapsed <= 0:
+            return 0.0
+        return self.busy / (elapsed * self.workers)
+
+    def summary(self, elapsed):
+        rate = self.items / elapsed if elapsed > 0 else 0.0
+        return (
+            f"{self.name}: {self.items} items ({self.failed} failed), {rate:.1f}/s, "
+            f"{self.utilization(elapsed):.0%} busy, waited {self.starved:.1f}s for input "
+            f"and {self.blocked:.1f}s on backpressure"
+        )
+
+class IngestPipeline:
+    def __init__(self, fetch, db_path='stock_data.db', fetch_workers=FETCH_WORKERS,
+                 batch_size=WRITE_BATCH_SIZE, queue_size=QUEUE_SIZE, before_commit=None):
+        """
+        Staged fetch / parse / write pipeline for historical candles
+
+        Args:
+            fetch: Function called with one job in a fetch worker; returns the API
+                   response, or None if the fetch failed
+            db_path: Database the writer thread connects to
+            fetch_workers: Number of concurrent fetches
+            batch_size: Stocks committed per write transaction
+            queue_size: Capacity of the parse and write queues
+            before_commit: Optional function (db, jobs, stats) called by the writer
+                           inside each write transaction, before it commits
+        """
+        self.fetch = fetch
+        self.db_path = db_path
+        self.fetch_workers = fetch_workers
+        self.batch_size = batch_size
+        self.before_commit = before_commit
+        self.counters = {
+            'fetch': StageCounters('fetch', fetch_workers),
+            'parse': StageCounters('parse'),
+            'write': StageCounters('write'),
+        }
+        self.batches = 0
+        self.started = None
+        self._jobs = queue.Queue()
+        self._raw = queue.Queue(maxsize=queue_size)
+        self._parsed = queue.Queue(maxsize=queue_size)
+        self._results = queue.Queue()
+        self._db = None
+        self._db_ready = threading.Event()
+
+    def _get(self, source, counters, timeout=None):
+        start = time.monotonic()
+        try:
+            return source.get(timeout=timeout)
+        finally:
+            counters.add(starved=time.monotonic() - start)
+
+    def _put(self, target, item, counters):
+        start = time.monotonic()
+        target.put(item)
+        counters.add(blocked=time.monotonic() - start)
+
+    def _fetch_worker(self):
+        counters = self.counters['fetch']
+        while True:
+            job = self._get(self._jobs, counters)
+            if job is _DONE:
+                return
+            start = time.monotonic()
+            try:
+                raw = self.fetch(job)
+            except Exception as e:
+                logging.error(f"Error fetching {job}: {e}")
+                raw = None
+            counters.add(items=1, failed=0 if raw else 1, busy=time.monotonic() - start)
+            if raw:
+                self._put(self._raw, (job, raw), counters)
+            else:
+                self._results.put((job, None))
+
+    def _parse_worker(self):
+        counters = self.counters['parse']
+        # Parsing needs the writer's history layout, known once it has connected
+        self._db_ready.wait()
+        while True:
+            item = self._get(self._raw, counters)
+            if item is _DONE:
+                return
+            job, raw = item
+            start = time.monotonic()
+            rows = None
+            if self._db is not None:
+                try:
+                    rows = self._db.prepare_history_rows(job[0], raw)
+                except Exception as e:
+                    logging.error(f"Error parsing historical data for {job}: {e}")
+            counters.add(items=1, failed=0 if rows is not None else 1, busy=time.monotonic() - start)
+            if rows is not None:
+                self._put(self._parsed, (job, rows), counters)
+            else:
+                self._results.put((job, None))
+
+    def _write_worker(self):
+        counters = self.counters['write']
+        db = DatabaseHandler(self.db_path)
+        self._db = db if db.connect() else None
+        self._db_ready.set()
+        if self._db is None:
+            logging.error("Ingest writer could not connect to the database")
+
+        batch = []
+        done = False
+        while not done:
+            try:
+                item = self._get(self._parsed, counters, timeout=WRITE_BATCH_WAIT if batch else None)
+            except queue.Empty:
+                item = None
+            if item is _DONE:
+                done = True
+            elif item is not None:
+                batch.append(item)
+
+            # Commit when the batch is full, the queue went quiet or the input ended
+            if batch and (len(batch) >= self.batch_size or item is None or done):
+                start = time.monotonic()
+                jobs = [job for job, _ in batch]
+                hook = None
+                if self.before_commit:
+                    hook = lambda stats, jobs=jobs: self.before_commit(self._db, jobs, stats)
+                written = {}
+                if self._db is not None:
+                    try:
+                        written = self._db.insert_history_rows_bulk(
+                            ((job[0], rows) for job, rows in batch), before_commit=hook
+                        )
+                    except Exception as e:
+                        # Keep the writer alive so the pipeline always drains
+                        logging.error(f"Error writing ingest batch: {e}")
+                        self._db.conn.rollback()
+                failed = sum(1 for job, _ in batch if job[0] not in written)
+                counters.add(items=len(batch), failed=failed, busy=time.monotonic() - start)
+                self.batches += 1
+                for job, _ in batch:
+                    self._results.put((job, written.get(job[0])))
+                batch = []
+
+        if self._db is not None:
+            self._db.close()
+
+    def _supervise(self, fetchers, parser, writer):
+        # Shut the stages down in order as each one drains
+        for thread in fetchers:
+            thread.join()
+        self._raw.put(_DONE)
+        parser.join()
+        self._parsed.put(_DONE)
+        writer.join()
+        self._results.put(_DONE)
+
+    def run(self, jobs):
+        """
+        Ingest the history for every job
+
+        Args:
+            jobs: Sequence of job tuples whose first element is the stock_id
+                  (e.g. FetchTask, or (stock_id, stock) pairs); each is passed to fetch
+
+        Returns:
+            Generator of (job, stats) pairs in completion order, yielded on the
+            calling thread. stats is the insert_history_rows_bulk dict for the stock,
+            or None if its fetch, parse or write failed.
+        """
+        self.started = time.monotonic()
+        for job in jobs:
+            self._jobs.put(job)
+        for _ in range(self.fetch_workers):
+            self._jobs.put(_DONE)
+
+        fetchers = [
+            threading.Thread(target=self._fetch_worker, name=f"ingest-fetch-{i}", daemon=True)
+            for i in range(self.fetch_workers)
+        ]
+        parser = threading.Thread(target=self._parse_worker, name="ingest-parse", daemon=True)
+        writer = threading.Thread(target=self._write_worker, name="ingest-write", daemon=True)
+        for thread in fetchers + [parser, writer]:
+            thread.start()
+        threading.Thread(
+            target=self._supervise, args=(fetchers, parser, writer), name="ingest-supervisor", daemon=True
+        ).start()
+
+        last_report = time.monotonic()
+        while True:
+            try:
+                item = self._results.get(timeout=REPORT_INTERVAL)
+            except queue.Empty:
+                item = None
+            if time.monotonic() - last_report >= REPORT_INTERVAL:
+                self.report()
+                last_report = time.monotonic()
+            if item is _DONE:
+                break
+            if item is not None:
+                yield item
+
+        self.report()
+
+    def report(self):
+        """Log per-stage throughput and name the bottleneck stage"""
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        for counters in self.counters.values():
+            logging.info(f"Ingest {counters.summary(elapsed)}")
+        bottleneck = max(self.counters.values(), key=lambda counters: counters.utilization(elapsed))
+        logging.info(
+            f"Ingest: {self.batches} write transactions in {elapsed:.1f}s; "
+            f"queues {self._raw.qsize()} raw / {self._parsed.qsize()} parsed; "
+            f"bottleneck stage: {bottleneck.name}"
+        )
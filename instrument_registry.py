@@ -0,0 +1,140 @@
+"""
+Process-wide instrument registry.
+
+Loads the stocks table once and answers symbol / security_id / stock_id lookups
+from memory, so the fetch, signal and order loops don't query stocks for every
+stock. Before each lookup the registry runs PRAGMA data_version on its own
+connection, which only changes when another connection commits; only then does
+it read the 'stocks' data version (bumped by every stocks write) and reload if
+the table changed.
+"""
+
+import os
+import logging
+import sqlite3
+import threading
+from collections import namedtuple
+from db_connection import get_connection, READ_ONLY
+from db_handler import get_data_version
+
+Instrument = namedtuple(
+    'Instrument',
+    ['stock_id', 'security_id', 'exchange_segment', 'symbol', 'name', 'instrument']
+)
+
+class InstrumentRegistry:
+    def __init__(self, db_path='stock_data.db'):
+        """Initialize the registry (stocks are loaded on the first lookup)"""
+        self.db_path = db_path
+        self.conn = None
+        self.by_id = {}
+        self.by_security = {}
+        self.by_symbols = {}
+        self._data_version = None
+        self._stocks_version = None
+        self._loaded = False
+        # Lookups may come from fetch worker threads
+        self._lock = threading.Lock()
+
+    def _check(self):
+        """Reload the registry if the stocks table changed since the last load"""
+        try:
+            if self.conn is None:
+                self.conn = get_connection(self.db_path, READ_ONLY, check_same_thread=False)
+
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._loaded and data_version == self._data_version:
+                return
+
+            stocks_version = get_data_version(self.conn, 'stocks')
+            if self._loaded and stocks_version is not None and stocks_version == self._stocks_version:
+                # Another connection wrote something else (e.g. candles or settings)
+                self._data_version = data_version
+                return
+
+            self._load()
+            self._data_version = data_version
+            self._stocks_version = stocks_version
+        except sqlite3.Error as e:
+            logging.error(f"Error refreshing instrument registry: {e}")
+
+    def _load(self):
+        rows = self.conn.execute("""
+            SELECT id, security_id, exchange_segment, symbol, name, instrument
+            FROM stocks
+            ORDER BY id
+        """).fetchall()
+
+        by_id = {}
+        by_security = {}
+        by_symbols = {}
+        for row in rows:
+            instrument = Instrument(*row)
+            by_id[instrument.stock_id] = instrument
+            if instrument.security_id is not None:
+                by_security[str(instrument.security_id)] = instrument
+            by_symbols.setdefault(instrument.symbol, []).append(instrument)
+
+        self.by_id = by_id
+        self.by_security = by_security
+        self.by_symbols = by_symbols
+        self._loaded = True
+        logging.info(f"Instrument registry loaded {len(by_id)} stocks")
+
+    def refresh(self):
+        """Force a reload on the next lookup"""
+        with self._lock:
+            self._loaded = False
+
+    def get_by_stock_id(self, stock_id):
+        """Instrument for a stocks.id, or None"""
+        with self._lock:
+            self._check()
+            return self.by_id.get(stock_id)
+
+    def get_by_security_id(self, security_id):
+        """Instrument for a Dhan security ID, or None"""
+        with self._lock:
+            self._check()
+            return self.by_security.get(str(security_id))
+
+    def get_by_symbol(self, symbol):
+        """
+        Instrument for a trading symbol, or None
+
+        If several stocks share the symbol (e.g. NSE and BSE listings) the one
+        with the lowest id is returned; use get_all_by_symbol to see them all.
+        """
+        with self._lock:
+            self._check()
+            instruments = self.by_symbols.get(symbol)
+            return instruments[0] if instruments else None
+
+    def get_all_by_symbol(self, symbol):
+        """All instruments with a trading symbol"""
+        with self._lock:
+            self._check()
+            return list(self.by_symbols.get(symbol, []))
+
+    def instruments(self):
+        """Every instrument, ordered by stocks.id"""
+        with self._lock:
+            self._check()
+            return list(self.by_id.values())
+
+    def get_stock_id(self, symbol):
+        """stocks.id for a trading symbol, or None"""
+        instrument = self.get_by_symbol(symbol)
+        return instrument.stock_id if instrument else None
+
+# One registry per database path, shared by every caller in the process
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_registry(db_path='stock_data.db'):
+    """Get the process-wide instrument registry for a database"""
+    key = os.path.abspath(db_path)
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = InstrumentRegistry(db_path)
+        return _registries[key]
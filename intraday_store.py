@@ -0,0 +1,385 @@
+"""
+Intraday (minute-bar) candle store.
+
+Minute bars run to ~94k rows per stock per year, several hundred times the daily
+history, so they live in their own database file next to stock_data.db
+(<db name>_intraday.db) and never slow down or bloat the daily tables.
+
+Bars are stored in one WITHOUT ROWID table per month, intraday_pYYYYMM, keyed by
+(stock_id, interval, minute): a stock's bars for one interval are contiguous on
+disk, so a range read is a single b-tree range scan in each month it touches.
+minute is minutes since 1970-01-01 UTC, prices are integer paise. Old months are
+dropped as whole tables.
+
+Bars can be stored at any of the Dhan intervals. Coarser timeframes are either
+fetched natively or bucketed on read from finer bars (e.g. 15-minute bars from
+1-minute bars), with buckets anchored at the 09:15 IST session open.
+"""
+
+import os
+import logging
+import sqlite3
+import numpy as np
+import pandas as pd
+from db_connection import connect_read_write
+
+# Bar sizes in minutes offered by the Dhan intraday charts API
+INTRADAY_INTERVALS = (1, 5, 15, 25, 60)
+
+INTRADAY_TABLE_PREFIX = 'intraday_p'
+
+INTRADAY_COLUMNS = ('stock_id', 'interval', 'minute', 'open', 'high', 'low', 'close', 'volume', 'open_interest')
+
+# NSE trades 09:15-15:30 IST; bars and buckets are reported in IST
+IST_OFFSET_MINUTES = 330
+SESSION_OPEN_MINUTE = 9 * 60 + 15
+
+def intraday_db_path(db_path='stock_data.db'):
+    """Intraday database file that sits next to the daily database"""
+    return os.path.splitext(os.path.abspath(db_path))[0] + '_intraday.db'
+
+def intraday_table_sql(name):
+    """DDL for one month of bars"""
+    return f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            stock_id INTEGER NOT NULL,
+            interval INTEGER NOT NULL,
+            minute INTEGER NOT NULL,
+            open INTEGER,
+            high INTEGER,
+            low INTEGER,
+            close INTEGER,
+            volume INTEGER,
+            open_interest INTEGER,
+            PRIMARY KEY (stock_id, interval, minute)
+        ) WITHOUT ROWID
+    '''
+
+def month_of_minute(minute):
+    """Month index (months since 1970-01, UTC) of minutes since the epoch"""
+    return np.asarray(minute, dtype=np.int64).astype('datetime64[m]').astype('datetime64[M]').astype(np.int64)
+
+def intraday_table_name(month):
+    """Table name for a month index, e.g. intraday_p202401"""
+    return INTRADAY_TABLE_PREFIX + str(np.datetime64(int(month), 'M')).replace('-', '')
+
+def date_to_minute(date_str, end_of_day=False):
+    """Minutes since the epoch of IST midnight (or the last minute) of a YYYY-MM-DD date"""
+    day = int(np.datetime64(str(date_str)[:10], 'D').astype(np.int64))
+    minute = day * 1440 - IST_OFFSET_MINUTES
+    return minute + 1439 if end_of_day else minute
+
+def minutes_to_ist(minutes):
+    """IST 'YYYY-MM-DD HH:MM' strings for minutes since the epoch"""
+    local = (np.asarray(minutes, dtype=np.int64) + IST_OFFSET_MINUTES).astype('datetime64[m]')
+    return np.char.replace(np.datetime_as_string(local, unit='m'), 'T', ' ')
+
+def parse_intraday_payload(data):
+    """
+    Parse an intraday charts API response (open/high/low/close/volume/timestamp
+    arrays, timestamps in epoch seconds) into NumPy columns sorted by minute
+
+    Returns:
+        dict of arrays (minute, open, high, low, close in paise, volume, open_interest),
+        or None if the payload is not in the expected format
+    """
+    if not data or 'timestamp' not in data:
+        return None
+    try:
+        minute = np.asarray(data['timestamp'], dtype=np.int64) // 60
+        n = len(minute)
+        columns = {'minute': minute}
+        for name in ('open', 'high', 'low', 'close'):
+            values = np.asarray(data.get(name) or [0] * n, dtype=np.float64)[:n]
+            columns[name] = np.floor(values * 100 + 0.5).astype(np.int64)
+        for name in ('volume', 'open_interest'):
+            values = np.asarray(data.get(name) or [0] * n, dtype=np.float64)[:n]
+            columns[name] = values.astype(np.int64)
+    except (TypeError, ValueError) as e:
+        logging.error(f"Invalid intraday payload: {e}")
+        return None
+    if any(len(values) != n for values in columns.values()):
+        logging.error("Invalid intraday payload: columns have different lengths")
+        return None
+
+    # Sorted, one bar per minute (the last one wins)
+    order = np.argsort(minute, kind='stable')
+    minute = minute[order]
+    keep = np.append(minute[1:] != minute[:-1], True) if n else np.zeros(0, dtype=bool)
+    return {name: values[order][keep] for name, values in columns.items()}
+
+def bucket_bars(columns, bucket):
+    """
+    Aggregate sorted bars into bucket-minute bars anchored at the session open
+
+    Args:
+        columns: dict of arrays as returned by parse_intraday_payload / IntradayStore.read
+        bucket: Bucket size in minutes
+
+    Returns:
+        dict of arrays with one bar per bucket
+    """
+    minute = columns['minute']
+    if len(minute) == 0:
+        return columns
+    local = minute + IST_OFFSET_MINUTES
+    day_start = local // 1440 * 1440
+    offset = (local - day_start - SESSION_OPEN_MINUTE) // bucket * bucket
+    keys = day_start + SESSION_OPEN_MINUTE + offset - IST_OFFSET_MINUTES
+
+    starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    ends = np.append(starts[1:], len(keys)) - 1
+    return {
+        'minute': keys[starts],
+        'open': columns['open'][starts],
+        'high': np.maximum.reduceat(columns['high'], starts),
+        'low': np.minimum.reduceat(columns['low'], starts),
+        'close': columns['close'][ends],
+        'volume': np.add.reduceat(columns['volume'], starts),
+        'open_interest': columns['open_interest'][ends],
+    }
+
+class IntradayStore:
+    def __init__(self, db_path=None, daily_db_path='stock_data.db'):
+        """
+        Minute-bar store
+
+        Args:
+            db_path: Intraday database file (defaults to the file next to daily_db_path)
+            daily_db_path: Daily database whose stock IDs the bars use
+        """
+        self.db_path = db_path or intraday_db_path(daily_db_path)
+        self.conn = None
+        self.cursor = None
+        self._tables = None
+
+    def connect(self):
+        """Connect to the intraday database, creating it if needed"""
+        try:
+            self.conn = connect_read_write(self.db_path)
+            self.cursor = self.conn.cursor()
+            # Dropped months give their pages back (see drop_months_before)
+            self.cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+            if self.cursor.fetchone()[0] == 0:
+                self.cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                self.cursor.execute("VACUUM")
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Intraday database connection error: {e}")
+            return False
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def months(self):
+        """Month indexes that have a table, in order"""
+        if self._tables is None:
+            rows = self.cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ? ESCAPE '\\'",
+                (INTRADAY_TABLE_PREFIX.replace('_', '\\_') + '%',)
+            ).fetchall()
+            self._tables = set()
+            for (name,) in rows:
+                suffix = name[len(INTRADAY_TABLE_PREFIX):]
+                if len(suffix) == 6 and suffix.isdigit():
+                    self._tables.add((int(suffix[:4]) - 1970) * 12 + int(suffix[4:]) - 1)
+        return sorted(self._tables)
+
+    def _ensure_table(self, month):
+        if month not in self.months():
+            self.cursor.execute(intraday_table_sql(intraday_table_name(month)))
+            self._tables.add(month)
+
+    def insert_bars_bulk(self, payloads):
+        """
+        Write the bars of many stocks in a single transaction
+
+        Bars are compared with the stored ones first: new bars are inserted,
+        changed ones updated, and unchanged ones (e.g. the overlap with the last
+        update) are not written at all.
+
+        Args:
+            payloads: Iterable of (stock_id, interval, data) where data is an
+                      intraday API response or parse_intraday_payload columns
+
+        Returns:
+            dict mapping stock_id to {'inserted': n, 'updated': n, 'unchanged': n}
+            (empty on error)
+        """
+        value_columns = INTRADAY_COLUMNS[3:]
+        try:
+            written = {}
+            for stock_id, interval, data in payloads:
+                columns = data if data and 'minute' in data else parse_intraday_payload(data)
+                if columns is None:
+                    continue
+                stats = written.setdefault(stock_id, {'inserted': 0, 'updated': 0, 'unchanged': 0})
+                if len(columns['minute']) == 0:
+                    continue
+
+                months = month_of_minute(columns['minute'])
+                # Rows are sorted, so each month is one contiguous slice
+                bounds = np.flatnonzero(np.append(True, months[1:] != months[:-1]))
+                for start, stop in zip(bounds, np.append(bounds[1:], len(months))):
+                    month = int(months[start])
+                    self._ensure_table(month)
+                    table = intraday_table_name(month)
+                    minutes = columns['minute'][start:stop]
+                    values = np.column_stack([columns[name][start:stop] for name in value_columns])
+
+                    stored = np.array(self.cursor.execute(f'''
+                        SELECT minute, {", ".join(value_columns)} FROM {table}
+                        WHERE stock_id = ? AND interval = ? AND minute BETWEEN ? AND ?
+                        ORDER BY minute
+                    ''', (stock_id, interval, int(minutes[0]), int(minutes[-1]))).fetchall(),
+                        dtype=np.int64).reshape(-1, len(value_columns) + 1)
+                    if len(stored):
+                        at = np.minimum(np.searchsorted(stored[:, 0], minutes), len(stored) - 1)
+                        found = stored[at, 0] == minutes
+                        same = found & (stored[at, 1:] == values).all(axis=1)
+                    else:
+                        found = same = np.zeros(len(minutes), dtype=bool)
+                    stats['inserted'] += int((~found).sum())
+                    stats['updated'] += int((found & ~same).sum())
+                    stats['unchanged'] += int(same.sum())
+
+                    changed = ~same
+                    count = int(changed.sum())
+                    if count == 0:
+                        continue
+                    rows = zip(
+                        [stock_id] * count, [interval] * count, minutes[changed].tolist(),
+                        *values[changed].T.tolist()
+                    )
+                    self.cursor.executemany(f'''
+                        INSERT INTO {table} ({", ".join(INTRADAY_COLUMNS)})
+                        VALUES ({", ".join("?" * len(INTRADAY_COLUMNS))})
+                        ON CONFLICT (stock_id, interval, minute) DO UPDATE SET
+                            open = excluded.open, high = excluded.high, low = excluded.low,
+                            close = excluded.close, volume = excluded.volume,
+                            open_interest = excluded.open_interest
+                    ''', rows)
+            self.conn.commit()
+            return written
+        except sqlite3.Error as e:
+            logging.error(f"Error inserting intraday bars: {e}")
+            self.conn.rollback()
+            self._tables = None
+            return {}
+
+    def read(self, stock_id, interval, from_minute, to_minute):
+        """
+        Stored bars of one stock and interval between two minutes (inclusive)
+
+        Returns:
+            dict of arrays sorted by minute (prices in paise)
+        """
+        first, last = month_of_minute([from_minute, to_minute]).tolist()
+        parts = []
+        for month in self.months():
+            if first <= month <= last:
+                parts.append(self.cursor.execute(f'''
+                    SELECT {", ".join(INTRADAY_COLUMNS[2:])} FROM {intraday_table_name(month)}
+                    WHERE stock_id = ? AND interval = ? AND minute BETWEEN ? AND ?
+                    ORDER BY minute
+                ''', (stock_id, interval, from_minute, to_minute)).fetchall())
+        rows = np.array([row for part in parts for row in part], dtype=np.int64).reshape(-1, len(INTRADAY_COLUMNS) - 2)
+        return {name: rows[:, i] for i, name in enumerate(INTRADAY_COLUMNS[2:])}
+
+    def stored_intervals(self, stock_id):
+        """Intervals with bars stored for a stock, from the latest month that has any"""
+        for month in reversed(self.months()):
+            rows = self.cursor.execute(
+                f"SELECT DISTINCT interval FROM {intraday_table_name(month)} WHERE stock_id = ?", (stock_id,)
+            ).fetchall()
+            if rows:
+                return sorted(row[0] for row in rows)
+        return []
+
+    def get_bars(self, stock_id, interval, from_date, to_date):
+        """
+        Bars of one stock at an interval between two dates (inclusive)
+
+        Native bars are used when the interval was fetched; otherwise bars are
+        bucketed from the coarsest stored interval that divides it.
+
+        Returns:
+            DataFrame with timestamp, date (IST 'YYYY-MM-DD HH:MM'), open, high, low,
+            close (rupees) and volume, or None if there are no bars or on error
+        """
+        try:
+            from_minute = date_to_minute(from_date)
+            to_minute = date_to_minute(to_date, end_of_day=True)
+            source = interval
+            stored = self.stored_intervals(stock_id)
+            if interval not in stored:
+                divisors = [size for size in stored if size < interval and interval % size == 0]
+                if not divisors:
+                    return None
+                source = max(divisors)
+
+            columns = self.read(stock_id, source, from_minute, to_minute)
+            if source != interval:
+                columns = bucket_bars(columns, interval)
+            if len(columns['minute']) == 0:
+                return None
+
+            return pd.DataFrame({
+                'timestamp': columns['minute'] * 60,
+                'date': minutes_to_ist(columns['minute']),
+                'open': columns['open'] / 100.0,
+                'high': columns['high'] / 100.0,
+                'low': columns['low'] / 100.0,
+                'close': columns['close'] / 100.0,
+                'volume': columns['volume'],
+            })
+        except sqlite3.Error as e:
+            logging.error(f"Error reading intraday bars for stock {stock_id}: {e}")
+            return None
+
+    def get_watermarks(self, interval):
+        """
+        Last stored minute of every stock for an interval
+
+        Returns:
+            dict mapping stock_id to minutes since the epoch
+        """
+        watermarks = {}
+        try:
+            for month in reversed(self.months()):
+                rows = self.cursor.execute(
+                    f"SELECT stock_id, MAX(minute) FROM {intraday_table_name(month)} "
+                    f"WHERE interval = ? GROUP BY stock_id", (interval,)
+                ).fetchall()
+                for stock_id, minute in rows:
+                    watermarks.setdefault(stock_id, minute)
+        except sqlite3.Error as e:
+            logging.error(f"Error reading intraday watermarks: {e}")
+        return watermarks
+
+    def drop_months_before(self, month):
+        """
+        Drop every month table older than a month index
+
+        Returns:
+            Number of tables dropped
+        """
+        old = [m for m in self.months() if m < month]
+        try:
+            for m in old:
+                self.cursor.execute(f"DROP TABLE IF EXISTS {intraday_table_name(m)}")
+            self.conn.commit()
+            if old:
+                self.cursor.execute("PRAGMA auto_vacuum")
+                if self.cursor.fetchone()[0] == 2:
+                    # executescript steps the pragma to completion; execute() frees one page
+                    self.conn.executescript("PRAGMA incremental_vacuum;")
+            self._tables = None
+            return len(old)
+        except sqlite3.Error as e:
+            logging.error(f"Error dropping intraday months: {e}")
+            self.conn.rollback()
+            self._tables = None
+            return 0
@@ -1,10 +1,14 @@
 import os
-import time
 import logging
 from tqdm import tqdm
-from datetime import datetime
+from datetime import datetime, timedelta
 from db_handler import DatabaseHandler
-from stock_fetcher import StockFetcher
+from stock_fetcher import StockFetcher, RETENTION_SETTING
+from ohlcv_cache import refresh_cache
+from indicator_state import update_indicator_state
+from feature_store import update_feature_store
+from backfill import BackfillJob
+from update_planner import FetchTask
 from dotenv import load_dotenv
 
 # Set up logging
@@ -13,6 +17,17 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Load environment variables
 load_dotenv()
 
+# Number of stocks whose history is written per database transaction
+HISTORY_BATCH_SIZE = 50
+
+# Checkpointed backfill job; a run that dies part way is resumed by the next one
+BACKFILL_JOB = 'main_history'
+
+# Days of history to keep. This must stay longer than the fetcher's 365-day
+# window, otherwise every run deletes candles only to download them again;
+# closed months are kept as read-only partitions and dropped whole
+HISTORY_RETENTION_DAYS = 400
+
 def create_dot_env_if_not_exists():
     """Create .env file if it doesn't exist"""
     if not os.path.exists(".env"):
@@ -22,16 +37,23 @@ def create_dot_env_if_not_exists():
         return False
     return True
 
-def clean_old_history_data(days=180):
-    """Clean historical data older than specified days"""
-    logging.info(f"Cleaning historical data older than {days} days...")
+def clean_old_history_data(days=None):
+    """
+    Clean historical data older than specified days
     
+    Defaults to the history_retention_days setting (extended by multi-year
+    backfills so they are not deleted again), or HISTORY_RETENTION_DAYS
+    """
     # Initialize database handler
     db = DatabaseHandler()
     if not db.connect():
         return False
     
     try:
+        if days is None:
+            days = max(int(db.get_setting(RETENTION_SETTING, HISTORY_RETENTION_DAYS)), HISTORY_RETENTION_DAYS)
+        logging.info(f"Cleaning historical data older than {days} days...")
+        
         # Clean data
         records_deleted = db.clean_history_data(older_than_days=days)
         logging.info(f"Cleaned {records_deleted} historical data records")
@@ -77,11 +99,17 @@ def fetch_and_store_stock_data():
     
     logging.info(f"Fetching historical data for {len(stocks)} stocks...")
     
-    # Process each stock
     success_count = 0
+    corrected_ids = []
+    
+    # One year of daily history (up to yesterday) per stock
+    end_date = datetime.now() - timedelta(days=1)
+    from_date = (end_date - timedelta(days=365)).strftime("%Y-%m-%d")
+    to_date = end_date.strftime("%Y-%m-%d")
     
-    for stock in tqdm(stocks, desc="Fetching stock data"):
-        # Insert stock into database
+    # Insert the stocks into the database
+    units = []
+    for stock in stocks:
         stock_id = db.insert_stock(
             stock["security_id"], 
             stock["exchange_segment"], 
@@ -93,38 +121,60 @@ def fetch_and_store_stock_data():
         if not stock_id:
             logging.error(f"Failed to insert stock {stock['symbol']} into database.")
             continue
-        
-        # Fetch historical data
-        hist_data = fetcher.fetch_historical_data_for_last_year(
-            stock["security_id"], 
-            stock["exchange_segment"], 
-            stock["instrument"]
+        units.append(FetchTask(
+            stock_id, stock["security_id"], stock["exchange_segment"], stock["symbol"],
+            stock["instrument"], from_date, to_date
+        ))
+    
+    def fetch(unit):
+        # No demo fallback: a failed unit stays pending for the next run
+        return fetcher.fetch_historical_daily_data(
+            unit.security_id, unit.exchange_segment, unit.instrument, unit.from_date, unit.to_date,
+            demo_fallback=False
         )
-        
-        if not hist_data:
-            logging.error(f"Failed to fetch historical data for {stock['symbol']}.")
-            continue
-        
-        # Insert historical data
-        inserted_count = db.insert_history_data(stock_id, hist_data)
-        
-        if inserted_count > 0:
-            logging.info(f"Inserted {inserted_count} historical data points for {stock['symbol']}")
+    
+    # Units already stored by an interrupted earlier run are skipped
+    job = BackfillJob(BACKFILL_JOB, db.db_name)
+    pending = job.prepare(db, units)
+    
+    # Fetch, parse and write concurrently: fetch workers paced by the API rate
+    # limiter, one writer committing HISTORY_BATCH_SIZE stocks per transaction
+    # together with their checkpoints
+    results = job.run(pending, fetch, batch_size=HISTORY_BATCH_SIZE)
+    for unit, stats in tqdm(results, total=len(pending), desc="Fetching stock data"):
+        if stats and sum(stats.values()) > 0:
+            logging.info(
+                f"Stored historical data for {unit.symbol}: {stats['inserted']} inserted, "
+                f"{stats['updated']} updated, {stats['unchanged']} unchanged, "
+                f"{stats['frozen']} frozen"
+            )
             success_count += 1
+            if stats['updated']:
+                corrected_ids.append(unit.stock_id)
         else:
-            logging.error(f"Failed to insert historical data for {stock['symbol']}")
-        
-        # Sleep to avoid hitting rate limits
-        time.sleep(1)
+            logging.error(f"Failed to fetch or store historical data for {unit.symbol}.")
+    
+    logging.info(f"Successfully fetched and stored data for {success_count} out of {len(pending)} pending stocks")
     
-    logging.info(f"Successfully fetched and stored data for {success_count} out of {len(stocks)} stocks")
+    # Move closed months into read-only partitions
+    db.roll_history_partitions()
     db.close()
+    
+    # Rebuild the columnar OHLCV cache from the new history; the 365-day refetch
+    # can correct old candles, so those stocks are reloaded in full
+    refresh_cache(db.db_name, reload_ids=corrected_ids)
+    
+    # Fold the new candles into the indicator state; corrected stocks are rebuilt
+    update_indicator_state(db.db_name, rebuild_ids=corrected_ids)
+    
+    # Append the new days' AI features, which the AI signals read instead of recomputing
+    update_feature_store(db.db_name, rebuild_ids=corrected_ids)
 
 if __name__ == "__main__":
     start_time = datetime.now()
     logging.info(f"Starting data fetch at {start_time}")
     
-    # Clean old history data (older than 180 days by default)
+    # Clean old history data (older than the retention setting or HISTORY_RETENTION_DAYS)
     clean_old_history_data()
     
     fetch_and_store_stock_data()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Migrate history_data to the compact v2 layout (history_v2 + compatibility view).
+
+The migration runs online: the ingest jobs, UI and signal generators can keep
+using the database while it runs. A DatabaseHandler connected before the
+switch re-reads the layout before each write (refresh_history_layout) and
+writes the v2 way from then on; a batch it parsed for the v1 layout just
+before the switch is rejected, and its units stay pending for the next run.
+1. history_v2 is created and triggers on the old table mirror every insert,
+   update and delete into it from then on.
+2. Existing rows are copied in small per-stock batches, each in its own short
+   transaction, so writers are never blocked for long.
+3. In one short write transaction the triggers are dropped, the old table is
+   renamed to history_data_v1 and the history_data view is created in its place.
+4. history_data_v1 is dropped (unless --keep-v1) and, with --vacuum, the file
+   is compacted and switched to incremental auto_vacuum. VACUUM needs exclusive
+   access, so run it in a quiet window.
+
+Closed months are moved into read-only monthly partitions later, by the next
+ingest run (DatabaseHandler.roll_history_partitions).
+
+Usage:
+    python migrate_history_v2.py [--db stock_data.db] [--batch-stocks 50] [--keep-v1] [--vacuum]
+"""
+
+import os
+import sys
+import sqlite3
+import logging
+import argparse
+from db_connection import connect_read_write
+from db_handler import (
+    DatabaseHandler, HISTORY_V2_TABLE_SQL, HISTORY_VIEW_SQL, HISTORY_LAYOUT_V2,
+    get_history_layout, history_day_sql, history_paise_sql, bump_data_version
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+OLD_TABLE = 'history_data_v1'
+
+def _v2_values(row):
+    """SQL for the v2 column values of a v1 row (row is the table alias or NEW/OLD)"""
+    return (
+        f"{row}.stock_id, {history_day_sql(f'{row}.date', f'{row}.timestamp')}, "
+        f"{history_paise_sql(f'{row}.open')}, {history_paise_sql(f'{row}.high')}, "
+        f"{history_paise_sql(f'{row}.low')}, {history_paise_sql(f'{row}.close')}, "
+        f"{row}.volume, {row}.open_interest"
+    )
+
+V2_COLUMNS = "stock_id, day, open, high, low, close, volume, open_interest"
+
+# Keep history_v2 in sync with writes made to the old table during the copy
+SYNC_TRIGGERS = {
+    'history_v2_sync_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS history_v2_sync_insert AFTER INSERT ON history_data
+        BEGIN
+            INSERT OR REPLACE INTO history_v2 ({V2_COLUMNS}) VALUES ({_v2_values('NEW')});
+        END
+    ''',
+    'history_v2_sync_update': f'''
+        CREATE TRIGGER IF NOT EXISTS history_v2_sync_update AFTER UPDATE ON history_data
+        BEGIN
+            DELETE FROM history_v2
+            WHERE stock_id = OLD.stock_id AND day = {history_day_sql('OLD.date', 'OLD.timestamp')};
+            INSERT OR REPLACE INTO history_v2 ({V2_COLUMNS}) VALUES ({_v2_values('NEW')});
+        END
+    ''',
+    'history_v2_sync_delete': f'''
+        CREATE TRIGGER IF NOT EXISTS history_v2_sync_delete AFTER DELETE ON history_data
+        BEGIN
+            DELETE FROM history_v2
+            WHERE stock_id = OLD.stock_id AND day = {history_day_sql('OLD.date', 'OLD.timestamp')};
+        END
+    ''',
+}
+
+def install_sync(conn):
+    """Create history_v2 and the triggers that mirror v1 writes into it"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(HISTORY_V2_TABLE_SQL)
+        for sql in SYNC_TRIGGERS.values():
+            conn.execute(sql)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def copy_rows(conn, batch_stocks):
+    """Copy every v1 row into history_v2, a batch of stocks per transaction"""
+    stock_ids = [row[0] for row in conn.execute("SELECT DISTINCT stock_id FROM history_data ORDER BY stock_id")]
+    copied = 0
+    for i in range(0, len(stock_ids), batch_stocks):
+        batch = stock_ids[i:i + batch_stocks]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # ORDER BY timestamp: if a day has several v1 rows, the latest one wins
+            cursor = conn.execute(f'''
+                INSERT OR REPLACE INTO history_v2 ({V2_COLUMNS})
+                SELECT {_v2_values('h')}
+                FROM history_data h
+                WHERE h.stock_id BETWEEN ? AND ?
+                ORDER BY h.stock_id, h.timestamp
+            ''', (batch[0], batch[-1]))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        copied += cursor.rowcount
+        logging.info(f"Copied {min(i + batch_stocks, len(stock_ids))}/{len(stock_ids)} stocks ({copied} rows)")
+    return copied
+
+def switch_over(conn):
+    """Replace the v1 table with the compatibility view in one transaction"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        v1_rows = conn.execute("SELECT COUNT(*) FROM history_data").fetchone()[0]
+        v2_rows = conn.execute("SELECT COUNT(*) FROM history_v2").fetchone()[0]
+        logging.info(f"Switching over: {v1_rows} v1 rows, {v2_rows} v2 rows")
+
+        for name in SYNC_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"ALTER TABLE history_data RENAME TO {OLD_TABLE}")
+        for sql in HISTORY_VIEW_SQL:
+            conn.execute(sql)
+
+        # Readers and caches see a new history version
+        bump_data_version(conn, 'history')
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate history_data to the compact v2 layout')
+    parser.add_argument('--db', default='stock_data.db', help='Database to migrate')
+    parser.add_argument('--batch-stocks', type=int, default=50, help='Stocks copied per transaction')
+    parser.add_argument('--keep-v1', action='store_true', help=f'Keep the old table as {OLD_TABLE}')
+    parser.add_argument('--vacuum', action='store_true', help='Compact the database file afterwards')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        logging.error(f"Database not found: {args.db}")
+        return 1
+
+    # Make sure data_versions and the other current tables exist
+    db = DatabaseHandler(args.db)
+    if not db.connect():
+        return 1
+    db.close()
+
+    size_before = os.path.getsize(args.db)
+    conn = connect_read_write(args.db)
+    conn.isolation_level = None  # transactions are managed explicitly
+    try:
+        if get_history_layout(conn) == HISTORY_LAYOUT_V2:
+            logging.info("history_data is already on the v2 layout")
+        else:
+            install_sync(conn)
+            copy_rows(conn, args.batch_stocks)
+            switch_over(conn)
+            logging.info("history_data now reads from history_v2")
+
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (OLD_TABLE,)).fetchone()
+        if exists and not args.keep_v1:
+            conn.execute(f"DROP TABLE {OLD_TABLE}")
+            logging.info(f"Dropped {OLD_TABLE}")
+
+        if args.vacuum:
+            logging.info("Vacuuming database...")
+            # Switch to incremental auto_vacuum (applied by the VACUUM) so that
+            # history partitions dropped later give their pages back
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            # In WAL mode the compacted pages reach the main file at checkpoint
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.Error as e:
+        logging.error(f"Migration failed: {e}")
+        return 1
+    finally:
+        conn.close()
+
+    size_after = os.path.getsize(args.db)
+    logging.info(f"Database file: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Dhan API, for load tests and benchmarks.
+
+Implements the endpoints this project calls:
+- POST /v2/charts/historical            deterministic daily candles per security
+- POST /v2/charts/intraday              deterministic 1/5/15/25/60-minute bars
+- POST/GET /v2/super/orders             place / list super orders
+- PUT /v2/super/orders/{id}             modify a leg
+- DELETE /v2/super/orders/{id}/{leg}    cancel a leg
+- POST /v2/marketfeed/ltp|ohlc|quote    market quotes
+
+Candles are derived from the security ID, so every run (and every window of a
+long span) returns the same prices. Latency, jitter, 429 and 5xx injection are
+configurable, and the per-second rate limits of each API family are enforced
+with 429s the way Dhan does, so client concurrency and retry changes can be
+measured offline.
+
+Usage:
+    python mock_dhan_server.py --port 8765 --latency 0.05 --error-rate-5xx 0.01
+    DHAN_API_URL=http://127.0.0.1:8765/v2 python update_daily_data.py
+"""
+
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rate_limiter import DHAN_RATE_LIMITS, TokenBucket
+
+API_PREFIX = '/v2'
+
+def mock_candles(security_id, from_date, to_date):
+    """
+    Deterministic daily candles for a security between two dates (inclusive),
+    in the column layout of the historical API; weekends have no candle
+    """
+    days = np.arange(np.datetime64(from_date, 'D'), np.datetime64(to_date, 'D') + 1)
+    days = days[np.is_busday(days)]
+
+    # Each day's move depends only on the security and the day, so overlapping
+    # requests agree on every candle they share
+    seed = sum(ord(c) * 31 ** i for i, c in enumerate(str(security_id))) % 1000003
+    day_numbers = days.astype(np.int64)
+    base = 100.0 + seed % 900
+    close = base * (1.0 + 0.2 * np.sin(day_numbers / 37.0 + seed) + 0.05 * np.sin(day_numbers * 1.7 + seed))
+    spread = close * 0.01 * (1.0 + np.abs(np.sin(day_numbers * 0.9 + seed)))
+    open_ = close - spread * np.sin(day_numbers * 2.3 + seed)
+    high = np.maximum(open_, close) + spread
+    low = np.minimum(open_, close) - spread
+    volume = (100000 + (day_numbers * 7919 + seed) % 50000).astype(np.int64)
+
+    # Candle timestamps are midnight IST, as Dhan returns them
+    timestamps = day_numbers * 86400 - 19800
+    return {
+        'open': np.round(open_, 2).tolist(),
+        'high': np.round(high, 2).tolist(),
+        'low': np.round(low, 2).tolist(),
+        'close': np.round(close, 2).tolist(),
+        'volume': volume.tolist(),
+        'timestamp': timestamps.tolist(),
+    }
+
+def mock_intraday_bars(security_id, from_date, to_date, interval=1):
+    """
+    Deterministic intraday bars (09:15-15:30 IST on weekdays) between two dates
+    (inclusive), in the column layout of the intraday API
+    """
+    daily = mock_candles(security_id, from_date, to_date)
+    if not daily['timestamp']:
+        return {name: [] for name in ('open', 'high', 'low', 'close', 'volume', 'timestamp')}
+
+    # 375 one-minute bars per session, wandering from the day's open to its close
+    minutes = np.arange(375)
+    day_open = np.asarray(daily['open'])[:, None]
+    day_close = np.asarray(daily['close'])[:, None]
+    day_start = np.asarray(daily['timestamp'])[:, None] + (9 * 60 + 15) * 60
+    path = day_open + (day_close - day_open) * minutes / 374.0
+    wobble = 0.002 * day_open * np.sin(minutes / 11.0 + day_open / 7.0)
+    close = np.round(path + wobble, 2)
+    open_ = np.concatenate([day_open, close[:, :-1]], axis=1)
+    high = np.round(np.maximum(open_, close) + 0.0005 * day_open, 2)
+    low = np.round(np.minimum(open_, close) - 0.0005 * day_open, 2)
+    volume = np.repeat(np.asarray(daily['volume'], dtype=np.int64)[:, None] // 375, 375, axis=1)
+    timestamps = day_start + minutes * 60
+
+    # Aggregate to the requested bar size
+    size = max(1, int(interval))
+    starts = np.arange(0, 375, size)
+    return {
+        'open': open_[:, starts].ravel().tolist(),
+        'high': np.maximum.reduceat(high, starts, axis=1).ravel().tolist(),
+        'low': np.minimum.reduceat(low, starts, axis=1).ravel().tolist(),
+        'close': close[:, np.minimum(starts + size, 375) - 1].ravel().tolist(),
+        'volume': np.add.reduceat(volume, starts, axis=1).ravel().tolist(),
+        'timestamp': timestamps[:, starts].ravel().tolist(),
+    }
+
+class MockDhanServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate_429=0.0,
+                 error_rate_5xx=0.0, rate_limits=None, seed=0):
+        """
+        Mock Dhan API server running on a background thread
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free port)
+            latency: Seconds added to every response
+            jitter: Extra random delay of up to this many seconds
+            error_rate_429: Share of requests answered with an injected 429
+            error_rate_5xx: Share of requests answered with an injected 500/502/503
+            rate_limits: Requests per second per API family (defaults to Dhan's quotas);
+                         None for a family disables its limit
+            seed: Seed for the injected delays and errors
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        limits = dict(DHAN_RATE_LIMITS)
+        limits.update(rate_limits or {})
+        # A full second's quota may arrive in a burst, but no more
+        self.buckets = {
+            family: TokenBucket(rate, capacity=rate) for family, rate in limits.items() if rate
+        }
+        self.orders = {}
+        self.stats = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_order = 1
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """API root to give clients, e.g. http://127.0.0.1:8765/v2"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-dhan", daemon=True)
+        self._thread.start()
+        logging.info(f"Mock Dhan API listening on {self.url}")
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def summary(self):
+        """Responses served so far, as {(method, route): {status: count}}"""
+        with self._lock:
+            return {key: dict(counts) for key, counts in self.stats.items()}
+
+    def _count(self, method, route, status):
+        with self._lock:
+            counts = self.stats.setdefault((method, route), {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def _draw(self):
+        # Delay and injected error for one request
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            roll = self._random.random()
+            status = self._random.choice((500, 502, 503))
+        if roll < self.error_rate_429:
+            return delay, 429
+        if roll < self.error_rate_429 + self.error_rate_5xx:
+            return delay, status
+        return delay, None
+
+    def _route(self, method, path):
+        """(family, route) for a request path, or (None, None) if unknown"""
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        if parts[:1] != [API_PREFIX.strip('/')]:
+            return None, None
+        parts = parts[1:]
+        if parts == ['charts', 'historical'] and method == 'POST':
+            return 'data', 'historical'
+        if parts == ['charts', 'intraday'] and method == 'POST':
+            return 'data', 'intraday'
+        if parts[:1] == ['marketfeed'] and len(parts) == 2 and method == 'POST':
+            return 'quote', parts[1]
+        if parts[:2] == ['super', 'orders']:
+            if method == 'GET' and len(parts) == 2:
+                return 'non_trading', 'list_orders'
+            if method == 'POST' and len(parts) == 2:
+                return 'order', 'place_order'
+            if method == 'PUT' and len(parts) == 3:
+                return 'order', 'modify_order'
+            if method == 'DELETE' and len(parts) == 4:
+                return 'order', 'cancel_order'
+        return None, None
+
+    def handle(self, method, path, body):
+        """
+        Answer one request
+
+        Returns:
+            (status, response body as a JSON-serialisable object)
+        """
+        family, route = self._route(method, path)
+        if route is None:
+            return 404, {'errorType': 'Input_Exception', 'errorMessage': f"No route for {method} {path}"}
+
+        delay, injected = self._draw()
+        if delay > 0:
+            time.sleep(delay)
+
+        bucket = self.buckets.get(family)
+        if bucket is not None and not bucket.try_acquire():
+            status, response = 429, {'errorType': 'Rate_Limit', 'errorCode': 'DH-904',
+                                     'errorMessage': 'Too many requests'}
+        elif injected == 429:
+            status, response = 429, {'errorType': 'Rate_Limit', 'errorCode': 'DH-904',
+                                     'errorMessage': 'Too many requests (injected)'}
+        elif injected:
+            status, response = injected, {'errorType': 'Server_Error', 'errorMessage': 'Injected failure'}
+        else:
+            status, response = getattr(self, f"_{route}")(path, body)
+
+        self._count(method, route, status)
+        return status, response
+
+    def _historical(self, path, body):
+        try:
+            return 200, mock_candles(body['securityId'], body['fromDate'], body['toDate'])
+        except (KeyError, TypeError, ValueError):
+            return 400, {'errorType': 'Input_Exception', 'errorMessage': 'Missing required fields'}
+
+    def _intraday(self, path, body):
+        try:
+            return 200, mock_intraday_bars(body['securityId'], str(body['fromDate'])[:10],
+                                           str(body['toDate'])[:10], body.get('interval', 1))
+        except (KeyError, TypeError, ValueError):
+            return 400, {'errorType': 'Input_Exception', 'errorMessage': 'Missing required fields'}
+
+    def _quote(self, path, body, fields=('last_price', 'ohlc', 'volume')):
+        today = np.datetime64('today', 'D')
+        data = {}
+        for segment, security_ids in (body or {}).items():
+            data[segment] = {}
+            for security_id in security_ids:
+                candles = mock_candles(security_id, today - 7, today)
+                quote = {
+                    'last_price': candles['close'][-1],
+                    'ohlc': {'open': candles['open'][-1], 'high': candles['high'][-1],
+                             'low': candles['low'][-1], 'close': candles['close'][-2]},
+                    'volume': candles['volume'][-1],
+                }
+                data[segment][str(security_id)] = {field: quote[field] for field in fields}
+        return 200, {'data': data, 'status': 'success'}
+
+    def _ltp(self, path, body):
+        return self._quote(path, body, ('last_price',))
+
+    def _ohlc(self, path, body):
+        return self._quote(path, body, ('last_price', 'ohlc'))
+
+    def _place_order(self, path, body):
+        with self._lock:
+            order_id = str(self._next_order)
+            self._next_order += 1
+            self.orders[order_id] = dict(body or {}, orderId=order_id, orderStatus='PENDING')
+        return 200, {'orderId': order_id, 'orderStatus': 'PENDING'}
+
+    def _modify_order(self, path, body):
+        order_id = path.split('?')[0].rstrip('/').split('/')[-1]
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                return 404, {'errorType': 'Order_Error', 'errorMessage': f"Unknown order {order_id}"}
+            order.update({k: v for k, v in (body or {}).items() if k not in ('orderId', 'dhanClientId')})
+        return 200, {'orderId': order_id, 'orderStatus': order['orderStatus']}
+
+    def _cancel_order(self, path, body):
+        order_id, leg = path.split('?')[0].rstrip('/').split('/')[-2:]
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                return 404, {'errorType': 'Order_Error', 'errorMessage': f"Unknown order {order_id}"}
+            if leg == 'ENTRY_LEG':
+                order['orderStatus'] = 'CANCELLED'
+        return 200, {'orderId': order_id, 'orderStatus': 'CANCELLED'}
+
+    def _list_orders(self, path, body):
+        with self._lock:
+            return 200, list(self.orders.values())
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+            def _serve(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(raw) if raw else None
+                except ValueError:
+                    body = None
+                status, response = server.handle(self.command, self.path, body)
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+            def log_message(self, format, *args):
+                logging.debug(f"mock-dhan {self.address_string()} {format % args}")
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Dhan API')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random delay of up to this many seconds')
+    parser.add_argument('--error-rate-429', type=float, default=0.0, help='Share of requests answered with a 429')
+    parser.add_argument('--error-rate-5xx', type=float, default=0.0, help='Share of requests answered with a 5xx')
+    parser.add_argument('--no-rate-limit', action='store_true', help="Don't enforce Dhan's per-second quotas")
+    parser.add_argument('--seed', type=int, default=0, help='Seed for injected delays and errors')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    rate_limits = {family: None for family in DHAN_RATE_LIMITS} if args.no_rate_limit else None
+    server = MockDhanServer(args.host, args.port, args.latency, args.jitter, args.error_rate_429,
+                            args.error_rate_5xx, rate_limits, args.seed).start()
+    print(f"Mock Dhan API on {server.url} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        for (method, route), counts in sorted(server.summary().items()):
+            print(f"{method} {route}: {counts}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,383 @@
+"""
+Memory-mapped columnar OHLCV cache.
+
+Keeps every stock's daily candles as contiguous NumPy column files
+(day, timestamp, open, high, low, close, volume) next to stock_data.db, in
+<db name>_ohlcv/. Rows are sorted by (stock_id, day) and an index file records
+where each stock's rows start and stop, so reading N days of one stock is a
+zero-copy slice of a memory-mapped array instead of a SQL query.
+
+The cache records the 'history' data version it was built from. Readers only
+use it while that version matches the database, and fall back to SQL
+otherwise, so a stale cache never returns stale data. The nightly update calls
+refresh(), which re-reads only new and recently changed rows; the writers pass
+the stocks whose stored candles they corrected, which are reloaded in full
+(a corrected candle older than the re-read tail is otherwise not noticed).
+"""
+
+import os
+import json
+import shutil
+import logging
+import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from db_connection import connect_read_only
+from db_handler import get_data_version, get_history_layout, HISTORY_LAYOUT_V2
+
+CACHE_COLUMNS = ('day', 'timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+COLUMN_DTYPES = {
+    'day': np.int32,         # days since 1970-01-01
+    'timestamp': np.int64,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.int64,
+}
+
+INDEX_DTYPE = np.dtype([('stock_id', np.int64), ('start', np.int64), ('stop', np.int64)])
+
+# Rows this many days before a stock's last cached day are re-read on refresh,
+# because the daily update re-fetches (and may correct) the last week
+REFRESH_TAIL_DAYS = 10
+
+# Stocks whose last cached day is this many days behind the newest one (delisted
+# or suspended) have their tails read one by one, as in incremental_store, so
+# they don't make the refresh re-read every stock's older history
+REFRESH_LAGGARD_DAYS = 31
+
+def date_to_day(date_str):
+    """Convert a YYYY-MM-DD string to days since the epoch"""
+    return int(np.datetime64(str(date_str)[:10], 'D').astype(np.int64))
+
+def days_to_dates(days):
+    """Convert an array of days since the epoch to YYYY-MM-DD strings"""
+    return np.datetime_as_string(np.asarray(days).astype('datetime64[D]'), unit='D')
+
+def default_cache_dir(db_path):
+    """Cache directory that sits next to the database file"""
+    return os.path.splitext(os.path.abspath(db_path))[0] + '_ohlcv'
+
+def _empty_columns():
+    return {name: np.empty(0, dtype=COLUMN_DTYPES[name]) for name in CACHE_COLUMNS}
+
+def _rows_to_columns(rows):
+    """Convert (stock_id, date, timestamp, open, high, low, close, volume) rows to arrays"""
+    if not rows:
+        return np.empty(0, dtype=np.int64), _empty_columns()
+    stock_ids, dates, timestamps, opens, highs, lows, closes, volumes = zip(*rows)
+    columns = {
+        'day': np.array([str(d)[:10] for d in dates], dtype='datetime64[D]').astype(np.int32),
+        'timestamp': np.array(timestamps, dtype=np.int64),
+        'open': np.array(opens, dtype=np.float64),
+        'high': np.array(highs, dtype=np.float64),
+        'low': np.array(lows, dtype=np.float64),
+        'close': np.array(closes, dtype=np.float64),
+        'volume': np.array([v or 0 for v in volumes], dtype=np.int64),
+    }
+    return np.array(stock_ids, dtype=np.int64), columns
+
+class OHLCVCache:
+    def __init__(self, db_path='stock_data.db', cache_dir=None):
+        """Initialize the cache for a database (nothing is loaded until load() is called)"""
+        self.db_path = db_path
+        self.cache_dir = cache_dir or default_cache_dir(db_path)
+        self.meta = None
+        self.columns = None
+        self.positions = {}
+
+    @property
+    def history_version(self):
+        """The 'history' data version the loaded cache was built from"""
+        return self.meta.get('history_version') if self.meta else None
+
+    def _read_meta(self):
+        meta_path = os.path.join(self.cache_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read OHLCV cache metadata: {e}")
+            return None
+
+    def load(self):
+        """Memory-map the current cache generation; returns False if there is no cache"""
+        meta = self._read_meta()
+        if not meta:
+            return False
+        if self.meta and meta.get('generation') == self.meta.get('generation'):
+            return True
+
+        generation_dir = os.path.join(self.cache_dir, meta['generation'])
+        try:
+            columns = {
+                name: np.load(os.path.join(generation_dir, f"{name}.npy"), mmap_mode='r')
+                for name in CACHE_COLUMNS
+            }
+            index = np.load(os.path.join(generation_dir, 'index.npy'))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load OHLCV cache: {e}")
+            return False
+
+        self.meta = meta
+        self.columns = columns
+        self.positions = {int(row['stock_id']): (int(row['start']), int(row['stop'])) for row in index}
+        return True
+
+    def is_fresh(self, conn):
+        """True if the loaded cache matches the database's current history version"""
+        if not self.load():
+            return False
+        version = get_data_version(conn, 'history')
+        return version is not None and version == self.history_version
+
+    def get_arrays(self, stock_id, from_date=None, to_date=None):
+        """
+        Get one stock's columns for an inclusive date range as zero-copy views
+
+        Returns:
+            dict of column name -> array view, or None if the stock is not cached
+        """
+        if self.columns is None or stock_id not in self.positions:
+            return None
+
+        start, stop = self.positions[stock_id]
+        days = self.columns['day'][start:stop]
+        lo = np.searchsorted(days, date_to_day(from_date), 'left') if from_date else 0
+        hi = np.searchsorted(days, date_to_day(to_date), 'right') if to_date else len(days)
+        return {name: self.columns[name][start + lo:start + hi] for name in CACHE_COLUMNS}
+
+    def get_frame(self, stock_id, from_date=None, to_date=None):
+        """
+        Get one stock's candles as a DataFrame shaped like the history_data queries
+
+        Returns:
+            DataFrame with timestamp, date, open, high, low, close, volume columns,
+            or None if the stock is not cached
+        """
+        arrays = self.get_arrays(stock_id, from_date, to_date)
+        if arrays is None:
+            return None
+        return pd.DataFrame({
+            'timestamp': arrays['timestamp'],
+            'date': days_to_dates(arrays['day']),
+            'open': arrays['open'],
+            'high': arrays['high'],
+            'low': arrays['low'],
+            'close': arrays['close'],
+            'volume': arrays['volume'],
+        })
+
+    def refresh(self, conn=None, reload_ids=None):
+        """
+        Bring the cache up to date with the database
+
+        Stocks whose row count and date span are unchanged keep their cached rows
+        and only re-read the last REFRESH_TAIL_DAYS days; new or otherwise changed
+        stocks are reloaded in full.
+
+        Args:
+            conn: Connection to read from (a read-only one is opened if None)
+            reload_ids: Stocks to reload in full, e.g. those with corrected
+                        candles (the 'updated' count of the history upsert)
+
+        Returns:
+            True if the cache is up to date afterwards
+        """
+        own_conn = conn is None
+        try:
+            if own_conn:
+                conn = connect_read_only(self.db_path)
+
+            # Read everything from one snapshot so the recorded version matches the data
+            conn.execute("BEGIN")
+            try:
+                version = get_data_version(conn, 'history')
+                if version is None:
+                    logging.warning("Database has no data_versions table; OHLCV cache not refreshed")
+                    return False
+
+                self.load()
+                if version == self.history_version:
+                    return True
+
+                v2 = get_history_layout(conn) == HISTORY_LAYOUT_V2
+                if v2:
+                    summary = {
+                        stock_id: (count, min_day, max_day)
+                        for stock_id, count, min_day, max_day in conn.execute("""
+                            SELECT stock_id, COUNT(*), MIN(day), MAX(day)
+                            FROM history_v2_all
+                            GROUP BY stock_id
+                        """)
+                    }
+                else:
+                    summary = {
+                        stock_id: (count, date_to_day(min_date), date_to_day(max_date))
+                        for stock_id, count, min_date, max_date in conn.execute("""
+                            SELECT stock_id, COUNT(*), MIN(date), MAX(date)
+                            FROM history_data
+                            GROUP BY stock_id
+                        """)
+                    }
+
+                parts = self._refresh_parts(conn, summary, v2, reload_ids)
+            finally:
+                conn.rollback()
+
+            self._write(parts, version)
+            logging.info(f"OHLCV cache refreshed: {len(parts)} stocks at history version {version}")
+            return self.load()
+
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.error(f"Error refreshing OHLCV cache: {e}")
+            return False
+        finally:
+            if own_conn and conn:
+                conn.close()
+
+    def _refresh_parts(self, conn, summary, v2=False, reload_ids=None):
+        """Build {stock_id: columns} for every stock in summary, re-reading as little as possible"""
+        select = "SELECT stock_id, date, timestamp, open, high, low, close, volume FROM history_data"
+        # On the v2 layout the view's day column maps onto the primary key
+        order = "ORDER BY stock_id, day" if v2 else "ORDER BY stock_id, date, timestamp"
+        tail_filter = "day > ?" if v2 else "date > ?"
+
+        corrected = {int(stock_id) for stock_id in reload_ids or ()}
+        cached = [stock_id for stock_id in summary if stock_id in self.positions and stock_id not in corrected]
+        reload_ids = [stock_id for stock_id in summary if stock_id not in self.positions or stock_id in corrected]
+        parts = {}
+
+        if cached:
+            # Each stock re-reads the days after its own last cached day less the tail
+            tail_days = {
+                stock_id: int(self.columns['day'][self.positions[stock_id][1] - 1]) - REFRESH_TAIL_DAYS
+                for stock_id in cached
+            }
+            newest = max(tail_days.values())
+            recent = [stock_id for stock_id in cached if tail_days[stock_id] >= newest - REFRESH_LAGGARD_DAYS]
+            reads = [(recent, min(tail_days[stock_id] for stock_id in recent))]
+            reads += [([stock_id], tail_days[stock_id]) for stock_id in cached
+                      if tail_days[stock_id] < newest - REFRESH_LAGGARD_DAYS]
+
+            tails = {}
+            for stock_ids, tail_day in reads:
+                tail_value = tail_day if v2 else str(days_to_dates([tail_day])[0])
+                for chunk in _chunks(stock_ids, 500):
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"{select} WHERE stock_id IN ({placeholders}) AND {tail_filter} {order}",
+                        (*chunk, tail_value)
+                    ).fetchall()
+                    tails.update(_split_by_stock(*_rows_to_columns(rows)))
+
+            for stock_id in cached:
+                tail_day = tail_days[stock_id]
+                start, stop = self.positions[stock_id]
+                cut = start + int(np.searchsorted(self.columns['day'][start:stop], tail_day, 'right'))
+                tail = tails.get(stock_id, _empty_columns())
+                keep = tail['day'] > tail_day
+                merged = {
+                    name: np.concatenate([self.columns[name][start:cut], tail[name][keep]])
+                    for name in CACHE_COLUMNS
+                }
+
+                count, min_day, max_day = summary[stock_id]
+                days = merged['day']
+                if len(days) == count and days[0] == min_day and days[-1] == max_day:
+                    parts[stock_id] = merged
+                else:
+                    reload_ids.append(stock_id)
+
+        for chunk in _chunks(reload_ids, 500):
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"{select} WHERE stock_id IN ({placeholders}) {order}", chunk).fetchall()
+            parts.update(_split_by_stock(*_rows_to_columns(rows)))
+
+        return parts
+
+    def _write(self, parts, version):
+        """Write a new cache generation and switch meta.json to it atomically"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        generation = f"gen-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+        generation_dir = os.path.join(self.cache_dir, generation)
+        os.makedirs(generation_dir)
+
+        stock_ids = sorted(parts)
+        index = np.zeros(len(stock_ids), dtype=INDEX_DTYPE)
+        position = 0
+        for i, stock_id in enumerate(stock_ids):
+            length = len(parts[stock_id]['day'])
+            index[i] = (stock_id, position, position + length)
+            position += length
+
+        for name in CACHE_COLUMNS:
+            if stock_ids:
+                column = np.concatenate([parts[stock_id][name] for stock_id in stock_ids])
+            else:
+                column = np.empty(0)
+            np.save(os.path.join(generation_dir, f"{name}.npy"), column.astype(COLUMN_DTYPES[name]))
+        np.save(os.path.join(generation_dir, 'index.npy'), index)
+
+        meta = {
+            'generation': generation,
+            'history_version': version,
+            'rows': position,
+            'stocks': len(stock_ids),
+            'built_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        meta_tmp = os.path.join(self.cache_dir, 'meta.json.tmp')
+        with open(meta_tmp, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_tmp, os.path.join(self.cache_dir, 'meta.json'))
+
+        self._remove_old_generations(generation)
+
+    def _remove_old_generations(self, current):
+        """Delete superseded generations; files still mapped by another process are retried next time"""
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith('gen-') and entry != current:
+                try:
+                    shutil.rmtree(os.path.join(self.cache_dir, entry))
+                except OSError:
+                    logging.debug(f"OHLCV cache generation {entry} still in use; will remove later")
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _split_by_stock(stock_ids, columns):
+    """Split row-ordered columns into {stock_id: columns} (rows must be grouped by stock)"""
+    if len(stock_ids) == 0:
+        return {}
+    boundaries = np.flatnonzero(np.diff(stock_ids)) + 1
+    starts = np.concatenate([[0], boundaries])
+    stops = np.concatenate([boundaries, [len(stock_ids)]])
+    return {
+        int(stock_ids[start]): {name: columns[name][start:stop] for name in CACHE_COLUMNS}
+        for start, stop in zip(starts, stops)
+    }
+
+# One loaded cache per database path, shared by every reader in the process
+_caches = {}
+
+def get_cache(db_path='stock_data.db'):
+    """Get the process-wide cache for a database"""
+    key = os.path.abspath(db_path)
+    if key not in _caches:
+        _caches[key] = OHLCVCache(db_path)
+    return _caches[key]
+
+def refresh_cache(db_path='stock_data.db', reload_ids=None):
+    """
+    Refresh the cache for a database; used by the nightly update and main.py
+
+    Args:
+        reload_ids: Stocks whose stored candles were corrected (reloaded in full)
+    """
+    return get_cache(db_path).refresh(reload_ids=reload_ids)
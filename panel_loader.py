@@ -0,0 +1,204 @@
+"""
+Aligned dates x stocks panel loader for whole-universe analysis.
+
+load_panel() pulls N stocks by D trading days in one pass (from the OHLCV cache
+when it is fresh, otherwise with one SQL statement per 500 stocks) and returns
+an OHLCVPanel: 2-D open/high/low/close/volume arrays with one row per trading
+date and one column per stock, plus a mask of which cells hold a candle.
+Cross-sectional computations can then run as single NumPy operations.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from db_handler import get_history_layout, HISTORY_LAYOUT_V2
+from ohlcv_cache import get_cache, date_to_day, days_to_dates
+
+PANEL_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+# Stocks per SQL statement when the cache can't be used
+SQL_CHUNK_SIZE = 500
+
+class OHLCVPanel:
+    def __init__(self, days, stock_ids, symbols, names, security_ids, fields, timestamps, mask):
+        """
+        Aligned OHLCV arrays
+
+        Args:
+            days: int array of trading days (days since epoch), the row index
+            stock_ids: int array of stock ids, the column index
+            symbols, names, security_ids: lists aligned with stock_ids
+            fields: dict of field name -> float64 array (dates x stocks, NaN where missing)
+            timestamps: int64 array (dates x stocks, 0 where missing)
+            mask: bool array (dates x stocks), True where a candle exists
+        """
+        self.days = days
+        self.stock_ids = stock_ids
+        self.symbols = symbols
+        self.names = names
+        self.security_ids = security_ids
+        self.fields = fields
+        self.timestamps = timestamps
+        self.mask = mask
+        self._columns = {int(stock_id): i for i, stock_id in enumerate(stock_ids)}
+        self._symbol_columns = {}
+        for i, symbol in enumerate(symbols):
+            self._symbol_columns.setdefault(symbol, []).append(i)
+
+    @property
+    def dates(self):
+        """Trading dates of the rows as YYYY-MM-DD strings"""
+        return days_to_dates(self.days)
+
+    @property
+    def shape(self):
+        return self.mask.shape
+
+    def __getattr__(self, name):
+        # panel.close, panel.open, ... return the 2-D field arrays
+        fields = self.__dict__.get('fields', {})
+        if name in fields:
+            return fields[name]
+        raise AttributeError(name)
+
+    def column(self, stock_id):
+        """Column position of a stock, or None if it is not in the panel"""
+        return self._columns.get(int(stock_id))
+
+    def symbol_column(self, symbol):
+        """Column position of a symbol, or None if it is missing or shared by several stocks"""
+        columns = self._symbol_columns.get(symbol, [])
+        return columns[0] if len(columns) == 1 else None
+
+    def masked(self, field):
+        """A field as a numpy masked array (missing days masked)"""
+        return np.ma.MaskedArray(self.fields[field], mask=~self.mask)
+
+    def frame(self, stock_id):
+        """
+        One stock's candles (present days only) as a DataFrame shaped like the
+        history_data queries: timestamp, date, open, high, low, close, volume
+        """
+        col = self.column(stock_id)
+        if col is None:
+            return None
+        rows = self.mask[:, col]
+        return pd.DataFrame({
+            'timestamp': self.timestamps[rows, col],
+            'date': days_to_dates(self.days[rows]),
+            'open': self.fields['open'][rows, col],
+            'high': self.fields['high'][rows, col],
+            'low': self.fields['low'][rows, col],
+            'close': self.fields['close'][rows, col],
+            'volume': self.fields['volume'][rows, col].astype(np.int64),
+        })
+
+def _select_stocks(conn, symbols=None, stock_ids=None):
+    """Resolve the requested stocks (all stocks if neither filter is given), ordered by id"""
+    query = "SELECT id, symbol, name, security_id FROM stocks"
+    params = []
+    if symbols:
+        query += f" WHERE symbol IN ({','.join('?' * len(symbols))})"
+        params = list(symbols)
+    elif stock_ids:
+        query += f" WHERE id IN ({','.join('?' * len(stock_ids))})"
+        params = [int(stock_id) for stock_id in stock_ids]
+    return conn.execute(query + " ORDER BY id", params).fetchall()
+
+def _load_from_cache(cache, stock_ids, from_date, to_date):
+    """Per-stock (day, timestamp, field...) arrays as zero-copy cache views"""
+    return {stock_id: cache.get_arrays(stock_id, from_date, to_date) for stock_id in stock_ids}
+
+def _load_from_sql(conn, stock_ids, from_date, to_date):
+    """Per-stock arrays read with one statement per SQL_CHUNK_SIZE stocks"""
+    per_stock = {}
+    # On the v2 layout filter on the view's day column, which maps onto the primary key
+    if get_history_layout(conn) == HISTORY_LAYOUT_V2:
+        date_filter = "day BETWEEN ? AND ?"
+        date_range = (date_to_day(from_date), date_to_day(to_date))
+    else:
+        date_filter = "date BETWEEN ? AND ?"
+        date_range = (from_date, to_date)
+    for i in range(0, len(stock_ids), SQL_CHUNK_SIZE):
+        chunk = stock_ids[i:i + SQL_CHUNK_SIZE]
+        df = pd.read_sql_query(f"""
+            SELECT stock_id, date, timestamp, open, high, low, close, volume
+            FROM history_data
+            WHERE stock_id IN ({','.join('?' * len(chunk))})
+            AND {date_filter}
+            ORDER BY stock_id, timestamp
+        """, conn, params=(*chunk, *date_range))
+        if df.empty:
+            continue
+        df['volume'] = df['volume'].fillna(0)
+        df['day'] = pd.to_datetime(df['date'].str[:10]).values.astype('datetime64[D]').astype(np.int64)
+        for stock_id, group in df.groupby('stock_id', sort=False):
+            per_stock[int(stock_id)] = {name: group[name].to_numpy() for name in ('day', 'timestamp') + PANEL_FIELDS}
+    return per_stock
+
+def load_panel(conn, symbols=None, stock_ids=None, days=100, end_date=None, db_path='stock_data.db'):
+    """
+    Load aligned dates x stocks OHLCV arrays in one pass
+
+    Args:
+        conn: SQLite connection
+        symbols: Stock symbols to load (optional)
+        stock_ids: Stock ids to load, used if symbols is not given (optional)
+        days: Number of calendar days of history up to end_date
+        end_date: Last date to include (defaults to today)
+        db_path: Database path, used to locate the OHLCV cache
+
+    Returns:
+        OHLCVPanel, or None if no stocks match
+    """
+    end = datetime.strptime(end_date, "%Y-%m-%d") if end_date else datetime.now()
+    from_date = (end - timedelta(days=days)).strftime("%Y-%m-%d")
+    to_date = end.strftime("%Y-%m-%d")
+
+    stocks = _select_stocks(conn, symbols, stock_ids)
+    if not stocks:
+        logging.warning("No stocks found for panel")
+        return None
+    ids = [row[0] for row in stocks]
+
+    cache = get_cache(db_path)
+    if cache.is_fresh(conn):
+        per_stock = _load_from_cache(cache, ids, from_date, to_date)
+    else:
+        per_stock = _load_from_sql(conn, ids, from_date, to_date)
+    per_stock = {stock_id: arrays for stock_id, arrays in per_stock.items() if arrays is not None}
+
+    # Row index: every trading day on which any requested stock has a candle
+    if per_stock:
+        all_days = np.unique(np.concatenate([arrays['day'] for arrays in per_stock.values()]))
+    else:
+        all_days = np.empty(0, dtype=np.int64)
+    all_days = all_days.astype(np.int64)
+
+    shape = (len(all_days), len(ids))
+    fields = {name: np.full(shape, np.nan) for name in PANEL_FIELDS}
+    timestamps = np.zeros(shape, dtype=np.int64)
+    mask = np.zeros(shape, dtype=bool)
+
+    for col, stock_id in enumerate(ids):
+        arrays = per_stock.get(stock_id)
+        if arrays is None or len(arrays['day']) == 0:
+            continue
+        rows = np.searchsorted(all_days, arrays['day'])
+        mask[rows, col] = True
+        timestamps[rows, col] = arrays['timestamp']
+        for name in PANEL_FIELDS:
+            fields[name][rows, col] = arrays[name]
+
+    logging.info(f"Loaded panel of {shape[0]} dates x {shape[1]} stocks ({int(mask.sum())} candles)")
+    return OHLCVPanel(
+        days=all_days,
+        stock_ids=np.array(ids, dtype=np.int64),
+        symbols=[row[1] for row in stocks],
+        names=[row[2] for row in stocks],
+        security_ids=[row[3] for row in stocks],
+        fields=fields,
+        timestamps=timestamps,
+        mask=mask,
+    )
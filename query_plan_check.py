@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Query-plan regression check for the hot history_data queries.
+
+Builds the schema exactly as DatabaseHandler.create_tables does, loads planner
+statistics that describe a production-sized table (millions of candles), then
+runs EXPLAIN QUERY PLAN on every hot query. The check fails if any of them
+falls back to a full table scan. On the v2 layout the simulated history is
+spread over the hot table and --partitions read-only monthly partitions, so
+every arm of the history_v2_all view is checked.
+
+Usage:
+    python query_plan_check.py                 # check the schema created by the code
+    python query_plan_check.py --db stock_data.db   # check the schema of an existing database
+"""
+
+import sys
+import sqlite3
+import logging
+import argparse
+from db_handler import (
+    DatabaseHandler, HISTORY_LAYOUT_V2, HISTORY_V2_TABLE, HOT_MONTHS, history_v2_table_sql, partition_freeze_sql,
+    partition_name, list_history_partitions, rebuild_history_all_view, month_of_day
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Hot queries as issued by the application, with representative parameters
+HOT_QUERIES = {
+    "SignalGenerator.get_stock_data (symbol)": ("""
+        SELECT h.timestamp, h.date, h.open, h.high, h.low, h.close, h.volume,
+               s.symbol, s.name, s.security_id
+        FROM history_data h
+        JOIN stocks s ON h.stock_id = s.id
+        WHERE s.symbol = ?
+        AND h.date BETWEEN ? AND ?
+        ORDER BY h.timestamp
+    """, ("RELIANCE", "2024-01-01", "2024-04-10")),
+    "SignalGenerator.get_stock_data (security_id)": ("""
+        SELECT h.timestamp, h.date, h.open, h.high, h.low, h.close, h.volume,
+               s.symbol, s.name, s.security_id
+        FROM history_data h
+        JOIN stocks s ON h.stock_id = s.id
+        WHERE h.security_id = ?
+        AND h.date BETWEEN ? AND ?
+        ORDER BY h.timestamp
+    """, ("INE002A01018", "2024-01-01", "2024-04-10")),
+    "AISignalGenerator.get_historical_data": ("""
+        SELECT h.date, h.open, h.high, h.low, h.close, h.volume
+        FROM history_data h
+        JOIN stocks s ON h.stock_id = s.id
+        WHERE s.symbol = ?
+        AND h.date >= ?
+        ORDER BY h.date ASC
+    """, ("RELIANCE", "2024-01-01")),
+    "AutoOrderPlacer.get_latest_candle": ("""
+        SELECT h.date, h.open, h.high, h.low, h.close, h.volume, s.symbol
+        FROM history_data h
+        JOIN stocks s ON h.stock_id = s.id
+        WHERE s.symbol = ?
+        ORDER BY h.date DESC
+        LIMIT 1
+    """, ("RELIANCE",)),
+    "StockListApp.view_chart (stock_id)": ("""
+        SELECT timestamp, date, open, high, low, close, volume
+        FROM history_data
+        WHERE stock_id = ?
+        AND date BETWEEN ? AND ?
+        ORDER BY timestamp
+    """, (1, "2024-01-01", "2024-12-31")),
+    "StockListApp.view_chart (security_id fallback)": ("""
+        SELECT timestamp, date, open, high, low, close, volume
+        FROM history_data
+        WHERE security_id = ?
+        AND date BETWEEN ? AND ?
+        ORDER BY timestamp
+    """, ("INE002A01018", "2024-01-01", "2024-12-31")),
+    "DatabaseHandler.data_exists_for_security_and_date": ("""
+        SELECT 1 FROM history_data h
+        JOIN stocks s ON h.stock_id = s.id
+        WHERE s.security_id = ? AND h.date = ?
+        LIMIT 1
+    """, ("INE002A01018", "2024-01-01")),
+}
+
+# Average number of rows sharing one value of an index's leading column
+LEADING_COLUMN_ROWS = {
+    ('history_data', 'stock_id'): 2500,
+    ('history_data', 'security_id'): 2500,
+    ('history_data', 'date'): 2000,
+}
+
+def build_schema(source_db=None, partitions=0):
+    """Return an in-memory connection holding the schema to check"""
+    if source_db:
+        conn = sqlite3.connect(":memory:")
+        source = sqlite3.connect(source_db)
+        for (sql,) in source.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY CASE type WHEN 'table' THEN 0 ELSE 1 END"
+        ):
+            conn.execute(sql)
+        source.close()
+        return conn
+
+    db = DatabaseHandler(":memory:")
+    if not db.connect():
+        raise sqlite3.Error("Could not create schema")
+    if db.history_layout == HISTORY_LAYOUT_V2 and partitions:
+        # The monthly partitions roll_history_partitions would have created (the
+        # months are arbitrary; they end before day 20000, 2024-10-04)
+        first_month = month_of_day(20000) - partitions
+        for month in range(first_month, first_month + partitions):
+            name = partition_name(month)
+            db.conn.execute(history_v2_table_sql(name))
+            for sql in partition_freeze_sql(name):
+                db.conn.execute(sql)
+        rebuild_history_all_view(db.conn)
+        db.conn.commit()
+    return db.conn
+
+def load_statistics(conn, history_rows, stock_count):
+    """Describe a production-sized database to the query planner via sqlite_stat1"""
+    table_rows = {'history_data': history_rows, 'stocks': stock_count}
+    v2_tables = []
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (HISTORY_V2_TABLE,)).fetchone():
+        # Spread the history over the hot months and the partitions
+        v2_tables = [name for name, _, _ in list_history_partitions(conn)]
+        month_rows = history_rows // (len(v2_tables) + HOT_MONTHS)
+        table_rows.update({name: month_rows for name in v2_tables})
+        table_rows[HISTORY_V2_TABLE] = month_rows * HOT_MONTHS
+        v2_tables.append(HISTORY_V2_TABLE)
+
+    conn.execute("ANALYZE")
+    conn.execute("DELETE FROM sqlite_stat1")
+
+    for table, rows in table_rows.items():
+        conn.execute("INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, NULL, ?)", (table, str(rows)))
+        indexes = conn.execute(f"PRAGMA index_list({table})").fetchall()
+        for index in indexes:
+            index_name, unique = index[1], index[2]
+            columns = [row[2] for row in conn.execute(f"PRAGMA index_info({index_name})")]
+            if not columns:
+                continue
+            if table in v2_tables:
+                leading = max(rows // stock_count, 1)
+            else:
+                leading = 1 if unique and len(columns) == 1 else LEADING_COLUMN_ROWS.get((table, columns[0]), 1)
+            stats = [rows, leading] + [1] * (len(columns) - 1)
+            conn.execute(
+                "INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)",
+                (table, index_name, " ".join(str(value) for value in stats))
+            )
+
+    conn.commit()
+    # Make the planner re-read sqlite_stat1
+    conn.execute("ANALYZE sqlite_master")
+
+def find_full_scans(conn):
+    """
+    Run EXPLAIN QUERY PLAN on every hot query
+
+    Returns:
+        dict mapping query name to (plan lines, list of full-scan lines)
+    """
+    results = {}
+    for name, (query, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        scans = [line for line in plan if line.startswith("SCAN ")]
+        results[name] = (plan, scans)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that hot queries use indexes on a large history_data table')
+    parser.add_argument('--db', help='Check the schema of this database instead of the one created by the code')
+    parser.add_argument('--rows', type=int, default=5000000, help='Simulated number of history_data rows')
+    parser.add_argument('--stocks', type=int, default=2000, help='Simulated number of stocks')
+    parser.add_argument('--partitions', type=int, default=24,
+                        help='Simulated monthly history partitions (ignored with --db)')
+    args = parser.parse_args()
+
+    conn = build_schema(args.db, args.partitions)
+    load_statistics(conn, args.rows, args.stocks)
+
+    failures = 0
+    for name, (plan, scans) in find_full_scans(conn).items():
+        status = "FAIL" if scans else "OK"
+        print(f"[{status}] {name}")
+        for line in plan:
+            print(f"       {line}")
+        failures += bool(scans)
+
+    conn.close()
+
+    if failures:
+        print(f"{failures} hot queries fall back to a full table scan")
+        return 1
+    print("All hot queries use an index")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+Token-bucket rate limiting for the Dhan API.
+
+Dhan enforces per-second request quotas per API family. Every request made by
+this process takes a token from the shared bucket for its family first, so any
+number of fetch worker threads together stay within the quota and throughput is
+set by the quota rather than by per-request latency or fixed sleeps.
+
+The rate of each family adapts to what Dhan actually allows (AIMD, as in TCP
+congestion control): every response is reported back to the limiter, a 429
+cuts the rate of all callers of the family at once, and throttle-free time
+adds it back linearly up to the configured quota. Rising latency stops the
+increase and trims the rate slightly. A 429 also holds the bucket for its
+Retry-After, so callers retry a 429 through the limiter instead of sleeping
+on their own.
+"""
+
+import os
+import time
+import logging
+import threading
+
+# Dhan's documented per-second quotas per API family. Historical candles are
+# "data" APIs
+DHAN_RATE_LIMITS = {
+    'data': 5,
+    'quote': 1,
+    'order': 25,
+    'non_trading': 20,
+}
+
+# AIMD tuning
+RATE_DECREASE_FACTOR = 0.7      # rate kept after a 429
+RATE_INCREASE_SHARE = 0.05      # share of the quota added back per throttle-free second
+RATE_PROBE_SLOWDOWN = 0.25      # increase speed near the rate that was last throttled
+MIN_RATE_SHARE = 0.1            # the rate never drops below this share of the quota
+LATENCY_FACTOR = 3.0            # latency above this multiple of the baseline counts as congestion
+LATENCY_DECREASE_FACTOR = 0.9   # rate kept after a latency rise
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        """
+        Thread-safe token bucket
+
+        Args:
+            rate: Tokens added per second
+            capacity: Largest burst. The default of 1 spaces requests evenly:
+                a full bucket of N plus the next second's refill would allow 2N
+                requests within one second and trip a per-second quota
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """
+        Take tokens, blocking until they are available
+
+        The tokens are reserved at once (the bucket may go into debt) and the
+        caller sleeps until they are paid off, so waiting threads are served in
+        arrival order instead of racing for each refill.
+
+        Returns:
+            Seconds spent waiting
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if they are available right now; returns True on success"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def set_rate(self, rate):
+        """Change the refill rate; tokens earned so far are kept"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+
+    def drain(self, seconds=0.0):
+        """Empty the bucket, and hold back refills for another number of seconds"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    def hold(self, seconds):
+        """Make sure no token is handed out for the next number of seconds, without adding to a longer debt"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+class AdaptiveRateLimiter:
+    def __init__(self, quota, family='data'):
+        """
+        Token bucket whose rate follows the responses reported with record()
+
+        Args:
+            quota: Highest rate in requests per second (the documented quota)
+            family: API family name, for logging
+        """
+        self.family = family
+        self.quota = float(quota)
+        self.floor = self.quota * MIN_RATE_SHARE
+        self.bucket = TokenBucket(self.quota)
+        self._lock = threading.Lock()
+        self._adjusted = time.monotonic()  # last rate change or increase step
+        self._decreased = 0.0              # requests sent before this can't cut the rate again
+        self._throttled_rate = None        # rate at the last 429
+        self._latency = None               # EWMA of response latency
+        self._baseline = None              # normal latency EWMA
+        self.requests = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.waited = 0.0
+
+    @property
+    def rate(self):
+        """Current allowed rate in requests per second"""
+        return self.bucket.rate
+
+    def acquire(self, tokens=1):
+        """Wait for a request slot; returns seconds spent waiting"""
+        waited = self.bucket.acquire(tokens)
+        with self._lock:
+            self.waited += waited
+        return waited
+
+    def try_acquire(self, tokens=1):
+        return self.bucket.try_acquire(tokens)
+
+    def record(self, started, status_code, retry_after=None):
+        """
+        Report the outcome of a request
+
+        Args:
+            started: time.monotonic() when the request was sent
+            status_code: HTTP status of the response
+            retry_after: Retry-After header value, if any
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            rate = self.bucket.rate
+            if status_code == 429:
+                self.throttled += 1
+                try:
+                    hold = max(0.0, float(retry_after)) if retry_after else 0.0
+                except ValueError:
+                    hold = 0.0
+                # Requests already in flight when the rate was cut see the same
+                # overload; only the first 429 after a cut counts, but every
+                # Retry-After is honoured before the next request goes out
+                if started < self._decreased:
+                    self.bucket.hold(hold)
+                    return
+                self._throttled_rate = rate
+                self._set_rate(rate * RATE_DECREASE_FACTOR, now)
+                self.bucket.drain(hold)
+                logging.warning(
+                    f"Dhan {self.family} rate limit hit; slowing to {self.bucket.rate:.2f} requests/s"
+                )
+                return
+
+            latency = now - started
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            # The baseline follows drops at once and rises slowly, so a lasting
+            # change in server latency becomes the new normal
+            if self._baseline is None or self._latency < self._baseline:
+                self._baseline = self._latency
+            else:
+                self._baseline += 0.01 * (self._latency - self._baseline)
+            if self._latency > LATENCY_FACTOR * self._baseline:
+                if started >= self._decreased:
+                    self._set_rate(rate * LATENCY_DECREASE_FACTOR, now)
+                return
+
+            # Additive increase for the throttle-free time since the last step,
+            # slower once the rate is back near where it was last throttled
+            step = RATE_INCREASE_SHARE * self.quota * (now - self._adjusted)
+            if self._throttled_rate and rate >= 0.9 * self._throttled_rate:
+                step *= RATE_PROBE_SLOWDOWN
+            self._adjusted = now
+            if rate < self.quota:
+                self.bucket.set_rate(min(self.quota, rate + step))
+
+    def _set_rate(self, rate, now):
+        # Multiplicative decrease; called with the lock held
+        self.bucket.set_rate(max(self.floor, rate))
+        self._adjusted = now
+        self._decreased = now
+        self.decreases += 1
+
+    def stats(self):
+        """Current rate, quota, request and throttle counts and latency"""
+        with self._lock:
+            return {
+                'rate': round(self.bucket.rate, 3),
+                'quota': self.quota,
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'decreases': self.decreases,
+                'waited_seconds': round(self.waited, 3),
+                'latency_ms': round(self._latency * 1000, 1) if self._latency is not None else None,
+            }
+
+# One limiter per API family, shared by every thread in the process
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(family='data'):
+    """
+    Get the process-wide adaptive limiter for a Dhan API family
+
+    The quota can be overridden with an environment variable such as
+    DHAN_DATA_RATE_LIMIT=10 (requests per second).
+    """
+    with _limiters_lock:
+        if family not in _limiters:
+            quota = float(os.getenv(f"DHAN_{family.upper()}_RATE_LIMIT", DHAN_RATE_LIMITS[family]))
+            _limiters[family] = AdaptiveRateLimiter(quota, family)
+        return _limiters[family]
+
+def rate_limit_stats():
+    """stats() of every limiter used so far, by API family"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {family: limiter.stats() for family, limiter in limiters.items()}
@@ -0,0 +1,226 @@
+"""
+Cache of computed signal frames and latest-signal records.
+
+SignalGenerator.analyze_stock() is called again and again for the same stocks
+on the same data (the stock list UI, its signal filter, the CLI). Its result
+depends only on the stock's candles in the requested window and the signal
+parameters, so it is cached under
+
+    (stock_id, last candle day, first day of the window, sma_period, rsi_period, rsi_threshold)
+
+in a per-process LRU and in the signal_cache table, which other processes
+share. Everything cached belongs to one 'history' data version: when new or
+corrected candles land the version moves and the cache starts over, so an
+entry is never served for data it wasn't computed from.
+
+Lookups read through the caller's connection. Writes to the table go through
+the cache's own connection and are committed there, so a lookup never commits
+(or fails) a transaction the caller has open.
+"""
+
+import io
+import os
+import json
+import logging
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from datetime import datetime
+from db_connection import get_connection, READ_WRITE
+from db_handler import get_data_version, SIGNAL_CACHE_TABLE_SQL
+from update_planner import get_watermarks
+
+# Entries kept in memory per database
+SIGNAL_CACHE_SIZE = 1024
+
+def _json_default(value):
+    # numpy scalars (np.int64, np.bool_, ...) in signal records
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+def encode_frame(frame):
+    """Serialize a signal frame: numeric columns as arrays, text columns as JSON"""
+    numeric = {}
+    text = {}
+    for name in frame.columns:
+        if pd.api.types.is_numeric_dtype(frame[name]):
+            numeric[name] = frame[name].to_numpy()
+        else:
+            text[name] = frame[name].tolist()
+    header = json.dumps({'columns': [str(name) for name in frame.columns], 'text': text}, default=_json_default)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, __header__=np.frombuffer(header.encode('utf-8'), dtype=np.uint8), **numeric)
+    return buffer.getvalue()
+
+def decode_frame(blob):
+    """Inverse of encode_frame()"""
+    with np.load(io.BytesIO(blob), allow_pickle=False) as arrays:
+        header = json.loads(arrays['__header__'].tobytes().decode('utf-8'))
+        columns = {name: arrays[name] if name in arrays.files else header['text'][name]
+                   for name in header['columns']}
+    return pd.DataFrame(columns, columns=header['columns'])
+
+class SignalCache:
+    def __init__(self, db_path='stock_data.db', max_entries=SIGNAL_CACHE_SIZE):
+        """
+        Signal cache for one database
+
+        Args:
+            db_path: Database path
+            max_entries: Entries kept in memory; the least recently used go first
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.history_version = None
+        self.watermarks = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Own connection for writes, opened on first use and shared by every thread
+        self._conn = None
+        self._write_lock = threading.Lock()
+
+    def _write(self, sql, params):
+        """Run one statement on the cache's own connection and commit it (raises sqlite3.Error)"""
+        with self._write_lock:
+            if self._conn is None:
+                self._conn = get_connection(self.db_path, READ_WRITE, check_same_thread=False)
+            try:
+                self._conn.execute(SIGNAL_CACHE_TABLE_SQL)
+                self._conn.execute(sql, params)
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+
+    def _sync(self, conn):
+        """
+        Start over if the history version moved
+
+        Returns:
+            Current history version, or None if the database has no version counters
+        """
+        version = get_data_version(conn, 'history')
+        with self._lock:
+            if version == self.history_version:
+                return version
+            self.entries.clear()
+            self.watermarks = None
+            self.history_version = version
+        if version is None:
+            return None
+        try:
+            self._write("DELETE FROM signal_cache WHERE history_version != ?", (version,))
+        except sqlite3.Error as e:
+            # A read-only or busy database still serves entries of the current version
+            logging.warning(f"Could not prune the signal cache: {e}")
+        return version
+
+    def last_day(self, conn, stock_id):
+        """A stock's last stored candle day, or None"""
+        if self._sync(conn) is None:
+            return None
+        with self._lock:
+            watermarks = self.watermarks
+        if watermarks is None:
+            watermarks = get_watermarks(conn)
+            with self._lock:
+                self.watermarks = watermarks
+        return watermarks.get(int(stock_id))
+
+    @staticmethod
+    def _key(stock_id, last_day, from_day, params):
+        return (int(stock_id), int(last_day), int(from_day),
+                int(params['ma_period']), int(params['rsi_period']), float(params['rsi_threshold']))
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, conn, stock_id, last_day, from_day, params):
+        """
+        Cached result for a stock's window and parameters
+
+        Args:
+            conn: Database connection
+            stock_id: Stock id
+            last_day: Day of the stock's last candle (days since the epoch)
+            from_day: First day of the analysed window
+            params: dict with ma_period, rsi_period and rsi_threshold
+
+        Returns:
+            (signal frame, latest-signal record) copies, or None
+        """
+        version = self._sync(conn)
+        if version is None or last_day is None:
+            return None
+        key = self._key(stock_id, last_day, from_day, params)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            try:
+                row = conn.execute('''
+                    SELECT signals, frame FROM signal_cache
+                    WHERE stock_id = ? AND last_day = ? AND from_day = ? AND sma_period = ?
+                    AND rsi_period = ? AND rsi_threshold = ? AND history_version = ?
+                ''', key + (version,)).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"Error reading the signal cache: {e}")
+                row = None
+            with self._lock:
+                if row is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            if row is None:
+                return None
+            entry = (decode_frame(row[1]), json.loads(row[0]))
+            self._remember(key, entry)
+        frame, signals = entry
+        return frame.copy(), dict(signals)
+
+    def put(self, conn, stock_id, last_day, from_day, params, frame, signals):
+        """Cache a computed result (see get() for the arguments; conn is only read)"""
+        version = self._sync(conn)
+        if version is None:
+            return
+        key = self._key(stock_id, last_day, from_day, params)
+        # Stored as it will be read back, so memory and table hits return the same types
+        record = json.dumps(signals, default=_json_default)
+        self._remember(key, (frame.copy(), json.loads(record)))
+        try:
+            self._write('''
+                INSERT OR REPLACE INTO signal_cache (
+                    stock_id, last_day, from_day, sma_period, rsi_period, rsi_threshold,
+                    history_version, signals, frame, created
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', key + (version, record, encode_frame(frame), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        except sqlite3.Error as e:
+            logging.warning(f"Error writing the signal cache: {e}")
+
+    def stats(self):
+        """Hit and miss counts and the number of entries in memory"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+# One cache per database path, shared by every signal generator in the process
+_signal_caches = {}
+_signal_caches_lock = threading.Lock()
+
+def get_signal_cache(db_path='stock_data.db'):
+    """Get the process-wide signal cache for a database"""
+    key = os.path.abspath(db_path)
+    with _signal_caches_lock:
+        if key not in _signal_caches:
+            _signal_caches[key] = SignalCache(db_path)
+        return _signal_caches[key]
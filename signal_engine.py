@@ -0,0 +1,143 @@
+"""
+Cross-sectional signal engine.
+
+Computes the SMA / RSI crossover signals of SignalGenerator.generate_signals()
+and get_latest_signals() for every stock of an OHLCVPanel at once, as a few
+NumPy operations on the dates x stocks arrays, and returns one row per stock.
+
+The per-stock path works on each stock's own candles, so a day on which a stock
+has no candle is not part of its windows. The engine keeps those semantics by
+packing every column first: each stock's candles are moved, in order, to the
+bottom of the array with NaN above them, so row -1 is every stock's latest
+candle and the rolling windows see exactly the candles the per-stock frames
+would. Pandas' rolling rules carry over: a window with fewer than `period`
+values (or any NaN) is NaN, and NaN compares as False.
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from ohlcv_cache import days_to_dates
+
+SIGNAL_COLUMNS = (
+    'stock_id', 'date', 'symbol', 'name', 'security_id', 'close', 'ma_50', 'rsi', 'price_vs_ma',
+    'ma_signal', 'rsi_signal', 'combined_signal', 'ma_signal_desc', 'rsi_signal_desc',
+    'combined_signal_desc', 'recent_ma_crossover', 'recent_rsi_crossover', 'change_percent', 'volume'
+)
+
+def pack_columns(mask, *arrays):
+    """
+    Move each column's present cells to the bottom, keeping their order
+
+    Args:
+        mask: bool array (dates x stocks), True where a candle exists
+        *arrays: arrays shaped like mask to pack the same way
+
+    Returns:
+        (packed mask, [packed arrays]); cells above a column's candles hold
+        whatever the source held for its missing days (NaN for panel fields)
+    """
+    # A stable sort on the mask puts missing rows first and present rows last,
+    # each group in date order
+    order = np.argsort(mask, axis=0, kind='stable')
+    packed = [np.take_along_axis(array, order, axis=0) for array in arrays]
+    return np.take_along_axis(mask, order, axis=0), packed
+
+def rolling_mean(values, window):
+    """Column-wise rolling mean with pandas' rolling(window).mean() NaN rules"""
+    out = np.full(values.shape, np.nan)
+    if window > 0 and len(values) >= window:
+        out[window - 1:] = sliding_window_view(values, window, axis=0).mean(axis=-1)
+    return out
+
+def diff(values):
+    """Column-wise first difference (NaN in the first row), like Series.diff()"""
+    out = np.full(values.shape, np.nan)
+    out[1:] = values[1:] - values[:-1]
+    return out
+
+def rsi(close, period=14):
+    """Column-wise RSI with simple moving averages of gains and losses (calculate_rsi)"""
+    delta = diff(close)
+    gain = np.where(delta < 0, 0.0, delta)
+    loss = np.abs(np.where(delta > 0, 0.0, delta))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = rolling_mean(gain, period) / rolling_mean(loss, period)
+        return 100 - (100 / (1 + rs))
+
+def universe_signals(panel, sma_period=50, rsi_period=14, rsi_threshold=50):
+    """
+    Latest SMA / RSI signals for every stock in a panel
+
+    Args:
+        panel: OHLCVPanel from load_panel()
+        sma_period, rsi_period, rsi_threshold: As for SignalGenerator.generate_signals()
+
+    Returns:
+        DataFrame with one row per stock (SIGNAL_COLUMNS, the keys of
+        get_latest_signals()), for the stocks with enough candles for both
+        indicators; stocks that generate_signals() would reject are left out
+    """
+    mask, (close, volume, days) = pack_columns(
+        panel.mask, panel.close, panel.volume, np.broadcast_to(panel.days[:, None], panel.shape)
+    )
+    counts = mask.sum(axis=0)
+    keep = counts >= max(sma_period, rsi_period + 1, 2)
+    if not keep.any():
+        return pd.DataFrame(columns=list(SIGNAL_COLUMNS))
+
+    close, volume, days = close[:, keep], volume[:, keep], days[:, keep]
+    sma = rolling_mean(close, sma_period)
+    rsi_values = rsi(close, rsi_period)
+
+    # Crossovers are only needed for the last two candles, which take the last three rows
+    tail = slice(-3, None)
+    with np.errstate(invalid='ignore'):
+        price_above_ma = (close[tail] > sma[tail]).astype(int)
+        rsi_above = (rsi_values[tail] > rsi_threshold).astype(int)
+    ma_signal = diff(price_above_ma)
+    rsi_signal = diff(rsi_above)
+    combined = ((ma_signal > 0) & (rsi_signal > 0)).astype(int)
+
+    latest_close, previous_close = close[-1], close[-2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_percent = np.where(
+            previous_close > 0, (latest_close - previous_close) / previous_close * 100, 0.0
+        )
+
+    # get_latest_signals() also looks one candle back when a stock has at least 3
+    lookback = counts[keep] >= 3
+    recent_ma = (ma_signal[-1] != 0) | (lookback & (ma_signal[-2] != 0))
+    recent_rsi = (rsi_signal[-1] != 0) | (lookback & (rsi_signal[-2] != 0))
+
+    def describe(signal, up, down):
+        return np.where(signal[-1] > 0, up, np.where(signal[-1] < 0, down, 'NEUTRAL'))
+
+    combined_desc = describe(combined, 'STRONG BUY', 'STRONG SELL')
+    fresh = recent_ma & recent_rsi
+    combined_desc = np.where(fresh & (combined_desc == 'STRONG BUY'), 'FRESH STRONG BUY',
+                             np.where(fresh & (combined_desc == 'STRONG SELL'), 'FRESH STRONG SELL',
+                                      combined_desc))
+
+    columns = np.flatnonzero(keep)
+    return pd.DataFrame({
+        'stock_id': panel.stock_ids[columns],
+        'date': days_to_dates(days[-1]),
+        'symbol': [panel.symbols[i] for i in columns],
+        'name': [panel.names[i] for i in columns],
+        'security_id': [panel.security_ids[i] for i in columns],
+        'close': latest_close,
+        'ma_50': sma[-1],
+        'rsi': rsi_values[-1],
+        'price_vs_ma': np.where(latest_close > sma[-1], 'ABOVE', 'BELOW'),
+        'ma_signal': ma_signal[-1],
+        'rsi_signal': rsi_signal[-1],
+        'combined_signal': combined[-1],
+        'ma_signal_desc': describe(ma_signal, 'BUY', 'SELL'),
+        'rsi_signal_desc': describe(rsi_signal, 'BUY', 'SELL'),
+        'combined_signal_desc': combined_desc,
+        'recent_ma_crossover': recent_ma,
+        'recent_rsi_crossover': recent_rsi,
+        'change_percent': change_percent,
+        'volume': np.nan_to_num(volume[-1]).astype(np.int64),
+    }, columns=list(SIGNAL_COLUMNS))
@@ -1,12 +1,18 @@
-import requests
 import json
 import time
 import os
 import logging
 import csv
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from db_handler import DatabaseHandler
+from db_handler import DatabaseHandler, parse_history_payload
+from instrument_registry import get_registry
+from dhan_transport import get_transport, DHAN_API_URL
+from synthetic_market import synthetic_history
+from ohlcv_cache import refresh_cache
+from indicator_state import update_indicator_state
+from feature_store import update_feature_store
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -14,10 +20,41 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Load environment variables
 load_dotenv()
 
+# Concurrent historical requests. The shared rate limiter sets the throughput;
+# the workers only need to cover the API's latency (rate x round-trip time)
+FETCH_WORKERS = 8
+
+# Days per historical request when fetching long spans: small requests are quick
+# to retry, and a failure only loses its own window
+HISTORY_WINDOW_DAYS = 180
+
+# Days per intraday request; Dhan serves at most 90 days of minute bars per call
+INTRADAY_WINDOW_DAYS = 90
+
+# Settings key holding how many days of history main.py keeps
+RETENTION_SETTING = 'history_retention_days'
+
+def merge_history_payloads(payloads):
+    """
+    Merge API responses for several windows of one stock into a single 'candles'
+    payload, sorted by date with one candle per day (later payloads win)
+    """
+    merged = {}
+    for data in payloads:
+        columns = parse_history_payload(data)
+        if columns is None:
+            continue
+        for i, date in enumerate(columns['date']):
+            merged[str(date)[:10]] = [
+                str(date)[:10], columns['open'][i], columns['high'][i], columns['low'][i],
+                columns['close'][i], columns['volume'][i], columns['open_interest'][i]
+            ]
+    return {'candles': [merged[date] for date in sorted(merged)]}
+
 class StockFetcher:
     def __init__(self):
         """Initialize the StockFetcher with API details"""
-        self.api_base_url = "https://api.dhan.co/v2"
+        self.api_base_url = DHAN_API_URL
         
         # Database connection
         self.db = DatabaseHandler()
@@ -31,12 +68,9 @@ class StockFetcher:
             if not self.api_key:
                 logging.warning("API key not found in environment variables. Set DHAN_API_KEY in .env file or update settings table.")
         
-        # Headers for API requests
-        self.headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "access-token": self.api_key
-        }
+        # Pooled keep-alive connection to the API (also supplies the headers
+        # and applies the shared per-second rate limit)
+        self.transport = get_transport(self.api_key, self.api_base_url)
         
         # Exchange segments and instruments we're interested in
         self.exchange_segments = ["NSE_EQ"]  # Can add more like "BSE_EQ", "NSE_FNO", etc.
@@ -127,8 +161,19 @@ class StockFetcher:
             logging.info(f"Using {len(nse_stocks)} hardcoded NSE stocks")
             return nse_stocks[:max_stocks]
     
-    def fetch_historical_daily_data(self, security_id, exchange_segment, instrument, from_date, to_date, retries=3):
-        """Fetch daily historical data for a stock"""
+    def fetch_historical_daily_data(self, security_id, exchange_segment, instrument, from_date, to_date, retries=3,
+                                    demo_fallback=True):
+        """
+        Fetch daily historical data for a stock
+        
+        Args:
+            demo_fallback: Return demo data when every attempt fails. Paths that store
+                           the candles pass False, so a failed fetch stays a failure
+                           (and a backfill unit stays pending) instead of writing fake data
+        
+        Returns:
+            API response, or None on failure
+        """
         endpoint = f"{self.api_base_url}/charts/historical"
         
         # Ensure security_id is a string
@@ -176,14 +221,17 @@ class StockFetcher:
         for attempt in range(retries):
             try:
                 logging.info(f"Fetching data for security ID: {security_id}")
-                response = requests.post(endpoint, headers=self.headers, json=payload)
+                response = self.transport.post(endpoint, json=payload)
                 
                 if response.status_code == 200:
                     return response.json()
                 elif response.status_code == 429:  # Rate limit
-                    wait_time = (2 ** attempt) + 1  # Exponential backoff
-                    logging.warning(f"Rate limit hit. Waiting for {wait_time} seconds before retry.")
-                    time.sleep(wait_time)
+                    # The shared limiter has slowed every worker down and holds the
+                    # next request for any Retry-After; the retry waits in it
+                    if attempt < retries - 1:
+                        logging.warning(f"Rate limit hit for {security_id}; retrying through the rate limiter")
+                    else:
+                        logging.error(f"Rate limit hit for {security_id}; giving up after {retries} attempts")
                 else:
                     logging.error(f"Error fetching data: {response.status_code} - {response.text}")
                     
@@ -200,7 +248,7 @@ class StockFetcher:
                         }
                         
                         try:
-                            response = requests.post(endpoint, headers=self.headers, json=simple_payload)
+                            response = self.transport.post(endpoint, json=simple_payload)
                             if response.status_code == 200:
                                 return response.json()
                         except Exception as inner_e:
@@ -209,44 +257,271 @@ class StockFetcher:
                     if attempt < retries - 1:
                         time.sleep(2)  # Wait before retry
                     else:
-                        # Try to load demo data if API call fails
-                        logging.info(f"Falling back to demo data for {security_id}")
-                        demo_data = self.get_demo_data(security_id, from_date, to_date)
-                        if demo_data:
-                            return demo_data
-                        return None
+                        return self._fetch_failed(security_id, from_date, to_date, demo_fallback)
             except Exception as e:
                 logging.error(f"Exception while fetching data: {e}")
                 if attempt < retries - 1:
                     time.sleep(2)  # Wait before retry
                 else:
-                    # Try to load demo data if API call fails
-                    logging.info(f"Falling back to demo data for {security_id}")
-                    demo_data = self.get_demo_data(security_id, from_date, to_date)
-                    if demo_data:
-                        return demo_data
-                    return None
+                    return self._fetch_failed(security_id, from_date, to_date, demo_fallback)
         
         return None
     
+    def _fetch_failed(self, security_id, from_date, to_date, demo_fallback):
+        """Result of a fetch whose attempts all failed: demo data if allowed, else None"""
+        if not demo_fallback:
+            logging.error(f"Giving up on {security_id} ({from_date} to {to_date})")
+            return None
+        # Try to load demo data if API call fails
+        logging.info(f"Falling back to demo data for {security_id}")
+        demo_data = self.get_demo_data(security_id, from_date, to_date)
+        if demo_data:
+            return demo_data
+        return None
+    
+    def fetch_many(self, jobs, fetch, max_workers=FETCH_WORKERS):
+        """
+        Run fetch(job) for many jobs on a worker pool
+        
+        Requests made by fetch (e.g. fetch_historical_daily_data) go through the
+        shared transport and its rate limiter, so the pool runs as fast as the
+        API quota allows.
+        Results are yielded in completion order on the calling thread, which can
+        therefore write them to its own database connection.
+        
+        Args:
+            jobs: Iterable of job objects (e.g. stock tuples or dicts)
+            fetch: Function called with one job in a worker thread
+            max_workers: Number of concurrent requests
+        
+        Returns:
+            Generator of (job, result) pairs; result is None if fetch raised
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(fetch, job): job for job in jobs}
+            try:
+                for future in as_completed(futures):
+                    job = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logging.error(f"Error fetching {job}: {e}")
+                        result = None
+                    yield job, result
+            finally:
+                # Don't start the remaining requests if the caller stops early
+                for future in futures:
+                    future.cancel()
+    
+    def split_date_range(self, from_date, to_date, window_days=HISTORY_WINDOW_DAYS):
+        """
+        Split a date span into request windows of at most window_days
+        
+        Consecutive windows share their boundary day, so no day is lost whether
+        the API treats toDate as inclusive or not; merging removes the overlap.
+        
+        Returns:
+            list of (from_date, to_date) YYYY-MM-DD pairs
+        """
+        start = datetime.strptime(from_date, "%Y-%m-%d")
+        end = datetime.strptime(to_date, "%Y-%m-%d")
+        windows = []
+        while start < end:
+            window_end = min(start + timedelta(days=window_days), end)
+            windows.append((start.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d")))
+            start = window_end
+        return windows or [(from_date, to_date)]
+    
+    def fetch_historical_data_windowed(self, security_id, exchange_segment, instrument, from_date, to_date,
+                                       window_days=HISTORY_WINDOW_DAYS):
+        """
+        Fetch a long span of daily history for one stock as concurrent windows
+        
+        Each window is fetched (and retried) on its own, so one failed window
+        doesn't lose the rest of the span.
+        
+        Returns:
+            Merged 'candles' payload, or None if every window failed
+        """
+        windows = self.split_date_range(from_date, to_date, window_days)
+        
+        def fetch_window(window):
+            return self.fetch_historical_daily_data(
+                security_id, exchange_segment, instrument, *window, demo_fallback=False
+            )
+        
+        results = dict(self.fetch_many(windows, fetch_window))
+        
+        # One more attempt for the windows that failed
+        failed = [window for window in windows if not results.get(window)]
+        if failed:
+            results.update(self.fetch_many(failed, fetch_window))
+            failed = [window for window in windows if not results.get(window)]
+            if failed:
+                logging.warning(
+                    f"{len(failed)} of {len(windows)} windows failed for {security_id}: "
+                    f"{', '.join(f'{start}..{end}' for start, end in failed)}"
+                )
+        
+        payloads = [results[window] for window in windows if results.get(window)]
+        if not payloads:
+            return None
+        return merge_history_payloads(payloads)
+    
+    def backfill_history(self, stocks, from_date, to_date=None, job_name='history_backfill',
+                         window_days=HISTORY_WINDOW_DAYS, retry_passes=1):
+        """
+        Backfill many stocks over a long span (e.g. 5-10 years) as a checkpointed job
+        
+        The span is split into windows; every (stock, window) pair is a unit of a
+        resumable BackfillJob, fetched concurrently within the rate limit and
+        written through the ingest pipeline. Overlapping days are de-duplicated by
+        the change-aware upsert. Failed windows are retried up to retry_passes
+        more times in this run, and any still pending are resumed by the next run.
+        
+        Args:
+            stocks: Rows of (stock_id, security_id, exchange_segment, symbol, instrument),
+                    as returned by DatabaseHandler.get_all_stocks
+            from_date: First day of the span (YYYY-MM-DD)
+            to_date: Last day of the span (defaults to yesterday)
+            job_name: Checkpoint job name; rerun with the same name to resume
+            window_days: Days per request window
+            retry_passes: Extra passes over failed windows in this run
+        
+        Returns:
+            Final job progress dict (see BackfillJob.progress)
+        """
+        # Imported here: backfill imports the ingest pipeline, which imports this module
+        from backfill import BackfillJob
+        from update_planner import FetchTask
+        
+        to_date = to_date or (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        windows = self.split_date_range(from_date, to_date, window_days)
+        units = [FetchTask(*stock, start, end) for stock in stocks for start, end in windows]
+        logging.info(
+            f"Backfilling {len(stocks)} stocks from {from_date} to {to_date} "
+            f"in {len(windows)} windows of {window_days} days ({len(units)} requests)"
+        )
+        
+        # Keep main.py's retention from deleting the backfilled years again
+        span_days = (datetime.now() - datetime.strptime(from_date, "%Y-%m-%d")).days + 1
+        retention = self.db.get_setting(RETENTION_SETTING)
+        if retention is None or int(retention) < span_days:
+            self.db.set_setting(RETENTION_SETTING, span_days, "Days of history kept by main.py's cleanup")
+            logging.info(f"History retention extended to {span_days} days")
+        
+        def fetch_unit(unit):
+            # No demo fallback: a failed window stays pending for the next run
+            return self.fetch_historical_daily_data(
+                unit.security_id, unit.exchange_segment, unit.instrument, unit.from_date, unit.to_date,
+                demo_fallback=False
+            )
+        
+        job = BackfillJob(job_name, self.db.db_name)
+        pending = job.prepare(self.db, units)
+        touched_ids = set()
+        for attempt in range(retry_passes + 1):
+            if not pending:
+                break
+            if attempt:
+                logging.info(f"Retrying {len(pending)} failed windows (pass {attempt} of {retry_passes})")
+            failed = []
+            for unit, stats in job.run(pending, fetch_unit):
+                if stats is None:
+                    failed.append(unit)
+                elif stats['inserted'] or stats['updated']:
+                    touched_ids.add(unit.stock_id)
+            pending = failed
+        
+        # Backfilled candles land before the stored ones, which the incremental
+        # cache refresh, indicator and feature updates don't look at: reload those stocks
+        if touched_ids:
+            self.db.roll_history_partitions()
+            refresh_cache(self.db.db_name, reload_ids=touched_ids)
+            update_indicator_state(self.db.db_name, rebuild_ids=touched_ids)
+            update_feature_store(self.db.db_name, rebuild_ids=touched_ids)
+        return job.progress()
+    
+    def fetch_intraday_data(self, security_id, exchange_segment, instrument, interval, from_date, to_date,
+                            retries=3):
+        """
+        Fetch intraday bars for a stock from the intraday charts API
+        
+        Spans longer than INTRADAY_WINDOW_DAYS are fetched as concurrent windows
+        and merged.
+        
+        Args:
+            interval: Bar size in minutes (1, 5, 15, 25 or 60)
+            from_date: First day (YYYY-MM-DD)
+            to_date: Last day (YYYY-MM-DD)
+        
+        Returns:
+            Merged response (open/high/low/close/volume/timestamp arrays), or None
+            if any window failed
+        """
+        windows = self.split_date_range(from_date, to_date, INTRADAY_WINDOW_DAYS)
+        
+        def fetch_window(window):
+            payload = {
+                "securityId": str(security_id),
+                "exchangeSegment": exchange_segment,
+                "instrument": instrument,
+                "interval": str(interval),
+                "oi": instrument in ["FUTURES", "OPTION"],
+                "fromDate": f"{window[0]} 09:15:00",
+                "toDate": f"{window[1]} 15:30:00"
+            }
+            for attempt in range(retries):
+                try:
+                    response = self.transport.post("/charts/intraday", json=payload)
+                    if response.status_code == 200:
+                        return response.json()
+                    if response.status_code == 429:
+                        logging.warning(f"Rate limit hit for {security_id}; retrying through the rate limiter")
+                        continue
+                    logging.error(f"Error fetching intraday data for {security_id}: "
+                                  f"{response.status_code} - {response.text}")
+                except Exception as e:
+                    logging.error(f"Exception while fetching intraday data for {security_id}: {e}")
+                if attempt < retries - 1:
+                    time.sleep(2)
+            return None
+        
+        if len(windows) == 1:
+            results = {windows[0]: fetch_window(windows[0])}
+        else:
+            results = dict(self.fetch_many(windows, fetch_window))
+        if not all(results.get(window) for window in windows):
+            return None
+        
+        # Windows share their boundary day: keep one bar per timestamp
+        merged = {}
+        for window in windows:
+            data = results[window]
+            columns = [data.get(name) or [] for name in ('timestamp', 'open', 'high', 'low', 'close', 'volume')]
+            for timestamp, *bar in zip(*columns):
+                merged[int(timestamp)] = bar
+        timestamps = sorted(merged)
+        bars = [merged[timestamp] for timestamp in timestamps]
+        return {
+            'open': [bar[0] for bar in bars],
+            'high': [bar[1] for bar in bars],
+            'low': [bar[2] for bar in bars],
+            'close': [bar[3] for bar in bars],
+            'volume': [bar[4] for bar in bars],
+            'timestamp': timestamps
+        }
+    
     def _get_stock_params_from_db(self, security_id):
         """Get the correct parameters for a security ID from the database"""
         try:
-            # Make sure we have a DB connection
-            if not self.db.conn or not self.db.cursor:
-                self.db.connect()
-                
-            # Query the database for the security ID
-            self.db.cursor.execute(
-                "SELECT exchange_segment, instrument FROM stocks WHERE security_id = ?", 
-                (security_id,)
-            )
-            result = self.db.cursor.fetchone()
+            # Served from the in-memory instrument registry
+            instrument = get_registry(self.db.db_name).get_by_security_id(security_id)
             
-            if result:
+            if instrument:
                 return {
-                    "exchange_segment": result[0],
-                    "instrument": result[1]
+                    "exchange_segment": instrument.exchange_segment,
+                    "instrument": instrument.instrument
                 }
             return None
         except Exception as e:
@@ -256,68 +531,8 @@ class StockFetcher:
     def get_demo_data(self, security_id, from_date, to_date):
         """Generate demo data if API call fails - helpful for testing the UI"""
         try:
-            import pandas as pd
-            import numpy as np
-            from datetime import datetime, timedelta
-            
-            # Parse dates
-            start_date = datetime.strptime(from_date, "%Y-%m-%d")
-            end_date = datetime.strptime(to_date, "%Y-%m-%d")
-            
-            # Create date range for business days only
-            date_range = []
-            current_date = start_date
-            while current_date <= end_date:
-                if current_date.weekday() < 5:  # Monday to Friday
-                    date_range.append(current_date.strftime("%Y-%m-%d"))
-                current_date += timedelta(days=1)
-            
-            if not date_range:
-                return None
-                
-            # Generate random data with some trend to look realistic
-            n_days = len(date_range)
-            base_price = 100 + (hash(security_id) % 1000)  # Use hash of security_id for varied starting points
-            
-            # Generate trending prices
-            trend = np.cumsum(np.random.normal(0, 1, n_days)) * 0.5
-            
-            # Generate OHLC data
-            candles = []
-            prev_close = base_price
-            
-            for i, date in enumerate(date_range):
-                daily_volatility = max(0.005 * prev_close, 1.0)
-                open_price = prev_close * (1 + np.random.normal(0, 0.01))
-                
-                # Add trend component
-                price_with_trend = open_price * (1 + 0.01 * trend[i])
-                
-                high_price = price_with_trend * (1 + abs(np.random.normal(0, 0.01)))
-                low_price = price_with_trend * (1 - abs(np.random.normal(0, 0.01)))
-                close_price = (high_price + low_price) / 2 + np.random.normal(0, daily_volatility)
-                
-                # Ensure OHLC relationships are maintained
-                high_price = max(high_price, open_price, close_price)
-                low_price = min(low_price, open_price, close_price)
-                
-                # Generate volume (higher on bigger price moves)
-                volume = int(abs(close_price - open_price) * 10000 + np.random.normal(50000, 10000))
-                volume = max(volume, 1000)  # Ensure minimum volume
-                
-                # Round values to 2 decimal places
-                open_price = round(open_price, 2)
-                high_price = round(high_price, 2)
-                low_price = round(low_price, 2)
-                close_price = round(close_price, 2)
-                
-                candle = [date, open_price, high_price, low_price, close_price, volume]
-                candles.append(candle)
-                
-                prev_close = close_price
-                
-            return {"candles": candles, "status": "success"}
-            
+            # Seeded per security, so the same stock always gets the same candles
+            return synthetic_history(security_id, from_date, to_date)
         except Exception as e:
             logging.error(f"Error generating demo data: {e}")
             return None
@@ -15,6 +15,9 @@ from stock_fetcher import StockFetcher
 from generate_signals import SignalGenerator
 from screener_auto_order import fetch_screener_stocks
 from auto_order import AutoOrderPlacer
+from db_connection import connect_read_only
+from ohlcv_cache import get_cache
+from intraday_store import IntradayStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -31,7 +34,7 @@ class StockListApp:
         
         # Connect to the database
         try:
-            self.conn = sqlite3.connect("stock_data.db")
+            self.conn = connect_read_only("stock_data.db")
             logging.info("Connected to database successfully")
         except sqlite3.Error as e:
             logging.error(f"Error connecting to database: {e}")
@@ -244,6 +247,14 @@ class StockListApp:
         period_dropdown = ctk.CTkOptionMenu(self.chart_options_frame, values=period_options, variable=self.period_var)
         period_dropdown.pack(side="left", padx=5)
         
+        ctk.CTkLabel(self.chart_options_frame, text="Timeframe:").pack(side="left", padx=(10, 5))
+        
+        # Intraday timeframes are read from the intraday store (update_intraday.py)
+        self.timeframe_var = tk.StringVar(value="Daily")
+        timeframe_options = ["Daily", "1 min", "5 min", "15 min", "60 min"]
+        timeframe_dropdown = ctk.CTkOptionMenu(self.chart_options_frame, values=timeframe_options, variable=self.timeframe_var)
+        timeframe_dropdown.pack(side="left", padx=5)
+        
         # Store signals data
         self.signals_data = {}
         
@@ -438,17 +449,42 @@ class StockListApp:
                 f.write(f"Date range: from {from_date} to {to_date}\n")
             
             try:
-                # First try to fetch data from database using stock_id for direct relation
-                query = """
-                    SELECT timestamp, date, open, high, low, close, volume
-                    FROM history_data
-                    WHERE stock_id = ? 
-                    AND date BETWEEN ? AND ?
-                    ORDER BY timestamp
-                """
-                logging.info(f"Executing query with params: stock_id={stock_id}, from_date={from_date}, to_date={to_date}")
-                df = pd.read_sql_query(query, self.conn, params=(stock_id, from_date, to_date))
-                logging.info(f"Query returned {len(df)} records")
+                timeframe = self.timeframe_var.get()
+                interval = None if timeframe == "Daily" else int(timeframe.split()[0])
+                df = None
+                
+                if interval:
+                    # Intraday bars come from their own store; today's bars are included
+                    store = IntradayStore(daily_db_path="stock_data.db")
+                    if store.connect():
+                        try:
+                            df = store.get_bars(int(stock_id), interval, from_date, datetime.now().strftime("%Y-%m-%d"))
+                        finally:
+                            store.close()
+                    if df is None:
+                        self.status_var.set(f"No {timeframe} bars for {symbol}; run update_intraday.py --interval {interval}")
+                        return
+                    logging.info(f"Intraday store returned {len(df)} {timeframe} bars")
+                
+                # First try the memory-mapped OHLCV cache when it is up to date
+                cache = get_cache("stock_data.db")
+                if df is None and cache.is_fresh(self.conn):
+                    df = cache.get_frame(int(stock_id), from_date, to_date)
+                    if df is not None:
+                        logging.info(f"OHLCV cache returned {len(df)} records")
+                
+                # Otherwise fetch data from database using stock_id for direct relation
+                if df is None:
+                    query = """
+                        SELECT timestamp, date, open, high, low, close, volume
+                        FROM history_data
+                        WHERE stock_id = ? 
+                        AND date BETWEEN ? AND ?
+                        ORDER BY timestamp
+                    """
+                    logging.info(f"Executing query with params: stock_id={stock_id}, from_date={from_date}, to_date={to_date}")
+                    df = pd.read_sql_query(query, self.conn, params=(stock_id, from_date, to_date))
+                    logging.info(f"Query returned {len(df)} records")
                 
                 # Write to debug log (using UTF-8 encoding)
                 with open("chart_debug.log", "a", encoding="utf-8") as f:
@@ -498,6 +534,12 @@ class StockListApp:
                 else:
                     x_values = pd.to_datetime(df['timestamp'], unit='s')
                 
+                # Intraday bars only exist during market hours: hide the overnight
+                # and weekend gaps instead of drawing long empty stretches
+                rangebreaks = []
+                if interval:
+                    rangebreaks = [dict(bounds=["sat", "mon"]), dict(bounds=[15.5, 9.25], pattern="hour")]
+                
                 # Create candlestick chart
                 fig = go.Figure()
                 
@@ -527,10 +569,11 @@ class StockListApp:
                 
                 # Layout adjustments
                 fig.update_layout(
-                    title=f"{name} ({symbol}) - {period} Chart",
+                    title=f"{name} ({symbol}) - {period} Chart ({timeframe})",
                     xaxis_title="Date",
                     yaxis_title="Price",
                     xaxis_rangeslider_visible=False,
+                    xaxis_rangebreaks=rangebreaks,
                     yaxis2=dict(
                         title="Volume",
                         overlaying="y",
@@ -547,6 +590,8 @@ class StockListApp:
                     os.makedirs(chart_dir)
                 
                 filename = f"{chart_dir}/{symbol}_{from_date}_{to_date}.html"
+                if interval:
+                    filename = f"{chart_dir}/{symbol}_{from_date}_{to_date}_{interval}min.html"
                 
                 # Write to debug log (using UTF-8 encoding)
                 with open("chart_debug.log", "a", encoding="utf-8") as f:
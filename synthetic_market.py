@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Seeded synthetic market data.
+
+Generates daily OHLCV candles for any number of securities with a few array
+operations over a (days x securities) matrix:
+- log returns are a shared market factor times a per-security beta plus
+  idiosyncratic noise, so stocks move together the way real ones do
+- open gaps from the previous close; high and low always enclose open and close
+- volume rises with the size of the day's move
+- only business days (Monday to Friday) have candles
+
+Every security draws from its own np.random.Generator seeded from (seed,
+security ID), and paths start at SYNTHETIC_EPOCH, so a security's candles for a
+day are the same whichever range (or window of a range) is requested, and
+don't depend on the other securities in the batch or on the global RNG.
+
+StockFetcher.get_demo_data uses this for its offline fallback, and the CLI
+writes a production-sized database for benchmarks and the UI:
+
+    python synthetic_market.py --stocks 2000 --years 10 --db synthetic_stock_data.db
+"""
+
+import os
+import sys
+import time
+import zlib
+import logging
+import argparse
+import numpy as np
+from datetime import datetime, timedelta
+from db_handler import (
+    DatabaseHandler, HISTORY_V2_TABLE, HISTORY_V2_COLUMNS, HOT_MONTHS, history_v2_table_sql,
+    partition_freeze_sql, partition_name, rebuild_history_all_view, bump_data_version
+)
+from ohlcv_cache import refresh_cache
+
+# First day of every synthetic path; requests before it start their own path
+SYNTHETIC_EPOCH = '2010-01-01'
+
+# Stocks generated (and held in memory) at a time when writing a database
+WRITE_CHUNK_STOCKS = 200
+
+# Daily market factor: drift and volatility of log returns
+MARKET_DRIFT = 0.0003
+MARKET_VOLATILITY = 0.01
+
+def security_seed(security_id):
+    """Stable 32-bit seed for a security ID (hash() is randomized per process)"""
+    return zlib.crc32(str(security_id).encode())
+
+def business_days(from_date, to_date):
+    """Business days between two YYYY-MM-DD dates (inclusive) as datetime64[D]"""
+    start = np.datetime64(str(from_date)[:10], 'D')
+    end = np.datetime64(str(to_date)[:10], 'D')
+    if end < start:
+        return np.empty(0, dtype='datetime64[D]')
+    days = np.arange(start, end + 1)
+    return days[np.is_busday(days)]
+
+def generate_market(security_ids, from_date, to_date, seed=0):
+    """
+    Synthetic daily candles for many securities
+
+    Args:
+        security_ids: Security IDs to generate
+        from_date: First day (YYYY-MM-DD)
+        to_date: Last day (YYYY-MM-DD)
+        seed: Seed for the whole market; the same seed gives the same candles
+
+    Returns:
+        (days, columns): datetime64[D] array of the business days, and a dict of
+        (days x securities) arrays 'open', 'high', 'low', 'close' (rounded to
+        paise) and 'volume' (int64)
+    """
+    start = min(str(from_date)[:10], SYNTHETIC_EPOCH)
+    all_days = business_days(start, to_date)
+    keep = all_days >= np.datetime64(str(from_date)[:10], 'D')
+    n_days, n_securities = len(all_days), len(security_ids)
+    if n_days == 0 or n_securities == 0 or not keep.any():
+        empty = np.empty((0, n_securities))
+        return all_days[keep], {'open': empty, 'high': empty, 'low': empty, 'close': empty,
+                                'volume': empty.astype(np.int64)}
+
+    # Shared market factor
+    market = np.random.default_rng([seed, 0]).normal(MARKET_DRIFT, MARKET_VOLATILITY, n_days)
+
+    # Per-security parameters and standard normal draws (4 per day)
+    params = np.empty((5, n_securities))
+    shocks = np.empty((4, n_days, n_securities))
+    for j, security_id in enumerate(security_ids):
+        rng = np.random.default_rng([seed, 1, security_seed(security_id)])
+        params[:, j] = rng.uniform([0.5, 0.008, 50.0, 50000.0, -0.0002], [1.5, 0.025, 3000.0, 2000000.0, 0.0004])
+        # Day-major draws: a longer range extends the sequence instead of reshuffling it
+        shocks[:, :, j] = rng.standard_normal((n_days, 4)).T
+    beta, volatility, base_price, base_volume, drift = params
+
+    # Close: geometric walk of beta * market + idiosyncratic returns
+    returns = market[:, None] * beta + drift + shocks[0] * volatility
+    close = base_price * np.exp(np.cumsum(returns, axis=0))
+
+    # Open gaps from the previous close; the day's return is split into gap and session
+    previous_close = np.vstack([base_price[None, :], close[:-1]])
+    open_ = previous_close * np.exp(shocks[1] * volatility * 0.3)
+
+    # High and low extend beyond the open/close range by a fraction of the volatility
+    high = np.maximum(open_, close) * np.exp(np.abs(shocks[2]) * volatility * 0.5)
+    low = np.minimum(open_, close) * np.exp(-np.abs(shocks[3]) * volatility * 0.5)
+
+    # Volume grows with the size of the move
+    move = np.abs(np.log(close / previous_close)) / volatility
+    volume = base_volume * (0.6 + 0.4 * move) * np.exp(shocks[2] * 0.2)
+
+    open_, high, low, close = (np.round(prices[keep], 2) for prices in (open_, high, low, close))
+    return all_days[keep], {
+        'open': open_,
+        # Rounding can't break the candle: re-enclose open and close
+        'high': np.maximum(high, np.maximum(open_, close)),
+        'low': np.minimum(low, np.minimum(open_, close)),
+        'close': close,
+        'volume': np.maximum(volume[keep], 1000).astype(np.int64),
+    }
+
+def synthetic_history(security_id, from_date, to_date, seed=0):
+    """
+    Synthetic candles for one security in the historical API's 'candles' format
+
+    Returns:
+        {"candles": [[date, open, high, low, close, volume], ...], "status": "success"},
+        or None if the range has no business days
+    """
+    days, columns = generate_market([security_id], from_date, to_date, seed)
+    if len(days) == 0:
+        return None
+    dates = np.datetime_as_string(days, unit='D').tolist()
+    values = [columns[name][:, 0].tolist() for name in ('open', 'high', 'low', 'close', 'volume')]
+    return {"candles": [[date] + list(candle) for date, *candle in zip(dates, *values)], "status": "success"}
+
+def write_synthetic_database(db_path, stocks=2000, years=10, seed=0, end_date=None):
+    """
+    Create a database with synthetic stocks and their daily history
+
+    Candles of closed months go straight into their read-only monthly partitions
+    and recent months into the hot table, as roll_history_partitions() would
+    leave them.
+
+    Returns:
+        Number of candles written, or None on error
+    """
+    db = DatabaseHandler(db_path)
+    if not db.connect():
+        return None
+    try:
+        end = end_date or (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        start = (datetime.strptime(end, "%Y-%m-%d") - timedelta(days=365 * years)).strftime("%Y-%m-%d")
+        security_ids = [str(100000 + i) for i in range(stocks)]
+
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        db.cursor.executemany('''
+            INSERT INTO stocks (security_id, exchange_segment, symbol, name, instrument, added_date, last_updated)
+            VALUES (?, 'NSE_EQ', ?, ?, 'EQUITY', ?, ?)
+        ''', [(security_id, f"SYN{i:04d}", f"Synthetic Stock {i}", now, now)
+              for i, security_id in enumerate(security_ids)])
+        db.cursor.execute("SELECT id FROM stocks ORDER BY id")
+        stock_ids = np.array([row[0] for row in db.cursor.fetchall()], dtype=np.int64)
+        bump_data_version(db.conn, 'stocks')
+
+        hot_month = int(np.datetime64(end, 'M').astype(np.int64)) - HOT_MONTHS + 1
+        placeholders = ", ".join("?" * len(HISTORY_V2_COLUMNS))
+        tables = set()
+        written = 0
+        for first in range(0, len(security_ids), WRITE_CHUNK_STOCKS):
+            chunk_ids = stock_ids[first:first + WRITE_CHUNK_STOCKS]
+            days, columns = generate_market(security_ids[first:first + WRITE_CHUNK_STOCKS], start, end, seed)
+            day_numbers = days.astype(np.int64)
+            months = days.astype('datetime64[M]').astype(np.int64)
+            paise = {name: np.round(columns[name] * 100).astype(np.int64) for name in ('open', 'high', 'low', 'close')}
+
+            for month in np.unique(months):
+                rows_of_month = np.flatnonzero(months == month)
+                table = HISTORY_V2_TABLE if month >= hot_month else partition_name(month)
+                if table not in tables:
+                    db.cursor.execute(history_v2_table_sql(table))
+                    tables.add(table)
+
+                # Stock-major order, which is the primary key order
+                n = len(rows_of_month) * len(chunk_ids)
+                block = [
+                    np.repeat(chunk_ids, len(rows_of_month)),
+                    np.tile(day_numbers[rows_of_month], len(chunk_ids)),
+                ]
+                block += [paise[name][rows_of_month].T.ravel() for name in ('open', 'high', 'low', 'close')]
+                block += [columns['volume'][rows_of_month].T.ravel(), np.zeros(n, dtype=np.int64)]
+                db.cursor.executemany(
+                    f"INSERT INTO {table} ({', '.join(HISTORY_V2_COLUMNS)}) VALUES ({placeholders})",
+                    zip(*(column.tolist() for column in block))
+                )
+                written += n
+
+        for table in tables - {HISTORY_V2_TABLE}:
+            for sql in partition_freeze_sql(table):
+                db.cursor.execute(sql)
+        rebuild_history_all_view(db.conn)
+        bump_data_version(db.conn, 'history')
+        db.conn.commit()
+        return written
+    except Exception as e:
+        logging.error(f"Error writing synthetic database: {e}")
+        db.conn.rollback()
+        return None
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a database of synthetic stocks and daily candles')
+    parser.add_argument('--db', default='synthetic_stock_data.db', help='Database to create')
+    parser.add_argument('--stocks', type=int, default=2000, help='Number of stocks')
+    parser.add_argument('--years', type=int, default=10, help='Years of daily history')
+    parser.add_argument('--seed', type=int, default=0, help='Market seed')
+    parser.add_argument('--end-date', help='Last day of history (default yesterday)')
+    parser.add_argument('--force', action='store_true', help='Replace the database if it exists')
+    parser.add_argument('--no-cache', action='store_true', help="Don't build the OHLCV cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if os.path.exists(args.db):
+        if not args.force:
+            logging.error(f"{args.db} already exists; use --force to replace it")
+            return 1
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    start = time.monotonic()
+    written = write_synthetic_database(args.db, args.stocks, args.years, args.seed, args.end_date)
+    if written is None:
+        return 1
+    logging.info(f"Wrote {args.stocks} stocks and {written} candles to {args.db} in {time.monotonic() - start:.1f}s")
+
+    if not args.no_cache:
+        refresh_cache(args.db)
+        logging.info(f"Built the OHLCV cache in {time.monotonic() - start:.1f}s total")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
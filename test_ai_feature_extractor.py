@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Tests for the vectorized AI feature pipeline (python -m pytest test_ai_feature_extractor.py)"""
+
+import sqlite3
+import numpy as np
+import pandas as pd
+from ai_feature_extractor import AIFeatureExtractor, FEATURE_COLUMNS, panel_features
+from panel_loader import load_panel
+from signal_engine import rsi
+from synthetic_market import write_synthetic_database
+
+def _reference_features(df):
+    """The per-Series pandas extractor that feature_matrix() replaced, kept as the reference"""
+    close = df['close']
+    features = pd.DataFrame(index=df.index)
+    features['price_ma_ratio'] = close / df['SMA_50']
+    features['price_volatility'] = close.rolling(20).std() / close.rolling(20).mean()
+    if 'volume' in df.columns:
+        features['volume_ma_ratio'] = df['volume'] / df['volume'].rolling(20).mean()
+        # pandas gives +/-inf where a window is flat; the pipeline leaves those undefined (0)
+        features['volume_price_corr'] = df['volume'].rolling(10).corr(close).replace([np.inf, -np.inf], np.nan)
+    features['rsi'] = df['RSI']
+    features['rsi_slope'] = df['RSI'].diff(5)
+
+    std = close.rolling(20).std()
+    middle = close.rolling(20).mean()
+    upper, lower = middle + 2 * std, middle - 2 * std
+    features['bollinger_width'] = (upper - lower) / middle
+    features['bollinger_pos'] = ((close - lower) / (upper - lower)).clip(0, 1)
+
+    macd_line = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    signal_line = macd_line.ewm(span=9, adjust=False).mean()
+    features['macd_line'] = macd_line
+    features['macd_signal'] = signal_line
+    features['macd_histogram'] = macd_line - signal_line
+
+    window = 10
+    price_max, price_min = close.rolling(window).max(), close.rolling(window).min()
+    macd_max, macd_min = macd_line.rolling(window).max(), macd_line.rolling(window).min()
+    divergence = pd.Series(0, index=df.index)
+    for i in range(window * 2, len(df)):
+        if price_max.iloc[i] > price_max.iloc[i - window] and macd_max.iloc[i] < macd_max.iloc[i - window]:
+            divergence.iloc[i] = -1
+        elif price_min.iloc[i] < price_min.iloc[i - window] and macd_min.iloc[i] > macd_min.iloc[i - window]:
+            divergence.iloc[i] = 1
+    features['macd_divergence'] = divergence
+
+    features['momentum_1d'] = close.pct_change(1)
+    features['momentum_5d'] = close.pct_change(5)
+    features['momentum_10d'] = close.pct_change(10)
+    return features.fillna(0)
+
+def _frame(close, volume=None):
+    df = pd.DataFrame({'close': np.asarray(close, dtype=np.float64)})
+    if volume is not None:
+        df['volume'] = np.asarray(volume, dtype=np.float64)
+    df['SMA_50'] = df['close'].rolling(50).mean()
+    df['RSI'] = rsi(df['close'].to_numpy(), 14)
+    return df
+
+def _assert_matches_reference(df):
+    features = AIFeatureExtractor().extract_features(df)
+    expected = _reference_features(df)
+    assert list(features.columns) == [name for name in FEATURE_COLUMNS if name in expected.columns]
+    assert (features.dtypes == np.float32).all()
+    for name in features.columns:
+        # float32 storage: compare to float32 precision
+        assert np.allclose(features[name], expected[name], rtol=2e-6, atol=1e-5), name
+
+def test_features_match_reference_on_a_random_walk():
+    rng = np.random.default_rng(0)
+    close = 100 + rng.normal(0, 2, 300).cumsum()
+    _assert_matches_reference(_frame(close, rng.integers(1000, 50000, 300)))
+
+def test_features_match_reference_without_volume():
+    rng = np.random.default_rng(1)
+    _assert_matches_reference(_frame(250 + rng.normal(0, 4, 120).cumsum()))
+
+def test_flat_windows_match_reference():
+    rng = np.random.default_rng(2)
+    # A suspended stock: the price and volume stand still for 40 days after a volatile stretch
+    close = np.concatenate([
+        100 + rng.normal(0, 3, 80).cumsum(), np.full(40, 123.37), 123.37 + rng.normal(0, 1, 30).cumsum()
+    ])
+    volume = np.concatenate([rng.integers(1000, 2000, 100), np.full(50, 1500)])
+    df = _frame(close, volume)
+    _assert_matches_reference(df)
+
+    features = AIFeatureExtractor().extract_features(df)
+    flat = slice(100, 120)  # every 20-day window inside the flat stretch
+    assert (features['bollinger_pos'].iloc[flat] == 0).all()
+    assert (features['bollinger_width'].iloc[flat] == 0).all()
+
+def test_short_history_has_no_features():
+    assert AIFeatureExtractor().extract_features(_frame(np.arange(49) + 100.0)) is None
+
+def test_panel_features_match_per_stock_features(tmp_path):
+    db_path = str(tmp_path / 'stock_data.db')
+    assert write_synthetic_database(db_path, stocks=4, years=1, end_date='2026-09-30')
+    conn = sqlite3.connect(db_path)
+    try:
+        panel = load_panel(conn, days=200, end_date='2026-09-30', db_path=db_path)
+    finally:
+        conn.close()
+
+    mask, features = panel_features(panel)
+    extractor = AIFeatureExtractor()
+    for j, stock_id in enumerate(panel.stock_ids.tolist()):
+        df = panel.frame(stock_id)
+        expected = extractor.extract_features(_frame(df['close'], df['volume']))
+        assert np.allclose(features[mask[:, j], j], expected.to_numpy(), rtol=1e-6, atol=1e-6)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Tests for the resumable backfill jobs (python -m pytest test_backfill.py)"""
+
+from backfill import BackfillJob
+from conftest import END_DATE
+from db_handler import DatabaseHandler
+from update_planner import FetchTask
+
+STOCKS = 10
+
+def _units(db, from_date, to_date):
+    return [FetchTask(*stock, from_date, to_date) for stock in db.get_all_stocks()]
+
+def _finish(db, job, stock_ids):
+    db.cursor.executemany(
+        "UPDATE backfill_checkpoints SET status = 'done', rows = 1 WHERE job = ? AND stock_id = ?",
+        [(job.name, stock_id) for stock_id in stock_ids]
+    )
+    db.conn.commit()
+
+def test_resume_next_day_fetches_only_missing_days(make_db):
+    db_path = make_db(stocks=STOCKS)
+    db = DatabaseHandler(db_path)
+    assert db.connect()
+    try:
+        # The nightly run crashes after 7 of 10 stocks
+        job = BackfillJob('nightly', db_path)
+        assert len(job.prepare(db, _units(db, '2025-09-30', END_DATE))) == STOCKS
+        _finish(db, job, range(1, 8))
+
+        # The next night's one-year units all start a day later
+        job = BackfillJob('nightly', db_path)
+        pending = job.prepare(db, _units(db, '2025-10-01', '2026-10-01'))
+    finally:
+        db.close()
+
+    full = [unit for unit in pending if unit.from_date == '2025-10-01']
+    assert sorted(unit.stock_id for unit in full) == [8, 9, 10]
+    assert all(unit.to_date == '2026-10-01' for unit in full)
+    # The finished stocks only fetch the day after their last stored candle
+    tails = [unit for unit in pending if unit.from_date != '2025-10-01']
+    assert sorted(unit.stock_id for unit in tails) == list(range(1, 8))
+    assert {(unit.from_date, unit.to_date) for unit in tails} == {('2026-10-01', '2026-10-01')}
+    # The stale pending units were replaced, not kept alongside
+    assert job.total == 7 + 3 + 7
+
+def test_resume_with_the_same_units_keeps_the_pending_ones(make_db):
+    db_path = make_db(stocks=STOCKS)
+    db = DatabaseHandler(db_path)
+    assert db.connect()
+    try:
+        job = BackfillJob('nightly', db_path)
+        units = _units(db, '2025-09-30', END_DATE)
+        job.prepare(db, units)
+        _finish(db, job, range(1, 5))
+
+        job = BackfillJob('nightly', db_path)
+        pending = job.prepare(db, units)
+    finally:
+        db.close()
+    assert [unit.stock_id for unit in pending] == list(range(5, STOCKS + 1))
+    assert job.total == STOCKS and job.done == 4
+
+def test_finished_job_starts_afresh(make_db):
+    db_path = make_db(stocks=STOCKS)
+    db = DatabaseHandler(db_path)
+    assert db.connect()
+    try:
+        job = BackfillJob('nightly', db_path)
+        job.prepare(db, _units(db, '2025-09-30', END_DATE))
+        _finish(db, job, range(1, STOCKS + 1))
+
+        job = BackfillJob('nightly', db_path)
+        pending = job.prepare(db, _units(db, '2025-10-01', '2026-10-01'))
+    finally:
+        db.close()
+    assert len(pending) == STOCKS and job.done == 0
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Tests for the retry policy of the Dhan transport (python -m pytest test_dhan_transport.py)"""
+
+import time
+import types
+import pytest
+import requests
+import dhan_transport
+import rate_limiter
+from dhan_transport import DhanTransport
+from mock_dhan_server import MockDhanServer
+
+ORDER = {'dhanClientId': '1', 'transactionType': 'BUY', 'securityId': '1333', 'quantity': 1}
+HISTORY = {'securityId': '1333', 'exchangeSegment': 'NSE_EQ', 'instrument': 'EQUITY',
+           'fromDate': '2026-09-01', 'toDate': '2026-09-30'}
+
+def _server(monkeypatch, **options):
+    # No backoff sleeps between resends; the rate limiters still pace them
+    monkeypatch.setattr(dhan_transport, 'time', types.SimpleNamespace(sleep=lambda seconds: None,
+                                                                      monotonic=time.monotonic))
+    # Fresh limiters, so a test's 429s don't slow down the others
+    monkeypatch.setattr(rate_limiter, '_limiters', {})
+    limits = {'data': None, 'order': None, 'non_trading': None}
+    return MockDhanServer(rate_limits=limits, **options).start()
+
+def _sent(server, method, route):
+    return sum(server.summary().get((method, route), {}).values())
+
+def test_order_post_is_never_resent(monkeypatch):
+    server = _server(monkeypatch, error_rate_5xx=1.0)
+    transport = DhanTransport('token', server.url)
+    try:
+        response = transport.post('/super/orders', family='order', json=ORDER)
+        assert response.status_code in (500, 502, 503)
+        assert _sent(server, 'POST', 'place_order') == 1
+    finally:
+        transport.close()
+        server.stop()
+
+def test_order_post_read_timeout_is_not_resent(monkeypatch):
+    server = _server(monkeypatch, latency=0.3)
+    transport = DhanTransport('token', server.url)
+    try:
+        with pytest.raises(requests.RequestException):
+            transport.post('/super/orders', family='order', json=ORDER, timeout=(5, 0.1))
+        # The order reached the server, so it must not be placed a second time
+        time.sleep(0.5)
+        assert _sent(server, 'POST', 'place_order') == 1
+        assert len(server.orders) == 1
+    finally:
+        transport.close()
+        server.stop()
+
+def test_order_family_reads_are_resent(monkeypatch):
+    server = _server(monkeypatch, error_rate_5xx=1.0)
+    transport = DhanTransport('token', server.url)
+    try:
+        transport.get('/super/orders', family='order')
+        assert _sent(server, 'GET', 'list_orders') == 1 + dhan_transport.ORDER_RESEND[0]
+    finally:
+        transport.close()
+        server.stop()
+
+def test_data_requests_are_resent_through_the_limiter(monkeypatch):
+    server = _server(monkeypatch, error_rate_5xx=1.0)
+    transport = DhanTransport('token', server.url)
+    limiter = dhan_transport.get_rate_limiter('data')
+    before = limiter.stats()['requests']
+    try:
+        response = transport.post('/charts/historical', json=HISTORY)
+        assert response.status_code in (500, 502, 503)
+        attempts = 1 + dhan_transport.DATA_RESEND[0]
+        assert _sent(server, 'POST', 'historical') == attempts
+        # Every attempt that reached the server was reported to the limiter
+        assert limiter.stats()['requests'] - before == attempts
+    finally:
+        transport.close()
+        server.stop()
+
+def test_429_is_returned_to_the_caller(monkeypatch):
+    server = _server(monkeypatch, error_rate_429=1.0)
+    transport = DhanTransport('token', server.url)
+    try:
+        assert transport.post('/charts/historical', json=HISTORY).status_code == 429
+        assert _sent(server, 'POST', 'historical') == 1
+    finally:
+        transport.close()
+        server.stop()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Tests for the AI feature store (python -m pytest test_feature_store.py)"""
+
+import sqlite3
+import numpy as np
+import pandas as pd
+from conftest import END_DATE, append_days
+from db_handler import DatabaseHandler
+from feature_store import features_db_path, frame_features, read_features, rebuild_feature_store, update_feature_store
+
+STOCKS = 3
+
+def _features(db_path):
+    conn = sqlite3.connect(features_db_path(db_path))
+    try:
+        return read_features(conn)
+    finally:
+        conn.close()
+
+def _candles(db_path, stock_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return pd.read_sql_query(
+            "SELECT s.symbol, s.security_id, h.date, h.close FROM history_data h JOIN stocks s ON s.id = h.stock_id "
+            "WHERE h.stock_id = ? AND h.date >= '2026-09-01' ORDER BY h.date", conn, params=(stock_id,))
+    finally:
+        conn.close()
+
+def test_appended_features_match_rebuild(make_db):
+    db_path = make_db(stocks=STOCKS, years=2)
+    assert update_feature_store(db_path)['rebuilt'] > 0
+
+    append_days(db_path, '2026-10-01', '2026-10-09')
+
+    totals = update_feature_store(db_path)
+    assert totals == {'appended': STOCKS, 'rows': 7 * STOCKS, 'rebuilt': 0}
+    ids, days, appended = _features(db_path)
+
+    assert rebuild_feature_store(db_path) == len(days)
+    rebuilt_ids, rebuilt_days, rebuilt = _features(db_path)
+    assert (ids == rebuilt_ids).all() and (days == rebuilt_days).all()
+    assert np.allclose(appended, rebuilt, rtol=1e-5, atol=1e-6)
+
+def test_corrected_watermark_candle_is_rebuilt(make_db):
+    db_path = make_db(stocks=STOCKS, years=2)
+    update_feature_store(db_path)
+
+    db = DatabaseHandler(db_path)
+    assert db.connect()
+    try:
+        assert db.insert_history_data(2, {'candles': [[END_DATE, 100.0, 110.0, 95.0, 105.5, 5000]]})['updated'] == 1
+    finally:
+        db.close()
+
+    totals = update_feature_store(db_path)
+    assert totals['appended'] == 0 and totals['rebuilt'] > 0
+    conn = sqlite3.connect(features_db_path(db_path))
+    try:
+        assert conn.execute("SELECT last_close FROM feature_store_stocks WHERE stock_id = 2").fetchone()[0] == 10550
+    finally:
+        conn.close()
+
+def test_store_is_kept_out_of_the_daily_database(make_db):
+    db_path = make_db(stocks=STOCKS, years=2)
+    assert frame_features(_candles(db_path, 1), db_path=db_path) is None
+    update_feature_store(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+    assert not tables & {'feature_store', 'feature_store_stocks'}
+
+    df = _candles(db_path, 1)
+    features = frame_features(df, db_path=db_path)
+    assert features is not None and len(features) == len(df)
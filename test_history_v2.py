@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""Tests for the v2 history layout: migration, monthly partitions and retention (python -m pytest test_history_v2.py)"""
+
+import sqlite3
+from datetime import datetime
+import numpy as np
+from db_connection import connect_read_write
+from db_handler import (
+    DatabaseHandler, HISTORY_LAYOUT_V1, HISTORY_LAYOUT_V2, HISTORY_V2_TABLE, HOT_MONTHS,
+    get_history_layout, list_history_partitions, month_bounds, month_of_day, partition_name
+)
+import migrate_history_v2
+
+LEGACY_HISTORY_SQL = '''
+    CREATE TABLE history_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stock_id INTEGER,
+        timestamp INTEGER,
+        date TEXT,
+        open REAL,
+        high REAL,
+        low REAL,
+        close REAL,
+        volume INTEGER,
+        open_interest INTEGER,
+        security_id TEXT,
+        UNIQUE (stock_id, timestamp)
+    )
+'''
+
+HISTORY_QUERY = '''
+    SELECT stock_id, date, open, high, low, close, volume, open_interest
+    FROM history_data ORDER BY stock_id, date
+'''
+
+def _day_date(day):
+    return str(np.datetime64(int(day), 'D'))
+
+def _candle(date, close, volume=1000):
+    return [date, close - 1.0, close + 2.0, close - 2.5, close, volume]
+
+def _connect(db_path):
+    db = DatabaseHandler(db_path)
+    assert db.connect()
+    return db
+
+def _add_stocks(db, count):
+    for i in range(count):
+        db.cursor.execute(
+            "INSERT INTO stocks (security_id, exchange_segment, symbol, instrument) VALUES (?, 'NSE_EQ', ?, 'EQUITY')",
+            (str(500 + i), f"STK{i}")
+        )
+    db.conn.commit()
+
+def _make_legacy_db(tmp_path):
+    """A database still on the v1 history table, with a few candles per stock"""
+    db_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute(LEGACY_HISTORY_SQL)
+    conn.commit()
+    conn.close()
+
+    db = _connect(db_path)
+    try:
+        assert db.history_layout == HISTORY_LAYOUT_V1
+        _add_stocks(db, 3)
+        for stock_id in (1, 2, 3):
+            candles = [_candle(f"2024-03-{day:02d}", 100.0 * stock_id + day + 0.37) for day in range(4, 9)]
+            assert db.insert_history_data(stock_id, {'candles': candles})['inserted'] == 5
+    finally:
+        db.close()
+    return db_path
+
+def _migrate(db_path, during_copy=None):
+    conn = connect_read_write(db_path)
+    conn.isolation_level = None
+    try:
+        migrate_history_v2.install_sync(conn)
+        if during_copy:
+            during_copy(conn)
+        migrate_history_v2.copy_rows(conn, batch_stocks=2)
+        migrate_history_v2.switch_over(conn)
+    finally:
+        conn.close()
+
+def _history(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(HISTORY_QUERY).fetchall()
+    finally:
+        conn.close()
+
+def test_migration_preserves_legacy_rows(tmp_path):
+    db_path = _make_legacy_db(tmp_path)
+    before = _history(db_path)
+    assert len(before) == 15
+
+    _migrate(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert get_history_layout(conn) == HISTORY_LAYOUT_V2
+        assert conn.execute(f"SELECT COUNT(*) FROM {HISTORY_V2_TABLE}").fetchone()[0] == 15
+        assert conn.execute(f"SELECT COUNT(*) FROM {migrate_history_v2.OLD_TABLE}").fetchone()[0] == 15
+    finally:
+        conn.close()
+    assert _history(db_path) == before
+
+def test_migration_keeps_writes_made_during_copy(tmp_path):
+    db_path = _make_legacy_db(tmp_path)
+
+    def write(conn):
+        # An ingest run updating one candle and adding another while the copy runs
+        conn.execute("UPDATE history_data SET close = 999.5 WHERE stock_id = 2 AND date = '2024-03-05'")
+        conn.execute('''
+            INSERT INTO history_data (stock_id, timestamp, date, open, high, low, close, volume, open_interest)
+            VALUES (3, ?, '2024-03-11', 1.0, 2.0, 0.5, 1.5, 10, 0)
+        ''', (int(datetime(2024, 3, 11).timestamp()),))
+
+    _migrate(db_path, during_copy=write)
+
+    rows = {(row[0], row[1]): row for row in _history(db_path)}
+    assert len(rows) == 16
+    assert rows[(2, '2024-03-05')][5] == 999.5
+    assert rows[(3, '2024-03-11')][2:6] == (1.0, 2.0, 0.5, 1.5)
+
+def test_handler_connected_before_switch_writes_v2(tmp_path):
+    db_path = _make_legacy_db(tmp_path)
+    db = _connect(db_path)
+    try:
+        # A batch parsed for the v1 table just before the switch
+        stale = db.prepare_history_rows(1, {'candles': [_candle("2024-03-12", 150.25)]})
+        _migrate(db_path)
+
+        assert db.insert_history_rows_bulk([(1, stale)]) == {}
+        stats = db.insert_history_data(1, {'candles': [_candle("2024-03-12", 150.25), _candle("2024-03-05", 105.37)]})
+        assert stats == {'inserted': 1, 'updated': 0, 'unchanged': 1, 'frozen': 0}
+        assert db.history_layout == HISTORY_LAYOUT_V2
+    finally:
+        db.close()
+
+    rows = {(row[0], row[1]): row for row in _history(db_path)}
+    assert len(rows) == 16
+    assert rows[(1, '2024-03-12')][5] == 150.25
+
+def _make_rolled_db(tmp_path, months=6):
+    """A v2 database with one candle per stock on the 1st of each of the last `months` months, rolled"""
+    db_path = str(tmp_path / 'stock_data.db')
+    db = _connect(db_path)
+    current = month_of_day((np.datetime64(datetime.now().strftime("%Y-%m-%d"), 'D')).astype(np.int64))
+    month_list = list(range(current - months + 1, current + 1))
+    dates = [_day_date(month_bounds(month)[0]) for month in month_list]
+    try:
+        assert db.history_layout == HISTORY_LAYOUT_V2
+        _add_stocks(db, 2)
+        for stock_id in (1, 2):
+            candles = [_candle(date, 50.0 * stock_id + k) for k, date in enumerate(dates)]
+            assert db.insert_history_data(stock_id, {'candles': candles})['inserted'] == months
+        moved = db.roll_history_partitions()
+    finally:
+        db.close()
+    assert moved == 2 * (months - HOT_MONTHS)
+    return db_path, month_list, dates
+
+def test_roll_moves_closed_months_into_partitions(tmp_path):
+    db_path, month_list, dates = _make_rolled_db(tmp_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        names = [name for name, _, _ in list_history_partitions(conn)]
+        assert names == [partition_name(month) for month in month_list[:-HOT_MONTHS]]
+        hot_days = [row[0] for row in conn.execute(f"SELECT DISTINCT day FROM {HISTORY_V2_TABLE} ORDER BY day")]
+        assert hot_days == [month_bounds(month)[0] for month in month_list[-HOT_MONTHS:]]
+        # The compatibility view still sees every candle
+        assert conn.execute("SELECT COUNT(*) FROM history_data").fetchone()[0] == 2 * len(dates)
+    finally:
+        conn.close()
+
+def test_upsert_into_frozen_partition_reports_frozen(tmp_path):
+    db_path, _, dates = _make_rolled_db(tmp_path)
+    frozen_date, hot_date = dates[0], dates[-1]
+    before = _history(db_path)
+
+    db = _connect(db_path)
+    try:
+        stats = db.insert_history_data(1, {'candles': [_candle(frozen_date, 77.0), _candle(dates[1], 51.0)]})
+        assert stats == {'inserted': 0, 'updated': 0, 'unchanged': 1, 'frozen': 1}
+        stats = db.insert_history_data(1, {'candles': [_candle(hot_date, 12.0)]})
+        assert stats['updated'] == 1
+    finally:
+        db.close()
+
+    after = {(row[0], row[1]): row for row in _history(db_path)}
+    assert after[(1, frozen_date)] == {(row[0], row[1]): row for row in before}[(1, frozen_date)]
+    assert after[(1, hot_date)][5] == 12.0
+
+def test_partitions_reject_direct_writes(tmp_path):
+    db_path, month_list, _ = _make_rolled_db(tmp_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        name = partition_name(month_list[0])
+        try:
+            conn.execute(f"DELETE FROM {name}")
+            assert False, "frozen partition accepted a delete"
+        except sqlite3.DatabaseError as e:
+            assert 'read-only' in str(e)
+    finally:
+        conn.close()
+
+def test_retention_drops_whole_months_before_cutoff(tmp_path):
+    db_path, month_list, dates = _make_rolled_db(tmp_path)
+
+    # The cutoff falls inside the third month: the first two partitions go, the third stays whole
+    first, last = month_bounds(month_list[2])
+    db = _connect(db_path)
+    try:
+        deleted = db.clean_history_data(before_date=_day_date(first + 5))
+    finally:
+        db.close()
+    assert deleted == 4
+
+    conn = sqlite3.connect(db_path)
+    try:
+        names = [name for name, _, _ in list_history_partitions(conn)]
+        assert names == [partition_name(month) for month in month_list[2:-HOT_MONTHS]]
+        remaining = sorted({row[0] for row in conn.execute("SELECT date FROM history_data")})
+    finally:
+        conn.close()
+    assert remaining == dates[2:]
+
+def test_retention_for_one_stock_keeps_partitions(tmp_path):
+    db_path, month_list, dates = _make_rolled_db(tmp_path)
+
+    db = _connect(db_path)
+    try:
+        deleted = db.clean_history_data(stock_id=2, before_date=dates[3])
+    finally:
+        db.close()
+    assert deleted == 3
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert len(list_history_partitions(conn)) == len(month_list) - HOT_MONTHS
+        stock_dates = [row[0] for row in conn.execute("SELECT date FROM history_data WHERE stock_id = 2 ORDER BY date")]
+        assert stock_dates == dates[3:]
+        assert conn.execute("SELECT COUNT(*) FROM history_data WHERE stock_id = 1").fetchone()[0] == len(dates)
+        # The partitions are read-only again afterwards
+        try:
+            conn.execute(f"DELETE FROM {partition_name(month_list[3])}")
+            assert False, "partition stayed writable after retention"
+        except sqlite3.DatabaseError as e:
+            assert 'read-only' in str(e)
+    finally:
+        conn.close()
+
+def test_view_rejects_writes_to_frozen_candles(tmp_path):
+    db_path, _, dates = _make_rolled_db(tmp_path)
+    frozen_date, hot_date = dates[0], dates[-1]
+    before = _history(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        for sql, params in (
+            ("DELETE FROM history_data WHERE stock_id = 1 AND date = ?", (frozen_date,)),
+            ("UPDATE history_data SET close = 1.0 WHERE stock_id = 1 AND date = ?", (frozen_date,)),
+            ("INSERT INTO history_data (stock_id, date, open, high, low, close, volume, open_interest) "
+             "VALUES (1, ?, 1.0, 2.0, 0.5, 1.5, 10, 0)", (frozen_date,)),
+        ):
+            try:
+                conn.execute(sql, params)
+                assert False, f"view accepted a write to a frozen candle: {sql}"
+            except sqlite3.DatabaseError as e:
+                assert 'read-only' in str(e)
+        conn.rollback()
+
+        # Candles in the hot table can still be changed through the view
+        conn.execute("UPDATE history_data SET close = 1.5 WHERE stock_id = 2 AND date = ?", (hot_date,))
+        conn.commit()
+        try:
+            conn.execute("INSERT INTO history_data (stock_id, date, close) VALUES (2, ?, 2.5)", (hot_date,))
+            assert False, "view inserted a second candle for the same day"
+        except sqlite3.IntegrityError:
+            pass
+    finally:
+        conn.close()
+
+    after = {(row[0], row[1]): row for row in _history(db_path)}
+    assert len(after) == len(before)
+    assert after[(1, frozen_date)] == {(row[0], row[1]): row for row in before}[(1, frozen_date)]
+    assert after[(2, hot_date)][5] == 1.5
+
+def test_old_view_triggers_are_upgraded(tmp_path):
+    db_path, _, dates = _make_rolled_db(tmp_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("DROP TRIGGER history_data_delete")
+        conn.execute('''
+            CREATE TRIGGER history_data_delete INSTEAD OF DELETE ON history_data
+            BEGIN
+                DELETE FROM history_v2 WHERE stock_id = OLD.stock_id AND day = OLD.day;
+            END
+        ''')
+        conn.commit()
+    finally:
+        conn.close()
+
+    _connect(db_path).close()
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("DELETE FROM history_data WHERE stock_id = 1 AND date = ?", (dates[0],))
+        assert False, "upgraded view accepted a delete of a frozen candle"
+    except sqlite3.DatabaseError as e:
+        assert 'read-only' in str(e)
+    finally:
+        conn.close()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Tests for the incremental indicator state (python -m pytest test_indicator_state.py)"""
+
+import sqlite3
+import numpy as np
+from conftest import END_DATE, append_days
+from db_handler import DatabaseHandler
+from generate_signals import SignalGenerator
+from indicator_state import (
+    INDICATOR_STATE_COLUMNS, indicator_signals, load_states, rebuild_indicator_state, state_is_current,
+    update_indicator_state
+)
+from panel_loader import load_panel
+from signal_engine import SIGNAL_COLUMNS, universe_signals
+
+STOCKS = 4
+
+def _states(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return load_states(conn)
+    finally:
+        conn.close()
+
+def _assert_same_states(advanced, rebuilt):
+    assert set(advanced) == set(rebuilt)
+    for stock_id, state in advanced.items():
+        expected = rebuilt[stock_id]
+        for name in INDICATOR_STATE_COLUMNS:
+            if name == 'updated':
+                continue
+            got, want = getattr(state, name), getattr(expected, name)
+            if isinstance(want, float):
+                assert np.isclose(got, want, rtol=1e-9, atol=1e-9), (stock_id, name, got, want)
+            else:
+                assert got == want, (stock_id, name, got, want)
+
+def test_advance_matches_rebuild(make_db):
+    db_path = make_db(stocks=STOCKS)
+    assert update_indicator_state(db_path)['rebuilt'] == STOCKS
+
+    append_days(db_path, '2026-10-01', '2026-10-09')
+    totals = update_indicator_state(db_path)
+    assert totals['advanced'] == STOCKS and totals['rebuilt'] == 0
+    assert totals['candles'] == 7 * STOCKS
+    advanced = _states(db_path)
+
+    assert rebuild_indicator_state(db_path) == STOCKS
+    _assert_same_states(advanced, _states(db_path))
+
+def test_corrected_last_candle_is_rebuilt(make_db):
+    db_path = make_db(stocks=STOCKS)
+    update_indicator_state(db_path)
+
+    db = DatabaseHandler(db_path)
+    assert db.connect()
+    try:
+        stats = db.insert_history_data(2, {'candles': [[END_DATE, 100.0, 110.0, 95.0, 105.5, 5000]]})
+    finally:
+        db.close()
+    assert stats['updated'] == 1
+
+    totals = update_indicator_state(db_path)
+    assert totals['rebuilt'] == 1
+    state = _states(db_path)[2]
+    assert state.closes[-1] == 10550
+
+def test_state_signals_match_universe_signals(make_db):
+    db_path = make_db(stocks=STOCKS)
+    append_days(db_path, '2026-10-01', '2026-10-09')
+    update_indicator_state(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        from_state = indicator_signals(conn).set_index('stock_id')
+        panel = load_panel(conn, days=120, end_date='2026-10-09', db_path=db_path)
+        from_panel = universe_signals(panel).set_index('stock_id')
+    finally:
+        conn.close()
+
+    assert sorted(from_state.index) == sorted(from_panel.index)
+    for column in SIGNAL_COLUMNS[1:]:
+        got, want = from_state[column], from_panel.loc[from_state.index, column]
+        if want.dtype.kind == 'f':
+            assert np.allclose(got.astype(float), want.astype(float), rtol=1e-9, equal_nan=True), column
+        else:
+            assert (got.astype(str) == want.astype(str)).all(), column
+
+def test_signal_scan_reads_state_only_while_current(make_db):
+    db_path = make_db(stocks=STOCKS)
+    update_indicator_state(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        assert state_is_current(conn)
+    finally:
+        conn.close()
+
+    append_days(db_path, '2026-10-01', '2026-10-02')
+    conn = sqlite3.connect(db_path)
+    try:
+        assert not state_is_current(conn)
+    finally:
+        conn.close()
+
+    generator = SignalGenerator(db_path)
+    try:
+        assert generator.connect_db()
+        assert generator._state_signals() is None
+        update_indicator_state(db_path)
+        signals = generator._state_signals(symbols=['SYN0001'], days=365)
+    finally:
+        generator.close_db()
+    assert list(signals['symbol']) == ['SYN0001']
+    assert list(signals['date']) == ['2026-10-02']
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Tests for the intraday minute-bar store (python -m pytest test_intraday_store.py)"""
+
+import numpy as np
+from intraday_store import (
+    IntradayStore, bucket_bars, date_to_minute, intraday_db_path, intraday_table_name, month_of_minute,
+    parse_intraday_payload, SESSION_OPEN_MINUTE
+)
+from mock_dhan_server import mock_intraday_bars
+
+def _store(tmp_path):
+    store = IntradayStore(daily_db_path=str(tmp_path / 'stock_data.db'))
+    assert store.connect()
+    return store
+
+def _session(date, count):
+    """count one-minute bars from the 09:15 IST open of a date, with known prices"""
+    minute = date_to_minute(date) + SESSION_OPEN_MINUTE + np.arange(count)
+    close = 10000 + np.arange(count) * 10
+    return {
+        'minute': minute,
+        'open': close - 5,
+        'high': close + 20,
+        'low': close - 20,
+        'close': close,
+        'volume': np.full(count, 100),
+        'open_interest': np.arange(count),
+    }
+
+def test_store_sits_next_to_the_daily_database(tmp_path):
+    store = _store(tmp_path)
+    store.close()
+    assert store.db_path == str(tmp_path / 'stock_data_intraday.db')
+    assert intraday_db_path(str(tmp_path / 'stock_data.db')) == store.db_path
+
+def test_bars_are_split_into_month_tables(tmp_path):
+    payload = mock_intraday_bars('1333', '2026-07-31', '2026-08-03')
+    columns = parse_intraday_payload(payload)
+    store = _store(tmp_path)
+    try:
+        assert store.insert_bars_bulk([(1, 1, payload)]) == {1: {'inserted': 750, 'updated': 0, 'unchanged': 0}}
+        july, august = month_of_minute(date_to_minute('2026-07-31')), month_of_minute(date_to_minute('2026-08-03'))
+        assert store.months() == [july, august]
+        assert intraday_table_name(july) == 'intraday_p202607'
+        for month in (july, august):
+            count = store.cursor.execute(f"SELECT COUNT(*) FROM {intraday_table_name(month)}").fetchone()[0]
+            assert count == (month_of_minute(columns['minute']) == month).sum() == 375
+
+        # A range read across the boundary returns both months in order
+        bars = store.read(1, 1, date_to_minute('2026-07-31'), date_to_minute('2026-08-03', end_of_day=True))
+        assert (bars['minute'] == columns['minute']).all() and (bars['close'] == columns['close']).all()
+
+        assert store.drop_months_before(august) == 1
+        assert store.months() == [august]
+    finally:
+        store.close()
+
+def test_unchanged_bars_are_not_rewritten(tmp_path):
+    payload = mock_intraday_bars('1333', '2026-08-03', '2026-08-04')
+    store = _store(tmp_path)
+    try:
+        store.insert_bars_bulk([(1, 1, payload)])
+        changed = dict(payload, close=list(payload['close']))
+        changed['close'][-1] += 1.0
+        assert store.insert_bars_bulk([(1, 1, changed)]) == {1: {'inserted': 0, 'updated': 1, 'unchanged': 749}}
+        assert store.read(1, 1, date_to_minute('2026-08-04'), date_to_minute('2026-08-04', end_of_day=True))[
+            'close'][-1] == round(changed['close'][-1] * 100)
+    finally:
+        store.close()
+
+def test_bars_are_bucketed_from_the_session_open():
+    columns = _session('2026-08-03', 40)
+    bars = bucket_bars(columns, 15)
+    open_minute = date_to_minute('2026-08-03') + SESSION_OPEN_MINUTE
+    assert bars['minute'].tolist() == [open_minute, open_minute + 15, open_minute + 30]
+    assert bars['open'].tolist() == [columns['open'][0], columns['open'][15], columns['open'][30]]
+    assert bars['close'].tolist() == [columns['close'][14], columns['close'][29], columns['close'][39]]
+    assert bars['high'].tolist() == [columns['high'][14], columns['high'][29], columns['high'][39]]
+    assert bars['low'].tolist() == [columns['low'][0], columns['low'][15], columns['low'][30]]
+    assert bars['volume'].tolist() == [1500, 1500, 1000]
+    assert bars['open_interest'].tolist() == [14, 29, 39]
+
+def test_coarser_intervals_are_read_from_finer_bars(tmp_path):
+    store = _store(tmp_path)
+    try:
+        store.insert_bars_bulk([(1, 1, _session('2026-08-03', 60))])
+        df = store.get_bars(1, 15, '2026-08-03', '2026-08-03')
+        assert df['date'].tolist() == ['2026-08-03 09:15', '2026-08-03 09:30', '2026-08-03 09:45',
+                                       '2026-08-03 10:00']
+        assert df['volume'].tolist() == [1500] * 4
+        # 25 isn't a multiple of any stored interval but 1
+        assert len(store.get_bars(1, 25, '2026-08-03', '2026-08-03')) == 3
+        assert store.get_bars(2, 15, '2026-08-03', '2026-08-03') is None
+    finally:
+        store.close()
+
+def test_watermarks_come_from_the_latest_month_of_each_stock(tmp_path):
+    store = _store(tmp_path)
+    try:
+        store.insert_bars_bulk([
+            (1, 1, _session('2026-07-31', 30)),
+            (1, 1, _session('2026-08-03', 30)),
+            (2, 1, _session('2026-07-31', 10)),
+            (2, 5, bucket_bars(_session('2026-08-03', 30), 5)),
+        ])
+        open_minute = SESSION_OPEN_MINUTE
+        assert store.get_watermarks(1) == {1: date_to_minute('2026-08-03') + open_minute + 29,
+                                           2: date_to_minute('2026-07-31') + open_minute + 9}
+        assert store.get_watermarks(5) == {2: date_to_minute('2026-08-03') + open_minute + 25}
+        assert store.get_watermarks(15) == {}
+        assert store.stored_intervals(2) == [5]
+    finally:
+        store.close()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Tests for the columnar OHLCV cache (python -m pytest test_ohlcv_cache.py)"""
+
+import sqlite3
+import pytest
+from conftest import END_DATE, append_days
+from db_handler import DatabaseHandler, bump_data_version
+from ohlcv_cache import date_to_day, get_cache, refresh_cache, REFRESH_TAIL_DAYS
+
+@pytest.fixture
+def db_path(make_db):
+    """Synthetic database with a warm cache"""
+    db_path = make_db(stocks=3)
+    assert refresh_cache(db_path)
+    return db_path
+
+def _correct_close(db_path, stock_id, date, delta):
+    """Rewrite one stored candle with a changed close, as a refetch would"""
+    conn = sqlite3.connect(db_path)
+    row = conn.execute(
+        "SELECT date, open, high, low, close, volume FROM history_data WHERE stock_id = ? AND date = ?",
+        (stock_id, date)
+    ).fetchone()
+    conn.close()
+    candle = [row[0], row[1], row[2] + delta, row[3], row[4] + delta, row[5]]
+
+    db = DatabaseHandler(db_path)
+    assert db.connect()
+    try:
+        return db.insert_history_data(stock_id, {'candles': [candle]})
+    finally:
+        db.close()
+
+def test_refresh_reloads_corrected_stocks(db_path):
+    cache = get_cache(db_path)
+    # Older than the tail refresh() re-reads, but still in the writable hot table
+    date = '2026-09-01'
+    before = cache.get_frame(1, date, date)['close'].iloc[0]
+
+    stats = _correct_close(db_path, 1, date, 7.0)
+    assert stats['updated'] == 1
+
+    assert refresh_cache(db_path, reload_ids=[1])
+    conn = sqlite3.connect(db_path)
+    try:
+        assert cache.is_fresh(conn)
+        stored = conn.execute(
+            "SELECT close FROM history_data WHERE stock_id = 1 AND date = ?", (date,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    cached = cache.get_frame(1, date, date)['close'].iloc[0]
+    assert abs(stored - (before + 7.0)) < 1e-9
+    assert abs(cached - stored) < 1e-9
+
+def test_refresh_keeps_other_stocks(db_path):
+    cache = get_cache(db_path)
+    untouched = cache.get_frame(2).copy()
+
+    _correct_close(db_path, 1, '2026-09-01', 3.0)
+    assert refresh_cache(db_path, reload_ids=[1])
+    assert cache.get_frame(2).equals(untouched)
+
+def test_lagging_stock_does_not_widen_the_refresh(db_path):
+    # Stock 3 stopped trading in July: its last candle is two months behind the others
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("DELETE FROM history_v2 WHERE stock_id = 3 AND day >= ?", (date_to_day('2026-08-01'),))
+        bump_data_version(conn, 'history')
+        conn.commit()
+    finally:
+        conn.close()
+    assert refresh_cache(db_path, reload_ids=[3])
+
+    append_days(db_path, '2026-10-01', '2026-10-09', stock_ids=(1, 2))
+
+    statements = []
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.set_trace_callback(statements.append)
+        assert get_cache(db_path).refresh(conn=conn)
+        stored = {stock_id: conn.execute(
+            "SELECT day, close FROM history_data WHERE stock_id = ? ORDER BY day", (stock_id,)
+        ).fetchall() for stock_id in (1, 2, 3)}
+    finally:
+        conn.close()
+
+    # The recent stocks' tail starts near their own last day, the laggard is read on its own
+    tails = [sql for sql in statements if 'day > ' in sql]
+    bulk = [sql for sql in tails if 'IN (1,2)' in sql]
+    assert len(bulk) == 1
+    assert bulk[0].rstrip().endswith(f"day > {date_to_day(END_DATE) - REFRESH_TAIL_DAYS} ORDER BY stock_id, day")
+    assert len([sql for sql in tails if 'IN (3)' in sql]) == 1
+
+    cache = get_cache(db_path)
+    for stock_id, rows in stored.items():
+        frame = cache.get_frame(stock_id)
+        assert [round(close, 2) for close in frame['close']] == [round(close, 2) for _, close in rows]
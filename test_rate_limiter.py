@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Tests for the Dhan API rate limiters (python -m pytest test_rate_limiter.py)"""
+
+import time
+import threading
+import rate_limiter
+from rate_limiter import AdaptiveRateLimiter, TokenBucket, RATE_DECREASE_FACTOR, MIN_RATE_SHARE
+
+class _Clock:
+    """Stand-in for the time module whose sleep() advances monotonic()"""
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+def _clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(rate_limiter, 'time', clock)
+    return clock
+
+def _ok(limiter, clock, latency=0.01):
+    """Report a quick successful response"""
+    limiter.record(clock.now - latency, 200)
+
+def test_bucket_spaces_requests_at_its_rate(monkeypatch):
+    clock = _clock(monkeypatch)
+    bucket = TokenBucket(5)
+    waits = [bucket.acquire() for _ in range(6)]
+    # The first token is in the bucket, the other five are paid off 0.2s apart
+    assert waits[0] == 0
+    assert all(abs(wait - 0.2) < 1e-9 for wait in waits[1:])
+    assert abs(sum(clock.slept) - 1.0) < 1e-9
+
+    assert not bucket.try_acquire()
+    clock.now += 0.2
+    assert bucket.try_acquire()
+
+def test_bucket_paces_many_threads_together():
+    bucket = TokenBucket(100)
+    started = time.monotonic()
+    threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 20 requests at 100/s: the first is free, the other 19 take 10ms each
+    assert time.monotonic() - started >= 0.18
+
+def test_hold_does_not_add_to_a_longer_debt(monkeypatch):
+    _clock(monkeypatch)
+    bucket = TokenBucket(10)
+    bucket.hold(2.0)
+    assert bucket.tokens == -20
+    bucket.hold(0.5)
+    assert bucket.tokens == -20
+    bucket.drain(0.5)
+    assert bucket.tokens == -25
+
+def test_429_cuts_the_rate_once_per_overload(monkeypatch):
+    clock = _clock(monkeypatch)
+    limiter = AdaptiveRateLimiter(10)
+    in_flight = [clock.now - 0.01 for _ in range(3)]
+
+    limiter.record(in_flight[0], 429)
+    assert limiter.rate == 10 * RATE_DECREASE_FACTOR
+    # Requests sent before the cut saw the same overload and don't cut again
+    for started in in_flight[1:]:
+        limiter.record(started, 429)
+    assert limiter.rate == 10 * RATE_DECREASE_FACTOR
+    assert limiter.stats()['throttled'] == 3 and limiter.stats()['decreases'] == 1
+
+    clock.now += 0.1
+    limiter.record(clock.now - 0.01, 429)
+    assert abs(limiter.rate - 10 * RATE_DECREASE_FACTOR ** 2) < 1e-9
+
+    for _ in range(30):
+        clock.now += 0.1
+        limiter.record(clock.now - 0.01, 429)
+    assert limiter.rate == 10 * MIN_RATE_SHARE
+
+def test_rate_recovers_after_throttle_free_time(monkeypatch):
+    clock = _clock(monkeypatch)
+    limiter = AdaptiveRateLimiter(10)
+    _ok(limiter, clock)
+    limiter.record(clock.now - 0.01, 429)
+    assert limiter.rate == 7
+
+    # 5% of the quota per throttle-free second
+    clock.now += 1.0
+    _ok(limiter, clock)
+    assert abs(limiter.rate - 7.5) < 1e-9
+    # Slower near the rate that was throttled, and never above the quota
+    clock.now += 4.0
+    _ok(limiter, clock)
+    assert abs(limiter.rate - 9.5) < 1e-9
+    clock.now += 4.0
+    _ok(limiter, clock)
+    assert abs(limiter.rate - 10.0) < 1e-9
+    clock.now += 100.0
+    _ok(limiter, clock)
+    assert limiter.rate == 10
+
+def test_rising_latency_trims_the_rate(monkeypatch):
+    clock = _clock(monkeypatch)
+    limiter = AdaptiveRateLimiter(10)
+    for _ in range(5):
+        clock.now += 0.1
+        _ok(limiter, clock, latency=0.01)
+    assert limiter.rate == 10
+
+    for _ in range(10):
+        clock.now += 0.1
+        _ok(limiter, clock, latency=0.5)
+    assert limiter.rate < 10
+    assert limiter.stats()['throttled'] == 0
+
+def test_retry_after_holds_every_caller(monkeypatch):
+    clock = _clock(monkeypatch)
+    limiter = AdaptiveRateLimiter(10)
+    limiter.acquire()
+    started = clock.now - 0.01
+    limiter.record(started, 429, retry_after='2')
+    assert limiter.acquire() >= 2.0
+
+    # A 429 of a request sent before the cut doesn't cut the rate again, but
+    # its Retry-After is still honoured
+    rate = limiter.rate
+    limiter.record(started, 429, retry_after='3')
+    assert limiter.rate == rate
+    assert limiter.acquire() >= 3.0
+
+    # Unparseable Retry-After values are ignored
+    clock.now += 10.0
+    limiter.record(clock.now - 0.01, 429, retry_after='soon')
+    assert limiter.acquire() < 1.0
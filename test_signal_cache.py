@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Tests for the signal cache (python -m pytest test_signal_cache.py)"""
+
+import sqlite3
+from generate_signals import SignalGenerator
+from ohlcv_cache import date_to_day
+from signal_cache import get_signal_cache
+
+PARAMS = {'ma_period': 50, 'rsi_period': 14, 'rsi_threshold': 50}
+
+def _stock_frame(db_path, stock_id=1, from_date='2026-05-01'):
+    generator = SignalGenerator(db_path)
+    generator.use_ai = False
+    assert generator.connect_db()
+    try:
+        df = generator.get_stock_data(symbol=f"SYN{stock_id - 1:04d}", days=400)
+    finally:
+        generator.close_db()
+    return df[df['date'] >= from_date].reset_index(drop=True)
+
+def test_put_leaves_the_callers_transaction_open(make_db):
+    db_path = make_db(stocks=2)
+    cache = get_signal_cache(db_path)
+    df = _stock_frame(db_path)
+    frame = SignalGenerator(db_path).generate_signals(df)
+    last_day = date_to_day(df['date'].iloc[-1])
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM stocks").fetchone()
+        cache.put(conn, 1, last_day, date_to_day(df['date'].iloc[0]), PARAMS, frame, {'close': 1.0})
+        assert conn.in_transaction
+        conn.rollback()
+    finally:
+        conn.close()
+
+    # The entry was committed on the cache's own connection
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM signal_cache WHERE stock_id = 1").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+def test_window_is_keyed_by_the_frame_passed_in(make_db):
+    db_path = make_db(stocks=2)
+    df = _stock_frame(db_path, from_date='2026-06-15')
+
+    generator = SignalGenerator(db_path)
+    generator.use_ai = False
+    assert generator.connect_db()
+    try:
+        first = generator.analyze_stock(symbol='SYN0000', show_chart=False, df=df)
+        hits = get_signal_cache(db_path).stats()['hits']
+        second = generator.analyze_stock(symbol='SYN0000', show_chart=False, df=df)
+        assert get_signal_cache(db_path).stats()['hits'] == hits + 1
+        # A longer window of the same stock is a different entry
+        longer = generator.analyze_stock(symbol='SYN0000', show_chart=False, df=_stock_frame(db_path))
+    finally:
+        generator.close_db()
+    assert first == second
+    assert longer['ma_50'] == first['ma_50']
+
+    conn = sqlite3.connect(db_path)
+    try:
+        from_days = {row[0] for row in conn.execute("SELECT from_day FROM signal_cache WHERE stock_id = 1")}
+    finally:
+        conn.close()
+    assert from_days == {date_to_day(df['date'].iloc[0]), date_to_day('2026-05-01')}
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Tests for the cross-sectional signal engine (python -m pytest test_signal_engine.py)"""
+
+import sqlite3
+import numpy as np
+import pandas as pd
+from conftest import END_DATE
+from db_handler import DatabaseHandler, bump_data_version
+from generate_signals import SignalGenerator
+from panel_loader import load_panel
+from signal_engine import SIGNAL_COLUMNS, universe_signals
+
+DAYS = 150
+
+def _per_stock_signals(conn, stock_id, from_date):
+    """Latest signals of one stock through SignalGenerator, from its own candles (None if rejected)"""
+    df = pd.read_sql_query('''
+        SELECT h.date, h.open, h.high, h.low, h.close, h.volume, s.symbol, s.name, s.security_id
+        FROM history_data h JOIN stocks s ON s.id = h.stock_id
+        WHERE h.stock_id = ? AND h.date >= ? AND h.date <= ?
+        ORDER BY h.date
+    ''', conn, params=(stock_id, from_date, END_DATE))
+    generator = SignalGenerator(':memory:')
+    return generator.get_latest_signals(generator.generate_signals(df))
+
+def _assert_matches(engine_row, expected):
+    for key in SIGNAL_COLUMNS:
+        if key == 'stock_id':
+            continue
+        got, want = engine_row[key], expected[key]
+        if isinstance(want, (float, np.floating)) or key == 'volume':
+            assert np.isclose(float(got), float(want), rtol=1e-9, atol=1e-9, equal_nan=True), (key, got, want)
+        else:
+            assert got == want, (key, got, want)
+
+def _check_universe(db_path, days=DAYS):
+    """Compare universe_signals() with the per-stock path for every stock of the panel"""
+    conn = sqlite3.connect(db_path)
+    try:
+        panel = load_panel(conn, days=days, end_date=END_DATE, db_path=db_path)
+        signals = universe_signals(panel)
+        assert list(signals.columns) == list(SIGNAL_COLUMNS)
+        rows = {row['stock_id']: row for row in signals.to_dict('records')}
+        from_date = str(np.datetime64(END_DATE) - np.timedelta64(days, 'D'))
+        for stock_id in panel.stock_ids.tolist():
+            expected = _per_stock_signals(conn, stock_id, from_date)
+            if expected is None:
+                assert stock_id not in rows
+            else:
+                _assert_matches(rows[stock_id], expected)
+    finally:
+        conn.close()
+    return signals
+
+def test_universe_signals_match_per_stock_signals(make_db):
+    signals = _check_universe(make_db(stocks=6))
+    assert len(signals) == 6
+
+def test_universe_signals_with_missing_days(make_db):
+    db_path = make_db(stocks=6)
+    # Stocks that skip days (suspensions, delistings) keep their own candle windows
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("DELETE FROM history_data WHERE stock_id = 2 AND date BETWEEN '2026-09-10' AND '2026-09-20'")
+        conn.execute("DELETE FROM history_data WHERE stock_id = 3 AND date >= '2026-09-25'")
+        conn.execute("DELETE FROM history_data WHERE stock_id = 4 AND date >= '2026-08-01'")
+        bump_data_version(conn, 'history')
+        conn.commit()
+    finally:
+        conn.close()
+
+    signals = _check_universe(db_path)
+    last_dates = dict(zip(signals['stock_id'], signals['date']))
+    assert last_dates[3] < '2026-09-25'
+    assert last_dates[4] < '2026-08-01'
+
+def test_universe_signals_leave_out_short_histories(make_db):
+    db_path = make_db(stocks=6)
+    db = DatabaseHandler(db_path)
+    assert db.connect()
+    try:
+        # Through retention: the candles of closed months sit in read-only partitions
+        assert db.clean_history_data(stock_id=5, before_date='2026-09-05') > 0
+    finally:
+        db.close()
+
+    signals = _check_universe(db_path, days=80)
+    assert 5 not in set(signals['stock_id'])
@@ -4,9 +4,15 @@ import logging
 import sys
 import schedule
 from tqdm import tqdm
-from datetime import datetime, timedelta
+from datetime import datetime
 from db_handler import DatabaseHandler
 from stock_fetcher import StockFetcher
+from ohlcv_cache import refresh_cache
+from update_planner import plan_updates
+from ingest_pipeline import IngestPipeline
+from rate_limiter import rate_limit_stats
+from indicator_state import update_indicator_state
+from feature_store import update_feature_store
 from dotenv import load_dotenv
 
 # Set up logging
@@ -48,85 +54,97 @@ def update_latest_stock_data():
     
     logging.info(f"Found {len(stocks)} stocks in the database")
 
-    # Calculate yesterday's date as we want the latest complete day of data
-    yesterday = datetime.now() - timedelta(days=1)
-    yesterday_str = yesterday.strftime("%Y-%m-%d")
-
-    # Calculate date 7 days ago to get a week's worth of data
-    # This helps ensure we don't miss any data in case the script wasn't run daily
-    week_ago = yesterday - timedelta(days=7)
-    week_ago_str = week_ago.strftime("%Y-%m-%d")
-    
-    logging.info(f"Fetching data from {week_ago_str} to {yesterday_str}")
+    # Plan one fetch per stock covering only the trading days after its last
+    # stored candle (up to yesterday, the latest complete day); stocks that are
+    # already current are skipped, and any downtime is caught up automatically.
+    # Exchange holidays can be listed in the 'market_holidays' setting (comma-separated dates)
+    holidays = [day.strip() for day in str(db.get_setting('market_holidays', '')).split(',') if day.strip()]
+    tasks, skipped_count = plan_updates(db.conn, stocks, holidays=holidays)
     
     # Process each stock
     success_count = 0
-    skipped_count = 0
     failed_stocks = []
+    corrected_ids = []
+    totals = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'frozen': 0}
     
-    for stock in tqdm(stocks, desc="Updating stock data"):
-        stock_id, security_id, exchange_segment, symbol, instrument = stock
-        
-        # Fetch the latest data (last 7 days to ensure we don't miss any)
-        retry_count = 0
-        max_retries = 3
-        hist_data = None
-        
-        while retry_count < max_retries and hist_data is None:
-            try:
-                hist_data = fetcher.fetch_historical_daily_data(
-                    security_id, 
-                    exchange_segment, 
-                    instrument, 
-                    week_ago_str,
-                    yesterday_str
-                )
-                
-                if not hist_data:
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        logging.warning(f"Retry {retry_count}/{max_retries} for {symbol}")
-                        time.sleep(2 ** retry_count)  # Exponential backoff
-                    else:
-                        logging.error(f"Failed to fetch latest data for {symbol} after {max_retries} attempts")
-                        failed_stocks.append(symbol)
-            except Exception as e:
-                retry_count += 1
-                logging.error(f"Error fetching data for {symbol}: {e}")
-                if retry_count < max_retries:
-                    logging.warning(f"Retry {retry_count}/{max_retries} for {symbol}")
-                    time.sleep(2 ** retry_count)  # Exponential backoff
-                else:
-                    logging.error(f"Failed to fetch latest data for {symbol} after {max_retries} attempts")
-                    failed_stocks.append(symbol)
-        
+    def fetch_latest(task):
+        """Fetch the missing days of one stock; runs in a worker thread"""
+        # The fetcher retries failures itself, and 429s slow down every worker
+        # through the shared rate limiter, so there is no second retry loop here.
+        # Without the demo fallback a failed stock is reported instead of stored
+        hist_data = fetcher.fetch_historical_daily_data(
+            task.security_id, 
+            task.exchange_segment, 
+            task.instrument, 
+            task.from_date,
+            task.to_date,
+            demo_fallback=False
+        )
         if not hist_data:
-            continue
+            logging.error(f"Failed to fetch latest data for {task.symbol}")
+        return hist_data
+    
+    # Fetch, parse and write concurrently: the fetches are paced by the shared
+    # API rate limiter and one writer commits many stocks per transaction
+    pipeline = IngestPipeline(fetch_latest, db.db_name)
+    for task, stats in tqdm(pipeline.run(tasks), total=len(tasks), desc="Updating stock data"):
+        symbol = task.symbol
+        
+        for key in totals:
+            totals[key] += stats[key] if stats else 0
         
-        # Insert historical data
-        try:
-            inserted_count = db.insert_history_data(stock_id, hist_data)
-            
-            if inserted_count > 0:
-                logging.info(f"Inserted {inserted_count} new data points for {symbol}")
-                success_count += 1
-            else:
-                logging.info(f"No new data points for {symbol} (all dates already exist in database)")
-                skipped_count += 1
-        except Exception as e:
-            logging.error(f"Database error while inserting data for {symbol}: {e}")
+        if stats is None:
+            logging.error(f"Failed to fetch or store data for {symbol}")
             failed_stocks.append(symbol)
+        elif stats['inserted'] or stats['updated']:
+            if stats['updated']:
+                corrected_ids.append(task.stock_id)
+            logging.info(
+                f"Inserted {stats['inserted']} new and updated {stats['updated']} changed data points "
+                f"for {symbol} ({stats['unchanged']} unchanged)"
+            )
+            success_count += 1
+        else:
+            logging.info(f"No new data points for {symbol} (all dates already exist in database)")
+            skipped_count += 1
         
-        # Sleep to avoid hitting rate limits
-        time.sleep(1)
+        if stats and stats['frozen']:
+            logging.warning(
+                f"{stats['frozen']} changed candles for {symbol} are in read-only history partitions "
+                f"and were not rewritten"
+            )
     
     logging.info(f"Successfully updated data for {success_count} stocks")
     logging.info(f"Skipped {skipped_count} stocks (no new data)")
+    logging.info(
+        f"Candles: {totals['inserted']} inserted, {totals['updated']} updated, "
+        f"{totals['unchanged']} unchanged (not rewritten), {totals['frozen']} frozen"
+    )
     if failed_stocks:
         logging.warning(f"Failed to update data for {len(failed_stocks)} stocks: {', '.join(failed_stocks[:10])}")
         if len(failed_stocks) > 10:
             logging.warning(f"... and {len(failed_stocks) - 10} more")
+    
+    for family, stats in rate_limit_stats().items():
+        logging.info(
+            f"Dhan {family} API: {stats['requests']} requests, {stats['throttled']} throttled, "
+            f"rate {stats['rate']}/{stats['quota']} per second"
+        )
+    
+    # Move closed months into read-only partitions
+    db.roll_history_partitions()
     db.close()
+    
+    # Bring the columnar OHLCV cache up to date with the new candles; stocks
+    # with corrected candles are reloaded in full
+    refresh_cache(db.db_name, reload_ids=corrected_ids)
+    
+    # Fold the new candles into the indicator state; stocks with corrected
+    # candles are rebuilt from their history
+    update_indicator_state(db.db_name, rebuild_ids=corrected_ids)
+    
+    # Append the new days to the AI feature store the same way
+    update_feature_store(db.db_name, rebuild_ids=corrected_ids)
 
 def run_scheduler():
     schedule.every().day.at("21:10").do(update_latest_stock_data)
@@ -3,6 +3,8 @@ import csv
 import os
 import logging
 from datetime import datetime
+from db_connection import connect_read_write
+from db_handler import bump_data_version
 
 # Set up logging
 logging.basicConfig(
@@ -25,7 +27,7 @@ class SecurityIDUpdater:
     def connect_to_db(self):
         """Connect to the SQLite database"""
         try:
-            self.conn = sqlite3.connect(self.db_name)
+            self.conn = connect_read_write(self.db_name)
             self.cursor = self.conn.cursor()
             logging.info(f"Connected to database: {self.db_name}")
             return True
@@ -132,6 +134,12 @@ class SecurityIDUpdater:
             except sqlite3.Error as e:
                 logging.error(f"Error updating security ID for {stock['symbol']}: {e}")
         
+        if updated_count:
+            try:
+                # Tells instrument registries to reload
+                bump_data_version(self.conn, 'stocks')
+            except sqlite3.Error as e:
+                logging.warning(f"Could not record stocks change: {e}")
         self.conn.commit()
         return updated_count
 
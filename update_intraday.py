@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Intraday bar ingestion.
+
+Fetches minute bars for every stock (or the given symbols) from the Dhan
+intraday charts API and bulk-loads them into the intraday store
+(<db name>_intraday.db). Each stock is fetched from its last stored bar, so
+repeated runs only download new bars; stocks without bars get --days of
+history. Months older than --keep-months are dropped.
+
+Usage:
+    python update_intraday.py --interval 1 --days 5
+    python update_intraday.py --interval 15 --symbols RELIANCE TCS --days 60
+"""
+
+import sys
+import logging
+import argparse
+import numpy as np
+from tqdm import tqdm
+from datetime import datetime, timedelta
+from db_handler import DatabaseHandler
+from intraday_store import IntradayStore, INTRADAY_INTERVALS, IST_OFFSET_MINUTES, month_of_minute
+from stock_fetcher import StockFetcher
+from dotenv import load_dotenv
+
+# Days of bars fetched for a stock that has none
+INTRADAY_INITIAL_DAYS = 5
+
+# Stocks committed per write transaction
+INTRADAY_BATCH_SIZE = 50
+
+# Months of bars kept (counting the current one)
+INTRADAY_KEEP_MONTHS = 12
+
+def update_intraday_data(interval=1, days=INTRADAY_INITIAL_DAYS, symbols=None, db_path='stock_data.db',
+                         keep_months=INTRADAY_KEEP_MONTHS):
+    """
+    Bring the intraday bars of every stock (or the given symbols) up to today
+
+    Returns:
+        dict with the number of stocks updated and failed, and bars written
+    """
+    db = DatabaseHandler(db_path)
+    if not db.connect():
+        return None
+    stocks = db.get_all_stocks()
+    db.close()
+    if symbols:
+        wanted = {symbol.upper() for symbol in symbols}
+        stocks = [stock for stock in stocks if str(stock[3]).upper() in wanted]
+    if not stocks:
+        logging.error("No stocks to update")
+        return None
+
+    store = IntradayStore(daily_db_path=db_path)
+    if not store.connect():
+        return None
+
+    fetcher = StockFetcher()
+    today = datetime.now().strftime("%Y-%m-%d")
+    first_day = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+    # Start each stock at the day of its last stored bar (that day may be incomplete)
+    watermarks = store.get_watermarks(interval)
+    tasks = []
+    for stock in stocks:
+        watermark = watermarks.get(stock[0])
+        if watermark is None:
+            from_date = first_day
+        else:
+            from_date = str(np.datetime64(int(watermark) + IST_OFFSET_MINUTES, 'm').astype('datetime64[D]'))
+        tasks.append((stock, from_date))
+
+    def fetch(task):
+        stock, from_date = task
+        return fetcher.fetch_intraday_data(stock[1], stock[2], stock[4], interval, from_date, today)
+
+    totals = {'updated': 0, 'failed': 0, 'bars': 0}
+    batch = []
+
+    def write(batch):
+        written = store.insert_bars_bulk((stock[0], interval, data) for stock, data in batch)
+        for stock, _ in batch:
+            if stock[0] in written:
+                totals['updated'] += 1
+                totals['bars'] += written[stock[0]]['inserted'] + written[stock[0]]['updated']
+            else:
+                totals['failed'] += 1
+
+    for (stock, _), data in tqdm(fetcher.fetch_many(tasks, fetch), total=len(tasks),
+                                 desc=f"Updating {interval}-minute bars"):
+        if not data:
+            logging.error(f"Failed to fetch intraday bars for {stock[3]}")
+            totals['failed'] += 1
+            continue
+        batch.append((stock, data))
+        if len(batch) >= INTRADAY_BATCH_SIZE:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+
+    # Drop whole months that fell out of the retention window
+    if keep_months:
+        current = int(month_of_minute(int(datetime.now().timestamp()) // 60))
+        dropped = store.drop_months_before(current - keep_months + 1)
+        if dropped:
+            logging.info(f"Dropped {dropped} months of intraday bars")
+    store.close()
+    fetcher.db.close()
+
+    logging.info(
+        f"Intraday update: {totals['updated']} stocks updated, {totals['failed']} failed, "
+        f"{totals['bars']} {interval}-minute bars written"
+    )
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch intraday bars into the intraday store')
+    parser.add_argument('--interval', type=int, default=1, choices=INTRADAY_INTERVALS, help='Bar size in minutes')
+    parser.add_argument('--days', type=int, default=INTRADAY_INITIAL_DAYS,
+                        help='Days of bars to fetch for stocks that have none')
+    parser.add_argument('--symbols', nargs='*', help='Only update these symbols')
+    parser.add_argument('--db', default='stock_data.db', help='Daily database (the intraday file sits next to it)')
+    parser.add_argument('--keep-months', type=int, default=INTRADAY_KEEP_MONTHS,
+                        help='Months of bars to keep (0 keeps everything)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    load_dotenv()
+
+    totals = update_intraday_data(args.interval, args.days, args.symbols, args.db, args.keep_months)
+    return 0 if totals and not totals['failed'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
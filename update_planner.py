@@ -0,0 +1,113 @@
+"""
+Gap-aware incremental update planner.
+
+Reads every stock's last stored trading day (its watermark) in one pass and
+plans only the fetches that are actually needed: a stock that already has the
+latest trading day gets no request at all, one that is behind gets a single
+request covering exactly the missing business days, and a stock with no
+history gets an initial backfill. However long the nightly job was down, the
+next run catches up without re-fetching anything already stored.
+
+Trading days are Monday to Friday minus the optional exchange holidays; a
+planned range that only spans holidays returns no candles and costs one call.
+"""
+
+import logging
+import numpy as np
+from collections import namedtuple
+from datetime import datetime, timedelta
+from db_handler import (
+    get_history_layout, HISTORY_LAYOUT_V2, HISTORY_V2_TABLE, HISTORY_ALL_VIEW
+)
+from ohlcv_cache import date_to_day, days_to_dates
+
+# Days of history requested for a stock that has none yet
+INITIAL_HISTORY_DAYS = 365
+
+FetchTask = namedtuple(
+    'FetchTask',
+    ['stock_id', 'security_id', 'exchange_segment', 'symbol', 'instrument', 'from_date', 'to_date']
+)
+
+def get_watermarks(conn):
+    """
+    Last stored trading day of every stock
+
+    Returns:
+        dict mapping stock_id to days since the epoch (stocks without history are absent)
+    """
+    if get_history_layout(conn) != HISTORY_LAYOUT_V2:
+        # Answered from the (stock_id, date) index
+        rows = conn.execute("SELECT stock_id, MAX(date) FROM history_data GROUP BY stock_id").fetchall()
+        return {stock_id: date_to_day(max_date) for stock_id, max_date in rows if max_date}
+
+    # Recent candles are in the hot table; only stocks without any recent candle
+    # need the (slower) scan across the monthly partitions
+    watermarks = dict(conn.execute(
+        f"SELECT stock_id, MAX(day) FROM {HISTORY_V2_TABLE} GROUP BY stock_id"
+    ).fetchall())
+    stale = [row[0] for row in conn.execute("SELECT id FROM stocks") if row[0] not in watermarks]
+    for i in range(0, len(stale), 500):
+        chunk = stale[i:i + 500]
+        watermarks.update(conn.execute(
+            f"SELECT stock_id, MAX(day) FROM {HISTORY_ALL_VIEW} "
+            f"WHERE stock_id IN ({','.join('?' * len(chunk))}) GROUP BY stock_id",
+            chunk
+        ).fetchall())
+    return {stock_id: day for stock_id, day in watermarks.items() if day is not None}
+
+def last_trading_day(end_date=None, holidays=()):
+    """
+    Latest trading day on or before end_date (default: yesterday, the latest
+    complete day), as days since the epoch
+    """
+    end = end_date or (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    day = np.busday_offset(np.datetime64(end, 'D'), 0, roll='backward', holidays=list(holidays))
+    return int(day.astype(np.int64))
+
+def plan_updates(conn, stocks, end_date=None, holidays=(), initial_days=INITIAL_HISTORY_DAYS, overlap_days=0):
+    """
+    Plan the minimal set of fetches that brings every stock up to end_date
+
+    Args:
+        conn: SQLite connection
+        stocks: Rows of (stock_id, security_id, exchange_segment, symbol, instrument),
+                as returned by DatabaseHandler.get_all_stocks
+        end_date: Last day to bring stocks up to (defaults to yesterday)
+        holidays: Exchange holidays (YYYY-MM-DD) that are not trading days
+        initial_days: Calendar days to backfill for stocks without history
+        overlap_days: Trading days before the watermark to fetch again, e.g. to
+                      pick up late corrections to the last candles
+
+    Returns:
+        (tasks, skipped): list of FetchTask, and the number of stocks already up to date
+    """
+    holidays = list(holidays)
+    end_day = last_trading_day(end_date, holidays)
+    watermarks = get_watermarks(conn)
+
+    tasks = []
+    skipped = 0
+    for stock_id, security_id, exchange_segment, symbol, instrument in stocks:
+        watermark = watermarks.get(stock_id)
+        if watermark is None:
+            from_day = end_day - initial_days
+        else:
+            if watermark >= end_day:
+                skipped += 1
+                continue
+            # First trading day after the watermark, less any overlap
+            from_day = int(np.busday_offset(
+                np.datetime64(int(watermark) + 1, 'D'), -overlap_days, roll='forward', holidays=holidays
+            ).astype(np.int64))
+
+        from_date, to_date = days_to_dates([from_day, end_day])
+        tasks.append(FetchTask(stock_id, security_id, exchange_segment, symbol, instrument,
+                               str(from_date), str(to_date)))
+
+    backfills = sum(1 for task in tasks if task.stock_id not in watermarks)
+    logging.info(
+        f"Update plan up to {days_to_dates([end_day])[0]}: {len(tasks)} fetches "
+        f"({backfills} initial backfills), {skipped} stocks already up to date"
+    )
+    return tasks, skipped
@@ -2,11 +2,11 @@ import sqlite3
 import logging
 import openpyxl
 from openpyxl.styles import PatternFill
-from datetime import datetime
-import requests
+from datetime import datetime, timedelta
 import os
-import time
 from dotenv import load_dotenv
+from db_connection import connect_read_only
+from dhan_transport import get_transport, DHAN_API_URL
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,24 +20,20 @@ class SecurityIDVerifier:
         self.db_name = 'stock_data.db'
         self.conn = None
         self.cursor = None
-        self.api_base_url = "https://api.dhan.co/v2"
+        self.api_base_url = DHAN_API_URL
         
         # Get API key from environment variable
         self.api_key = os.getenv("DHAN_API_KEY")
         if not self.api_key:
             logging.warning("API key not found in environment variables. Set DHAN_API_KEY in .env file.")
         
-        # Headers for API requests
-        self.headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "access-token": self.api_key
-        }
+        # Pooled keep-alive connection to the API (headers and rate limiting included)
+        self.transport = get_transport(self.api_key, self.api_base_url)
     
     def connect_to_db(self):
         """Connect to the SQLite database"""
         try:
-            self.conn = sqlite3.connect(self.db_name)
+            self.conn = connect_read_only(self.db_name)
             self.cursor = self.conn.cursor()
             logging.info(f"Connected to database: {self.db_name}")
             return True
@@ -94,10 +90,35 @@ class SecurityIDVerifier:
         logging.info(f"Exported {len(stocks)} stocks to {filename}")
         return filename
     
+    def check_security_id(self, security_id, exchange_segment, instrument, from_date, to_date):
+        """
+        Request a short stretch of history for one security
+        
+        Returns:
+            "OK", or a description of the error
+        """
+        endpoint = f"{self.api_base_url}/charts/historical"
+        payload = {
+            "securityId": security_id,
+            "exchangeSegment": exchange_segment,
+            "instrument": instrument,
+            "fromDate": from_date,
+            "toDate": to_date,
+            "oi": False
+        }
+        
+        try:
+            response = self.transport.post(endpoint, json=payload)
+            if response.status_code == 200:
+                return "OK"
+            return f"Error: {response.status_code} - {response.text}"
+        except Exception as e:
+            return f"Exception: {str(e)}"
+    
     def test_security_ids(self, stocks):
         """Test each security ID with the API to find problems"""
         yesterday = datetime.now().strftime("%Y-%m-%d")
-        one_week_ago = (datetime.now() - datetime.timedelta(days=7)).strftime("%Y-%m-%d")
+        one_week_ago = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
         
         # Create a new workbook and sheet
         wb = openpyxl.Workbook()
@@ -122,35 +143,13 @@ class SecurityIDVerifier:
                 ws.cell(row=row_num, column=col_num).value = value
             
             # Test API call
-            endpoint = f"{self.api_base_url}/charts/historical"
-            payload = {
-                "securityId": security_id,
-                "exchangeSegment": exchange_segment,
-                "instrument": instrument,
-                "fromDate": one_week_ago,
-                "toDate": yesterday,
-                "oi": False
-            }
-            
-            try:
-                response = requests.post(endpoint, headers=self.headers, json=payload)
-                if response.status_code == 200:
-                    status = "OK"
-                    ws.cell(row=row_num, column=7).value = status
-                    ws.cell(row=row_num, column=7).fill = green_fill
-                else:
-                    status = f"Error: {response.status_code} - {response.text}"
-                    ws.cell(row=row_num, column=7).value = status
-                    ws.cell(row=row_num, column=7).fill = red_fill
-                    logging.error(f"Error testing {symbol} (ID: {security_id}): {status}")
-            except Exception as e:
-                status = f"Exception: {str(e)}"
-                ws.cell(row=row_num, column=7).value = status
+            status = self.check_security_id(security_id, exchange_segment, instrument, one_week_ago, yesterday)
+            ws.cell(row=row_num, column=7).value = status
+            if status == "OK":
+                ws.cell(row=row_num, column=7).fill = green_fill
+            else:
                 ws.cell(row=row_num, column=7).fill = red_fill
-                logging.error(f"Exception testing {symbol} (ID: {security_id}): {e}")
-            
-            # Sleep to avoid rate limits
-            time.sleep(0.5)
+                logging.error(f"Error testing {symbol} (ID: {security_id}): {status}")
         
         # Save file
         filename = f"security_id_verification_{datetime.now().strftime('%Y%m%d')}.xlsx"